@@ -32,9 +32,19 @@ setup(
         "tldextract",
         "pandas",
         "numpy",
+        "scipy",
         "tqdm",
         "unshortenit",
         "news-please",
         "waybackpy",
     ],
+    extras_require={
+        # faster parsing of fetched .jsonl files
+        "fast": ["orjson"],
+        # Parquet and Arrow IPC output
+        "arrow": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": ["urlexpander=urlexpander.cli:main"],
+    },
 )
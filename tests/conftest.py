@@ -0,0 +1,220 @@
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+import pytest
+from urlexpander.core import api, constants, url_utils
+from urlexpander.extended import extraction
+from urlexpander.extended.archive import ArchiveBackend
+
+
+class LocalServer(object):
+    """A local HTTP server which serves canned responses.
+
+    routes maps a path (including the query string) to (status, headers, body).
+    A path without a query string also matches requests with any query string.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                route = server.routes.get(self.path) or server.routes.get(
+                    self.path.split("?")[0], (404, {}, b"not found")
+                )
+                status, headers, body = route
+                if callable(body):
+                    status, headers, body = body(self)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path="/"):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    server = LocalServer()
+    yield server
+    server.close()
+
+
+def _surt(url):
+    """SURT urlkey of a URL, like the CDX server computes it"""
+    split = urllib.parse.urlsplit(url.lower())
+    host = re.sub(r"^www\d*\.", "", split.hostname)
+    if split.port not in (None, 80, 443):
+        host += f":{split.port}"
+    key = ",".join(reversed(host.split("."))) + ")" + (split.path or "/")
+    if split.query:
+        key += "?" + "&".join(sorted(split.query.split("&")))
+    return key
+
+
+class Wayback(object):
+    """A stand-in for the CDX server and the Wayback Machine on a local server."""
+
+    def __init__(self, server):
+        self.server = server
+        self.captures = []  # (original URL, timestamp, status code)
+        self.queries = []  # query parameters of each CDX request
+        self.n_failures = 0  # number of the next CDX requests which fail with a 503
+        server.routes["/cdx"] = (200, {}, self.cdx)
+
+    def capture(self, original, timestamp, status="200"):
+        self.captures.append((original, timestamp, status))
+        body = f"<html><p>{original} at {timestamp}</p></html>".encode()
+        self.server.routes[f"/web/{timestamp}/{original}"] = (200, {}, body)
+
+    def backend(self, **kwargs):
+        return ArchiveBackend(
+            cdx_url=self.server.url("/cdx"),
+            wayback_url=self.server.url("/web"),
+            **kwargs,
+        )
+
+    def cdx(self, handler):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+        self.queries.append(params)
+        if self.n_failures:
+            self.n_failures -= 1
+            return 503, {}, b"Service Unavailable"
+        filters = [f.split(":", 1) for f in params.get("filter", [])]
+        target = params["url"][0]
+        rows = []
+        for original, timestamp, status in self.captures:
+            urlkey = _surt(original)
+            if params.get("matchType") == ["domain"]:
+                host = urlkey.split(")")[0]
+                if not (host + ",").startswith(_surt("http://" + target)[:-2] + ","):
+                    continue
+            elif urlkey.rstrip("/") != _surt(target).rstrip("/"):
+                continue
+            fields = dict(
+                urlkey=urlkey, original=original, timestamp=timestamp, statuscode=status
+            )
+            if all(re.fullmatch(p, fields[field]) for field, p in filters):
+                rows.append(fields)
+        rows.sort(key=lambda r: (r["urlkey"], r["timestamp"]))
+        if "collapse" in params:
+            rows = [
+                r
+                for i, r in enumerate(rows)
+                if i == 0 or rows[i - 1]["urlkey"] != r["urlkey"]
+            ]
+        if "resumeKey" in params:
+            resume = params["resumeKey"][0]
+            rows = [r for r in rows if f"{r['urlkey']} {r['timestamp']}" > resume]
+        fl = params.get("fl", ["original,timestamp"])[0].split(",")
+        body = [fl] + [[r[field] for field in fl] for r in rows]
+        if "limit" in params:
+            limit = int(params["limit"][0])
+            body = body[: limit + 1]
+            if len(rows) > limit and params.get("showResumeKey") == ["true"]:
+                last = rows[limit - 1]
+                body += [[], [f"{last['urlkey']} {last['timestamp']}"]]
+        body = json.dumps(body).encode()
+        return 200, {"Content-Type": "application/json"}, body
+
+
+@pytest.fixture
+def wayback(local_server, no_delay):
+    yield Wayback(local_server)
+
+
+@pytest.fixture
+def no_delay(monkeypatch):
+    """Skip the politeness delay before each request."""
+    monkeypatch.setattr(constants, "MIN_DELAY", 0)
+    monkeypatch.setattr(constants, "MAX_DELAY", 0)
+
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    """Serve canned pages to the fetching functions instead of sending requests.
+    Maps a URL to its HTML."""
+    pages = {}
+
+    def fake_expand_with_content(url, timeout=10, **kwargs):
+        return dict(
+            original_url=url,
+            response_url=url,
+            resolved_url=url,
+            resolved_domain=url_utils.get_domain(url),
+            response_code=200,
+            response_reason="OK",
+            resolved_text=pages[url],
+        )
+
+    monkeypatch.setattr(api, "expand_with_content", fake_expand_with_content)
+    yield pages
+
+
+@pytest.fixture
+def fake_newsplease(monkeypatch):
+    """Replace NewsPlease with a cheap extractor which records the URLs it's called with."""
+    calls = []
+
+    class FakeArticle(object):
+        def __init__(self, maintext):
+            self.maintext = maintext
+
+    class FakeNewsPlease(object):
+        @staticmethod
+        def from_html(html, url=None, **kwargs):
+            calls.append(url)
+            return FakeArticle(f"maintext of {url}")
+
+    monkeypatch.setattr(extraction, "NewsPlease", FakeNewsPlease)
+    yield calls
+
+
+def stub_maintext(html, url):
+    return f"maintext of {url}"
+
+
+def slow_maintext(html, url):
+    if "slow" in (url or ""):
+        time.sleep(60)
+    return stub_maintext(html, url)
+
+
+@pytest.fixture
+def stub_extractor():
+    """A cheap extractor which returns the same text as the fake NewsPlease.
+    It's a top-level function, so that it can be pickled into spawned worker processes,
+    which don't inherit a monkeypatched NewsPlease."""
+    yield stub_maintext
+
+
+@pytest.fixture
+def slow_extractor():
+    """Like stub_extractor, but it hangs for 60 seconds on pages whose URL contains "slow".
+    Use a time limit of a few seconds, so that it doesn't depend on how fast the worker starts."""
+    yield slow_maintext
@@ -1,7 +1,15 @@
+import codecs
 import os
+import threading
 
 import pytest
-from urlexpander.core.api import expand, expand_with_content
+from urlexpander.core import constants
+from urlexpander.core.api import (
+    FetchCancelled,
+    decode_html,
+    expand,
+    expand_with_content,
+)
 
 
 @pytest.fixture
@@ -54,3 +62,158 @@ class TestExpandWithContent(object):
         assert isinstance(data["response_code"], int)
         assert isinstance(data["response_reason"], str)
         assert "<!DOCTYPE html>" in data["resolved_text"]
+
+
+class TestExpandWithContentHeadOnly(object):
+    def test_head_only(self, local_server, no_delay):
+        head = (
+            "<html><head><title>Preview</title>"
+            '<meta property="og:description" content="Summary">'
+            '<link rel="canonical" href="https://example.com/story"></head>'
+        )
+        body = "<body>" + "<p>paragraph</p>" * 100000 + "</body></html>"
+        local_server.routes["/story"] = (
+            200,
+            {"Content-Type": "text/html; charset=utf-8"},
+            (head + body).encode("utf-8"),
+        )
+        data = expand_with_content(local_server.url("/story"), head_only=True)
+        assert data["response_code"] == 200
+        assert head in data["resolved_text"]
+        assert len(data["resolved_text"]) < len(head + body)
+        assert data["meta"]["title"] == "Preview"
+        assert data["meta"]["description"] == "Summary"
+        assert data["meta"]["canonical_url"] == "https://example.com/story"
+
+    def test_byte_budget(self, local_server, no_delay):
+        page = "<html><head>" + "<!-- comment -->" * 100000
+        local_server.routes["/no-head-end"] = (
+            200,
+            {"Content-Type": "text/html"},
+            page.encode("utf-8"),
+        )
+        data = expand_with_content(
+            local_server.url("/no-head-end"), head_only=True, max_bytes=16384
+        )
+        assert 16384 <= len(data["resolved_text"]) < len(page)
+        assert data["meta"]["title"] is None
+
+
+class TestCancel(object):
+    def test_cancelled_before_request(self, local_server, no_delay):
+        local_server.routes["/story"] = (200, {}, b"<html></html>")
+        cancel = threading.Event()
+        cancel.set()
+        with pytest.raises(FetchCancelled):
+            expand_with_content(local_server.url("/story"), cancel=cancel)
+        assert local_server.requests == []
+
+        data = expand_with_content(local_server.url("/story"), cancel=threading.Event())
+        assert data["response_code"] == 200
+
+
+class TestConditionalRequest(object):
+    @pytest.fixture
+    def page(self, local_server, no_delay):
+        """A page which replies 304 Not Modified to a request with its current ETag."""
+        page = {"etag": '"v1"', "html": "<html><p>v1</p></html>"}
+
+        def respond(handler):
+            if handler.headers.get("If-None-Match") == page["etag"]:
+                return 304, {"ETag": page["etag"]}, b""
+            headers = {
+                "Content-Type": "text/html; charset=utf-8",
+                "ETag": page["etag"],
+                "Last-Modified": "Mon, 01 Nov 2021 00:00:00 GMT",
+            }
+            return 200, headers, page["html"].encode("utf-8")
+
+        local_server.routes["/story"] = (200, {}, respond)
+        page["url"] = local_server.url("/story")
+        yield page
+
+    def test_validators(self, page, local_server):
+        data = expand_with_content(page["url"])
+        assert data["response_code"] == 200
+        assert data["response_etag"] == '"v1"'
+        assert data["response_last_modified"] == "Mon, 01 Nov 2021 00:00:00 GMT"
+
+        validators = dict(
+            etag=data["response_etag"], last_modified=data["response_last_modified"]
+        )
+        data = expand_with_content(page["url"], validators=validators)
+        assert data["response_code"] == 304
+        assert data["resolved_text"] == ""
+        _, headers = local_server.requests[-1]
+        assert headers["If-Modified-Since"] == "Mon, 01 Nov 2021 00:00:00 GMT"
+
+    def test_modified(self, page):
+        page["etag"], page["html"] = '"v2"', "<html><p>v2</p></html>"
+        data = expand_with_content(page["url"], validators=dict(etag='"v1"'))
+        assert data["response_code"] == 200
+        assert data["resolved_text"] == "<html><p>v2</p></html>"
+
+
+class TestDecodeHtml(object):
+    def test_header_charset(self):
+        html = "<html><p>café</p></html>"
+        assert decode_html(html.encode("cp1252"), "windows-1252") == html
+        html = "<html><p>ニュース</p></html>"
+        assert decode_html(html.encode("shift_jis"), "Shift_JIS") == html
+
+    def test_meta_charset(self):
+        html = '<html><head><meta charset="koi8-r"></head><p>новости</p></html>'
+        assert decode_html(html.encode("koi8-r")) == html
+        html = (
+            '<meta http-equiv="Content-Type" content="text/html; charset=euc-kr">'
+            "<p>뉴스</p>"
+        )
+        assert decode_html(html.encode("euc-kr")) == html
+
+    def test_wrong_declaration(self):
+        html = "<html><p>café</p></html>"
+        # pages which are actually UTF-8 are often declared as Latin-1
+        assert decode_html(html.encode("utf-8"), "iso-8859-1") == html
+        # a charset which can't decode the HTML is skipped
+        assert decode_html(html.encode("utf-8"), "ascii") == html
+        assert decode_html(html.encode("utf-8"), "no-such-charset") == html
+
+    def test_undeclared(self, monkeypatch):
+        import cchardet
+
+        html = "<html><p>" + "das Bücherregal " * 10000 + "</p></html>"
+        assert decode_html(html.encode("utf-8")) == html
+        assert decode_html(codecs.BOM_UTF8 + html.encode("utf-8")) == html
+
+        detected = []
+
+        def detect(content):
+            detected.append(len(content))
+            return dict(encoding="windows-1252", confidence=0.9)
+
+        monkeypatch.setattr(cchardet, "detect", detect)
+        assert decode_html(html.encode("cp1252")) == html
+        # the charset is guessed from a prefix of the HTML
+        assert detected == [constants.CHARSET_DETECT_BYTES]
+
+    def test_empty(self):
+        assert decode_html(b"", "utf-8") == ""
+
+
+class TestExpandWithContentRaw(object):
+    def test_raw(self, local_server, no_delay):
+        html = "<html><p>café</p></html>"
+        local_server.routes["/story"] = (
+            200,
+            {"Content-Type": "text/html; charset=ISO-8859-1"},
+            html.encode("iso-8859-1"),
+        )
+        data = expand_with_content(local_server.url("/story"))
+        assert data["resolved_text"] == html
+        assert "resolved_content" not in data
+
+        data = expand_with_content(local_server.url("/story"), decode_text=False)
+        assert data["resolved_text"] == ""
+        assert data["resolved_content"] == html.encode("iso-8859-1")
+        assert data["resolved_charset"] == "ISO-8859-1"
+        assert decode_html(data["resolved_content"], data["resolved_charset"]) == html
@@ -0,0 +1,112 @@
+import pytest
+from urlexpander.core.html_utils import (
+    HeadMetaParser,
+    search_webpage_canonical_url,
+    search_webpage_maintext,
+    search_webpage_meta,
+)
+
+
+@pytest.fixture
+def page():
+    page = """<!DOCTYPE html>
+<html><head>
+<meta charset="utf-8">
+<title>  Small business endorses Shuster &amp; co </title>
+<meta name="description" content="plain description">
+<meta content="OG description" property="og:description" />
+<meta property="og:image" content="https://example.com/img.jpg">
+<meta property="og:url" content="https://example.com/story">
+<link rel="canonical" href="https://example.com/story?page=1">
+<meta property="article:published_time" content="2021-11-05T23:25:15Z">
+<meta name="author" content="Jane Doe">
+<script>var s = "<title>not the title</title>";</script>
+</head>
+<body><meta property="og:title" content="ignored"><p>Text</p></body></html>
+"""
+    yield page
+
+
+class TestHeadMetaParser(object):
+    def test_meta(self, page):
+        meta = search_webpage_meta("https://example.com", page)
+        assert meta == dict(
+            url="https://example.com",
+            title="Small business endorses Shuster & co",
+            description="OG description",
+            image_url="https://example.com/img.jpg",
+            og_url="https://example.com/story",
+            published_time="2021-11-05T23:25:15Z",
+            author="Jane Doe",
+            canonical_url="https://example.com/story?page=1",
+        )
+
+    def test_chunks(self, page):
+        parser = HeadMetaParser()
+        chunks = [page[i : i + 7] for i in range(0, len(page), 7)]
+        fed = 0
+        for chunk in chunks:
+            fed += 1
+            if parser.feed(chunk):
+                break
+        assert fed < len(chunks)
+        assert parser.meta == {
+            k: v for k, v in search_webpage_meta("", page).items() if k != "url"
+        }
+
+    def test_stops_at_body(self):
+        parser = HeadMetaParser()
+        assert parser.feed("<html><title>t</title><body><title>x</title>")
+        assert parser.meta["title"] == "t"
+
+    def test_empty(self):
+        meta = search_webpage_meta("https://example.com", "")
+        assert meta["title"] is None
+        assert meta["canonical_url"] is None
+
+
+class TestSearchWebpageCanonicalUrl(object):
+    def test_canonical(self, page):
+        assert search_webpage_canonical_url(page) == "https://example.com/story?page=1"
+
+    def test_og_url(self):
+        page = '<head><meta property="og:url" content="https://example.com/a"></head>'
+        assert search_webpage_canonical_url(page) == "https://example.com/a"
+        assert search_webpage_canonical_url("") is None
+
+
+class TestSearchWebpageMaintext(object):
+    @pytest.fixture
+    def article(self):
+        article = """<html><head><script>var p = "<p>not text</p>";</script></head><body>
+<nav><p>Home | World | Politics | Business | Opinion</p></nav>
+<div id="main"><h1>Headline</h1>
+<div class="story-body">
+<p>The first paragraph of the story, with an &amp; in it.</p>
+<p>The second   paragraph has a <a href="/link">link</a> in it.
+<p>The third paragraph isn't closed.
+</div>
+<div class="related"><p><a href="/1">A related story with a long headline</a></p></div>
+</div>
+<footer><p>Copyright 2021, all rights reserved by the publisher of this story</p></footer>
+</body></html>"""
+        yield article
+
+    def test_maintext(self, article):
+        assert search_webpage_maintext(article) == "\n".join(
+            [
+                "The first paragraph of the story, with an & in it.",
+                "The second paragraph has a link in it.",
+                "The third paragraph isn't closed.",
+            ]
+        )
+
+    def test_split_body(self):
+        """The paragraphs of an article split across sibling containers are kept together."""
+        paragraphs = [f"Paragraph number {i} of the article." for i in range(6)]
+        article = "<div>" + "".join(f"<div><p>{p}</p></div>" for p in paragraphs)
+        assert search_webpage_maintext(article + "</div>") == "\n".join(paragraphs)
+
+    def test_empty(self):
+        assert search_webpage_maintext("") == ""
+        assert search_webpage_maintext("<html><body>no paragraphs</body></html>") == ""
@@ -0,0 +1,253 @@
+import collections
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from urlexpander.core import tweet_utils
+from urlexpander.core.tweet_utils import (
+    DomainCountAccumulator,
+    _get_domain,
+    _get_full_text,
+    count_matrix,
+    get_link,
+    links_from_jsonl,
+    sparse_count_matrix,
+)
+
+
+def _tweet(i, urls, retweeted_urls=None, quoted_urls=None):
+    tweet = {
+        "id": 1000 + i,
+        "user": {"id": i % 3},
+        "created_at": "Mon Nov 01 00:00:00 +0000 2021",
+        "full_text": f"tweet {i}",
+        "entities": {
+            "urls": [{"url": "https://t.co/x", "expanded_url": u} for u in urls]
+        },
+    }
+    if retweeted_urls is not None:
+        tweet["retweeted_status"] = {
+            "entities": {"urls": [{"expanded_url": u} for u in retweeted_urls]}
+        }
+    if quoted_urls is not None:
+        tweet["quoted_status"] = {
+            "entities": {"urls": [{"expanded_url": u} for u in quoted_urls]}
+        }
+    return tweet
+
+
+@pytest.fixture
+def tweets():
+    tweets = []
+    for i in range(30):
+        tweets.append(
+            _tweet(
+                i,
+                [f"https://www.nytimes.com/{i}", f"https://m.foxnews.com/{i}"],
+                retweeted_urls=["http://cnn.com/rt"] if i % 2 else None,
+                quoted_urls=[None] if i % 5 == 0 else None,
+            )
+        )
+    yield tweets
+
+
+@pytest.fixture
+def tweets_file(tweets, tmpdir):
+    file = str(tmpdir.join("tweets.jsonl"))
+    with open(file, "w", encoding="utf-8") as f:
+        for tweet in tweets:
+            f.write(json.dumps(tweet) + "\n")
+        f.write("not a tweet\n")
+        f.write(json.dumps({"limit": {"track": 1}}) + "\n")
+    yield file
+
+
+class TestGetLink(object):
+    def test_links(self, tweets):
+        links = list(get_link(tweets[1]))
+        assert [(r["tweet_type"], r["link_domain"]) for r in links] == [
+            ("OG", "nytimes.com"),
+            ("OG", "foxnews.com"),
+            ("RT", "cnn.com"),
+        ]
+        assert links[0]["tweet_text"] == "tweet 1"
+
+    def test_full_text(self):
+        assert _get_full_text({"full_text": "full", "text": "short"}) == "full"
+        assert _get_full_text({"text": "short"}) == "short"
+
+
+class TestLinksFromJsonl(object):
+    @pytest.mark.parametrize("n_processes", [1, 2])
+    def test_same_as_get_link(self, tweets, tweets_file, n_processes):
+        batches = list(
+            links_from_jsonl(tweets_file, n_processes=n_processes, chunk_bytes=2048)
+        )
+        assert len(batches) > 1
+        rows = [
+            r
+            for df in batches
+            for r in df.astype(object).where(df.notna(), None).to_dict("records")
+        ]
+        assert rows == [r for tweet in tweets for r in get_link(tweet)]
+
+    def test_arrow(self, tweets, tweets_file):
+        pytest.importorskip("pyarrow")
+        (table,) = links_from_jsonl([tweets_file], output="arrow", include_text=False)
+        assert "tweet_text" not in table.column_names
+        assert table.num_rows == sum(len(list(get_link(t))) for t in tweets)
+
+
+class TestGetDomain(object):
+    def test_bounded(self, monkeypatch):
+        monkeypatch.setattr(tweet_utils, "DOMAIN_INDEX_SIZE", 2)
+        monkeypatch.setattr(tweet_utils, "_domain_index", collections.OrderedDict())
+        assert _get_domain("https://www.a.com/1") == "a.com"
+        assert _get_domain("https://b.com/1") == "b.com"
+        assert _get_domain("https://www.a.com/2") == "a.com"
+        assert _get_domain("https://c.com/1") == "c.com"
+        # the least recently used network location is dropped
+        assert list(tweet_utils._domain_index) == ["www.a.com", "c.com"]
+
+    def test_threads(self, monkeypatch):
+        monkeypatch.setattr(tweet_utils, "DOMAIN_INDEX_SIZE", 8)
+        monkeypatch.setattr(tweet_utils, "_domain_index", collections.OrderedDict())
+        urls = [f"https://site{i % 20}.com/{i}" for i in range(2000)]
+        with ThreadPoolExecutor(8) as executor:
+            domains = list(executor.map(_get_domain, urls))
+        assert domains == [f"site{i % 20}.com" for i in range(2000)]
+        assert len(tweet_utils._domain_index) <= 8
+
+
+@pytest.fixture
+def links():
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    n = 2000
+    domains = np.array([f"site{i}.com" for i in range(30)])
+    links = pd.DataFrame(
+        dict(
+            user_id=rng.integers(0, 200, n),
+            link_domain=domains[rng.zipf(1.5, n) % 30],
+            tweet_id=rng.integers(0, 500, n),
+        )
+    )
+    yield links
+
+
+def _pivot_count_matrix(df, normalize=False, min_freq=None, domain_list=[], exclude=[]):
+    """count_matrix() as it was implemented with a pivot table"""
+    if domain_list:
+        df = df[df["link_domain"].isin(domain_list)]
+    if exclude:
+        df = df[~df["link_domain"].isin(exclude)]
+    all_domains = df["link_domain"].unique()
+    matrix = df.pivot_table(
+        index="user_id",
+        columns=["link_domain"],
+        values=["tweet_id"],
+        aggfunc=lambda x: len(x.unique()),
+        fill_value=0,
+    )
+    matrix = matrix.T.reset_index(level=0, drop=True).T
+    matrix.columns.name = None
+    if domain_list:
+        matrix = matrix[[c for c in all_domains if c in domain_list]]
+    if exclude:
+        matrix = matrix[[c for c in all_domains if c not in exclude]]
+    if min_freq:
+        matrix = matrix[matrix.columns[matrix.sum() > min_freq]]
+    if normalize:
+        matrix = matrix.div(matrix.sum(axis=1), axis=0)
+    return matrix
+
+
+class TestCountMatrix(object):
+    @pytest.mark.parametrize(
+        "options",
+        [
+            {},
+            dict(min_freq=20),
+            dict(normalize=True, min_freq=50),
+            dict(domain_list=["site3.com", "site1.com", "site2.com"]),
+            dict(exclude=["site1.com", "site4.com"]),
+        ],
+    )
+    def test_same_as_pivot(self, links, options):
+        import pandas as pd
+
+        expected = _pivot_count_matrix(links, **options)
+        if "exclude" in options:
+            options["exclude_domain_list"] = options.pop("exclude")
+        matrix = count_matrix(links, **options)
+        pd.testing.assert_frame_equal(matrix, expected, check_dtype=False)
+
+    def test_sparse(self, links):
+        import numpy as np
+
+        matrix, users, domains = sparse_count_matrix(links, min_freq=20)
+        expected = _pivot_count_matrix(links, min_freq=20)
+        assert matrix.format == "csr"
+        assert list(users) == list(expected.index)
+        assert list(domains) == list(expected.columns)
+        np.testing.assert_array_equal(matrix.toarray(), expected.to_numpy())
+
+        df = sparse_count_matrix(links, normalize=True, as_dataframe=True)
+        assert df.sparse.density < 1
+        np.testing.assert_allclose(df.sum(axis=1), 1)
+
+    def test_missing_column(self, links):
+        with pytest.raises(ValueError):
+            count_matrix(links, unique_count_col="retweet_id")
+
+
+class TestDomainCountAccumulator(object):
+    @pytest.mark.parametrize(
+        "options",
+        [
+            {},
+            dict(min_freq=20, normalize=True),
+            dict(domain_list=["site3.com", "site1.com", "site2.com"]),
+            dict(exclude_domain_list=["site1.com", "site4.com"]),
+        ],
+    )
+    def test_same_as_count_matrix(self, links, options):
+        import pandas as pd
+
+        accumulator = DomainCountAccumulator()
+        for start in range(0, len(links), 300):
+            accumulator.update(links.iloc[start : start + 300])
+        pd.testing.assert_frame_equal(
+            accumulator.count_matrix(**options), count_matrix(links, **options)
+        )
+
+    def test_dedup(self, links):
+        accumulator = DomainCountAccumulator()
+        n_unique = len(links.drop_duplicates())
+        assert accumulator.update(links) == n_unique
+        # ingesting the same links again doesn't change the counts
+        assert accumulator.update(links.to_dict("records")) == 0
+        assert len(accumulator) == n_unique
+
+    def test_merge(self, links):
+        import numpy as np
+
+        shards = [DomainCountAccumulator() for _ in range(3)]
+        for i, shard in enumerate(shards):
+            # the shards overlap
+            shard.update(links.iloc[i * 600 : i * 600 + 800])
+        shards = [pickle.loads(pickle.dumps(shard)) for shard in shards]
+        merged = shards[0].merge(shards[1]).merge(shards[2])
+
+        matrix, users, domains = merged.sparse_count_matrix()
+        expected, expected_users, expected_domains = sparse_count_matrix(links)
+        assert list(users) == list(expected_users)
+        assert list(domains) == list(expected_domains)
+        np.testing.assert_array_equal(matrix.toarray(), expected.toarray())
+
+    def test_merge_fields(self):
+        with pytest.raises(ValueError):
+            DomainCountAccumulator().merge(DomainCountAccumulator(user_col="author"))
@@ -0,0 +1,126 @@
+import pickle
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+from urlexpander.core.url_rules import DomainRules
+from urlexpander.core.url_utils import standardize_url, standardize_urls
+
+
+@pytest.fixture
+def urls():
+    urls = [
+        "https://www.breitbart.com/radio/2017/08/15/raheem-kassam/?utm_source=feedburner&utm_medium=feed",
+        "https://www.CNN.com/2021/10/05/us/index.html#section",
+        "https://www.breitbart.com/radio/2017/08/15/raheem-kassam/?utm_source=feedburner&utm_medium=feed",
+        "not a url",
+    ]
+    yield urls
+
+
+class TestStandardizeUrls(object):
+    def test_list(self, urls):
+        assert standardize_urls(urls) == [standardize_url(url) for url in urls]
+
+    def test_options(self, urls):
+        assert standardize_urls(urls, remove_path=True) == [
+            standardize_url(url, remove_path=True) for url in urls
+        ]
+
+    def test_series(self, urls):
+        series = pd.Series(urls + [None], index=list("abcde"), name="resolved_url")
+        standardized = standardize_urls(series)
+        assert standardized.index.tolist() == list("abcde")
+        assert standardized.name == "resolved_url"
+        assert standardized.tolist() == [standardize_url(url) for url in urls] + [
+            "ERROR"
+        ]
+
+    def test_file(self, urls, tmpdir):
+        path = tmpdir.join("urls.txt")
+        path.write("\n".join(urls) + "\n")
+        standardized = standardize_urls(str(path), batchsize=3)
+        assert list(standardized) == [standardize_url(url) for url in urls]
+
+    def test_file_blank_lines(self, urls, tmpdir):
+        path = tmpdir.join("urls.txt")
+        path.write(urls[0] + "\n\n" + urls[1] + "\n")
+        standardized = list(standardize_urls(str(path)))
+        assert standardized == [standardize_url(urls[0]), "", standardize_url(urls[1])]
+
+    def test_list_without_pandas(self, urls):
+        code = (
+            "import sys; from urlexpander.core.url_utils import standardize_urls; "
+            f"standardize_urls({urls!r}); assert 'pandas' not in sys.modules"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_processes(self, urls):
+        many_urls = urls * 50
+        assert standardize_urls(many_urls, n_processes=2, chunksize=1) == [
+            standardize_url(url) for url in many_urls
+        ]
+
+
+class TestDomainRules(object):
+    def test_params(self):
+        rules = DomainRules()
+        rules.register(
+            "newsmax.com",
+            params=["dkt_nbr"],
+            param_prefixes=["trk_"],
+            param_globs=["ref_*_id"],
+        )
+        url = "https://www.newsmax.com/politics/story/id/1/?dkt_nbr=abc&trk_src=x&ref_tw_id=2&page=2"
+        assert (
+            standardize_url(url, domain_rules=rules)
+            == "www.newsmax.com/politics/story/id/1/?page=2"
+        )
+
+    def test_subdomain_only(self):
+        rules = DomainRules([{"domain": "newsmax.com", "params": ["page"]}])
+        url = "https://www.example.com/story?page=2"
+        assert (
+            standardize_url(url, domain_rules=rules) == "www.example.com/story?page=2"
+        )
+
+    def test_path_rewrite_and_host_alias(self):
+        rules = DomainRules()
+        rules.register("nypost.com", path_rewrites=[("/amp/?$", "/")])
+        rules.register("foxnews.com", host_aliases={"m.foxnews.com": "www.foxnews.com"})
+        assert (
+            standardize_url(
+                "https://nypost.com/2021/11/05/story/amp/", domain_rules=rules
+            )
+            == "nypost.com/2021/11/05/story"
+        )
+        assert (
+            standardize_url("https://m.foxnews.com/politics/story", domain_rules=rules)
+            == "www.foxnews.com/politics/story"
+        )
+
+    def test_google_amp(self):
+        url = "https://www.google.com/amp/s/nypost.com/2021/11/05/story/amp/"
+        assert standardize_url(url) == "nypost.com/2021/11/05/story"
+        assert standardize_url(url, replace_netloc_with_domain=True) == (
+            "nypost.com/2021/11/05/story"
+        )
+        assert standardize_url(url, remove_scheme=False) == (
+            "https://nypost.com/2021/11/05/story"
+        )
+
+    def test_disabled(self):
+        url = "https://www.newsmax.com/story/?dkt_nbr=abc"
+        assert standardize_url(url) == "www.newsmax.com/story"
+        assert (
+            standardize_url(url, domain_rules=None)
+            == "www.newsmax.com/story/?dkt_nbr=abc"
+        )
+
+    def test_pickle(self):
+        rules = DomainRules([{"domain": "newsmax.com", "params": ["dkt_nbr"]}])
+        rules.compile()
+        restored = pickle.loads(pickle.dumps(rules))
+        url = "https://www.newsmax.com/story/?dkt_nbr=abc"
+        assert standardize_url(url, domain_rules=restored) == "www.newsmax.com/story"
@@ -0,0 +1,191 @@
+import json
+
+import pytest
+from urlexpander.extended import news_api
+from urlexpander.extended.archive import NoSnapshotError
+
+
+class TestArchiveBackend(object):
+    def test_batched_lookup(self, wayback):
+        wayback.capture("https://www.cnn.com/a", "20200101000000")
+        wayback.capture("http://cnn.com/a/", "20190101000000")
+        wayback.capture("https://www.cnn.com/b", "20200101000000", status="301")
+        wayback.capture("https://www.cnn.com/c", "20210101000000")
+        wayback.capture("https://www.foxnews.com/a", "20200101000000")
+        backend = wayback.backend()
+
+        urls = [
+            "https://www.cnn.com/a",
+            "https://www.cnn.com/b",
+            "https://www.cnn.com/c",
+            "https://www.cnn.com/d",
+            "https://www.foxnews.com/a",
+        ]
+        assert backend.prefetch(urls) == 5
+        # one query for the cnn.com batch, and one for the single foxnews.com URL
+        assert [q["url"][0] for q in wayback.queries] == [
+            "cnn.com",
+            "https://www.foxnews.com/a",
+        ]
+        assert wayback.queries[0]["matchType"] == ["domain"]
+
+        assert backend.lookup(urls[0]) == ("20190101000000", "http://cnn.com/a/")
+        assert backend.lookup(urls[1]) is None
+        assert backend.lookup(urls[2]) == ("20210101000000", "https://www.cnn.com/c")
+        assert backend.lookup(urls[3]) is None
+        assert backend.lookup(urls[4]) == (
+            "20200101000000",
+            "https://www.foxnews.com/a",
+        )
+        # everything was cached, including the URLs without a snapshot
+        assert backend.prefetch(urls) == 0
+        assert len(wayback.queries) == 2
+
+    def test_batch_size(self, wayback):
+        for i in range(5):
+            wayback.capture(f"https://cnn.com/{i}", "20200101000000")
+        backend = wayback.backend(batch_size=2)
+        backend.prefetch([f"https://cnn.com/{i}" for i in range(5)])
+        assert len(wayback.queries) == 3
+
+    def test_canonical_match(self, wayback):
+        # the capture's URL is spelled differently from the looked up URL
+        wayback.capture("http://example.com:80/a?page=2&id=5", "20200101000000")
+        wayback.capture("https://example.com/b", "20200101000000")
+        backend = wayback.backend()
+        backend.prefetch(
+            ["https://www.example.com/a?id=5&page=2", "https://example.com/b"]
+        )
+        assert backend.lookup("https://www.example.com/a?id=5&page=2") == (
+            "20200101000000",
+            "http://example.com:80/a?page=2&id=5",
+        )
+        # both were found by the batched query
+        assert len(wayback.queries) == 1
+
+    def test_paging(self, wayback):
+        urls = [f"https://cnn.com/{i}" for i in range(5)]
+        for url in urls:
+            wayback.capture(url, "20200101000000")
+            wayback.capture(url, "20210101000000")
+        backend = wayback.backend(page_size=2)
+        backend.prefetch(urls)
+        assert all(q["url"] == ["cnn.com"] for q in wayback.queries)
+        assert len(wayback.queries) == 3
+        assert [backend.lookup(url)[0] for url in urls] == ["20200101000000"] * 5
+
+    def test_ambiguous_checked_exactly(self, wayback, monkeypatch):
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        wayback.capture("https://cnn.com/b%20c", "20200101000000")
+        backend = wayback.backend()
+        # the batched query misses the snapshots, e.g. because they're canonicalized differently
+        monkeypatch.setattr(
+            "urlexpander.extended.archive._urlkey_pattern", lambda keys: "nothing"
+        )
+        backend.prefetch(["https://cnn.com/a", "https://cnn.com/b%20c"])
+        # only the URL with a percent-encoded character is looked up on its own
+        assert len(wayback.queries) == 2
+        assert backend.lookup("https://cnn.com/a") is None
+        assert backend.lookup("https://cnn.com/b%20c") is not None
+
+    def test_failed_batch(self, wayback):
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        backend = wayback.backend()
+        wayback.n_failures = 1
+        assert backend.prefetch(["https://cnn.com/a", "https://cnn.com/b"]) == 0
+        # the failed batch wasn't cached, so each URL is looked up on its own
+        assert backend.lookup("https://cnn.com/a") == (
+            "20200101000000",
+            "https://cnn.com/a",
+        )
+        assert backend.lookup("https://cnn.com/b") is None
+        assert len(wayback.queries) == 3
+
+    def test_persistent_cache(self, wayback, tmpdir):
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        cache_path = str(tmpdir.join("archive.jsonl"))
+        backend = wayback.backend(cache_path=cache_path)
+        backend.prefetch(["https://cnn.com/a", "https://cnn.com/missing"])
+
+        backend = wayback.backend(cache_path=cache_path)
+        assert backend.lookup("https://cnn.com/a") == (
+            "20200101000000",
+            "https://cnn.com/a",
+        )
+        assert backend.lookup("https://cnn.com/missing") is None
+        assert len(wayback.queries) == 1
+
+    def test_missing_ttl(self, wayback):
+        backend = wayback.backend(missing_ttl=0)
+        assert backend.lookup("https://cnn.com/a") is None
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        assert backend.lookup("https://cnn.com/a") is not None
+
+    def test_get(self, wayback):
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        backend = wayback.backend()
+        archive_url, original, html = backend.get("https://cnn.com/a")
+        assert archive_url == wayback.server.url(
+            "/web/20200101000000/https://cnn.com/a"
+        )
+        assert original == "https://cnn.com/a"
+        assert "https://cnn.com/a at 20200101000000" in html
+        with pytest.raises(NoSnapshotError):
+            backend.get("https://cnn.com/missing")
+
+
+class TestArchivedUrlWithBackend(object):
+    def test_request_archived_url(self, wayback, fake_newsplease):
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        backend = wayback.backend()
+        nc = json.loads(
+            news_api.request_archived_url(
+                "https://cnn.com/a?utm_source=x", archive_backend=backend
+            )
+        )
+        assert nc["resolved_url"] == "https://cnn.com/a"
+        assert nc["resolved_domain"] == "cnn.com"
+        assert nc["fetch_error"] is False
+        assert nc["article_maintext"] == "maintext of https://cnn.com/a"
+
+        nc = json.loads(
+            news_api.request_archived_url(
+                "https://cnn.com/missing", archive_backend=backend
+            )
+        )
+        assert nc["fetch_error"] is True
+        assert nc["response_reason"] == "NoSnapshotError, no archived snapshot"
+
+    def test_fetch_urls_batches_lookups(self, wayback, fake_newsplease):
+        for i in range(3):
+            wayback.capture(f"https://cnn.com/{i}", "20200101000000")
+        url_dicts = [{"url": f"https://cnn.com/{i}", "n": i} for i in range(4)]
+        fetched = [
+            json.loads(r)
+            for r in news_api.fetch_urls(
+                url_dicts,
+                fetch_function=news_api.request_archived_url,
+                verbose=0,
+                archive_backend=wayback.backend(),
+            )
+        ]
+        assert [r["fetch_error"] for r in fetched] == [False, False, False, True]
+        assert len(wayback.queries) == 1
+
+    def test_fetch_urls_cdx_down(self, wayback, fake_newsplease):
+        wayback.n_failures = 100
+        url_dicts = [{"url": f"https://cnn.com/{i}"} for i in range(3)]
+        fetched = [
+            json.loads(r)
+            for r in news_api.fetch_urls(
+                url_dicts,
+                fetch_function=news_api.request_archived_url,
+                verbose=0,
+                archive_backend=wayback.backend(),
+            )
+        ]
+        # each URL gets its own error record instead of the run failing
+        assert [r["fetch_error"] for r in fetched] == [True] * 3
+        assert all("503" in r["response_reason"] for r in fetched)
+        # the batched query, and one query for each URL
+        assert len(wayback.queries) == 4
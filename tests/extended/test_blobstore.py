@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+from urlexpander.extended import extraction
+from urlexpander.extended.blobstore import BlobStore, text_hash
+from urlexpander.extended.news_api import (
+    fetch_urls,
+    fetch_urls_to_file,
+    load_fetched_from_file,
+    request_active_url,
+)
+
+
+@pytest.fixture
+def store(tmpdir):
+    yield BlobStore(str(tmpdir.join("store")))
+
+
+@pytest.fixture
+def syndicated(fake_pages):
+    """Three URLs which resolve to the same page and one which doesn't."""
+    html = "<html><p>the same story</p></html>"
+    url_dicts = []
+    for i in range(3):
+        url = f"https://example.com/copy-{i}"
+        fake_pages[url] = html
+        url_dicts.append({"url": url})
+    fake_pages["https://example.com/other"] = "<html><p>another story</p></html>"
+    url_dicts.append({"url": "https://example.com/other"})
+    yield url_dicts
+
+
+class TestBlobStore(object):
+    def test_put_get(self, store):
+        html = "<html>café</html>"
+        key = store.put(html)
+        assert key == text_hash(html)
+        assert key in store
+        assert store.get(key) == html
+        assert store.put(html) == key
+        with pytest.raises(KeyError):
+            store.get(text_hash("missing"))
+
+    def test_results(self, store):
+        key = store.put("<html></html>")
+        assert store.get_result(key) is None
+        store.put_result(key, {"article_maintext": None})
+        assert store.get_result(key) == {"article_maintext": None}
+        assert store.get_result(key, name="other") is None
+
+
+class TestFetchWithBlobStore(object):
+    def test_dedup(self, syndicated, store, fake_newsplease):
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                syndicated,
+                fetch_function=request_active_url,
+                verbose=0,
+                blob_store=store,
+            )
+        ]
+        assert [r["resolved_text"] for r in fetched] == [""] * 4
+        hashes = [r["resolved_text_hash"] for r in fetched]
+        assert len(set(hashes[:3])) == 1 and hashes[3] != hashes[0]
+        assert store.get(hashes[0]) == "<html><p>the same story</p></html>"
+        # NewsPlease ran once per distinct page
+        assert fake_newsplease == [
+            "https://example.com/copy-0",
+            "https://example.com/other",
+        ]
+        assert (
+            fetched[2]["article_maintext"] == "maintext of https://example.com/copy-0"
+        )
+        n_blobs = sum(len(files) for _, _, files in os.walk(store.root))
+        assert n_blobs == 4  # two pages and their two results
+
+        # the results are memoized across runs
+        list(
+            fetch_urls(
+                syndicated,
+                fetch_function=request_active_url,
+                verbose=0,
+                blob_store=store,
+            )
+        )
+        assert len(fake_newsplease) == 2
+
+    def test_pipeline(self, syndicated, store, stub_extractor):
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                syndicated,
+                fetch_function=request_active_url,
+                verbose=0,
+                blob_store=store,
+                n_extract_processes=1,
+                extractor=stub_extractor,
+            )
+        ]
+        assert [r["resolved_text"] for r in fetched] == [""] * 4
+        for r, d in zip(fetched, syndicated):
+            assert r["article_maintext"].startswith("maintext of ")
+            assert (
+                store.get_result(r["resolved_text_hash"], name="stub_maintext")
+                is not None
+            )
+
+    def test_deferred(self, syndicated, store, fake_newsplease, tmpdir):
+        fetch_urls_to_file(
+            syndicated,
+            fetch_function=request_active_url,
+            path=tmpdir,
+            verbose=0,
+            blob_store=store,
+            defer_extraction=True,
+        )
+        extraction.extract_maintext(tmpdir, "fetched.jsonl", blob_store=store)
+        fetched = [
+            json.loads(r)
+            for r in load_fetched_from_file(tmpdir, "fetched-extracted.jsonl")
+        ]
+        assert [r["maintext_status"] for r in fetched] == ["extracted"] * 4
+        assert [r["resolved_text_encoding"] for r in fetched] == [""] * 4
+        assert len(fake_newsplease) == 2
+
+    def test_deferred_without_store(self, syndicated, store, fake_newsplease, tmpdir):
+        fetch_urls_to_file(
+            syndicated,
+            fetch_function=request_active_url,
+            path=tmpdir,
+            verbose=0,
+            blob_store=store,
+            defer_extraction=True,
+        )
+        with pytest.raises(ValueError):
+            extraction.extract_maintext(tmpdir, "fetched.jsonl")
+        assert fake_newsplease == []
+        # the run can be resumed with the store
+        extraction.extract_maintext(tmpdir, "fetched.jsonl", blob_store=store)
+        fetched = [
+            json.loads(r)
+            for r in load_fetched_from_file(tmpdir, "fetched-extracted.jsonl")
+        ]
+        assert [r["maintext_status"] for r in fetched] == ["extracted"] * 4
@@ -0,0 +1,256 @@
+import json
+import os
+import time
+
+import pytest
+from urlexpander.extended import extraction
+from urlexpander.extended.extraction import (
+    FALLBACK_MIN_LENGTH,
+    ExtractionCrashed,
+    ExtractionTimeout,
+    auto_maintext,
+    compress_text,
+    decompress_text,
+    extract_maintext,
+    fast_maintext,
+    select_extractor,
+    timed_maintext,
+)
+from urlexpander.extended.news_api import NewsContent
+
+
+def _deferred(n):
+    records = []
+    for i in range(n):
+        nc = NewsContent(
+            f"https://example.com/{i}", FETCH_FUNCTION="request_active_url", n=i
+        )
+        nc.resolved_url = nc.original_url
+        nc.resolved_domain = "cnn.com" if i % 2 else "foxnews.com"
+        nc.resolved_text = f"<html><p>story {i}</p></html>"
+        nc.defer_article_maintext()
+        records.append(nc.to_json())
+    return records
+
+
+def crash(html, url):
+    os._exit(1)
+
+
+def fallback_min_length(html, url):
+    return extraction.FALLBACK_MIN_LENGTH
+
+
+def _write(path, filename, lines):
+    with open(os.path.join(path, filename), "w", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def _read(path, filename):
+    with open(os.path.join(path, filename), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def is_cnn(record):
+    return record["resolved_domain"] == "cnn.com"
+
+
+class TestCompressText(object):
+    def test_round_trip(self):
+        html = "<html><p>café ☕</p></html>" * 100
+        compressed = compress_text(html)
+        assert len(compressed) < len(html)
+        assert decompress_text(compressed, "zlib+base64") == html
+        assert decompress_text(html, "") == html
+
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            decompress_text("", "gzip")
+
+    def test_defer(self):
+        nc = NewsContent("https://example.com", FETCH_FUNCTION="request_active_url")
+        nc.resolved_text = "<html></html>"
+        nc.defer_article_maintext()
+        assert nc.maintext_status == "deferred"
+        assert nc.resolved_text_encoding == "zlib+base64"
+        assert decompress_text(nc.resolved_text, "zlib+base64") == "<html></html>"
+
+
+class TestExtractMaintext(object):
+    def test_extract(self, tmpdir, fake_newsplease):
+        _write(tmpdir, "fetched.jsonl", _deferred(5))
+        assert extract_maintext(tmpdir, "fetched.jsonl", batch_size=2) == 5
+        records = _read(tmpdir, "fetched-extracted.jsonl")
+        assert [r["n"] for r in records] == list(range(5))
+        for r in records:
+            assert r["article_maintext"] == f"maintext of {r['original_url']}"
+            assert r["maintext_status"] == "extracted"
+            assert r["resolved_text_encoding"] == "zlib+base64"
+
+    def test_filter(self, tmpdir, fake_newsplease):
+        lines = _deferred(4)
+        _write(tmpdir, "fetched.jsonl", lines)
+        extract_maintext(tmpdir, "fetched.jsonl", "out.jsonl", filter_function=is_cnn)
+        records = _read(tmpdir, "out.jsonl")
+        assert [r["maintext_status"] for r in records] == [
+            "deferred",
+            "extracted",
+        ] * 2
+        # filtered out records are copied unchanged
+        assert json.loads(lines[0]) == records[0]
+
+    def test_resume(self, tmpdir, fake_newsplease):
+        _write(tmpdir, "fetched.jsonl", _deferred(5))
+        extract_maintext(tmpdir, "fetched.jsonl", "out.jsonl")
+        with open(os.path.join(tmpdir, "out.jsonl"), "rb") as f:
+            done = f.readlines()
+        # a crash left two records and part of a third
+        with open(os.path.join(tmpdir, "out.jsonl"), "wb") as f:
+            f.write(b"".join(done[:2]) + done[2][:10])
+
+        del fake_newsplease[:]
+        assert extract_maintext(tmpdir, "fetched.jsonl", "out.jsonl") == 5
+        assert fake_newsplease == [f"https://example.com/{i}" for i in range(2, 5)]
+        assert [r["n"] for r in _read(tmpdir, "out.jsonl")] == list(range(5))
+
+    def test_processes(self, tmpdir, stub_extractor):
+        """The worker processes are spawned, so they extract with a picklable stub."""
+        _write(tmpdir, "fetched.jsonl", _deferred(9))
+        extract_maintext(
+            tmpdir,
+            "fetched.jsonl",
+            n_processes=2,
+            batch_size=2,
+            filter_function=is_cnn,
+            extractor=stub_extractor,
+        )
+        records = _read(tmpdir, "fetched-extracted.jsonl")
+        assert [r["n"] for r in records] == list(range(9))
+        for r in records:
+            if is_cnn(r):
+                assert r["article_maintext"] == f"maintext of {r['original_url']}"
+            else:
+                assert r["maintext_status"] == "deferred"
+
+
+class TestTimedMaintext(object):
+    def test_timeout(self, slow_extractor):
+        start = time.monotonic()
+        with pytest.raises(ExtractionTimeout):
+            timed_maintext(
+                "<html></html>",
+                "https://example.com/slow",
+                timeout=5,
+                extractor=slow_extractor,
+            )
+        # the worker was killed before the extractor returned
+        assert time.monotonic() - start < 60
+        # the killed worker is replaced
+        maintext = timed_maintext(
+            "<html></html>",
+            "https://example.com/",
+            timeout=10,
+            extractor=slow_extractor,
+        )
+        assert maintext == "maintext of https://example.com/"
+
+    def test_crash(self, slow_extractor):
+        with pytest.raises(ExtractionCrashed):
+            timed_maintext("<html></html>", "", timeout=10, extractor=crash)
+        # the dead worker is replaced
+        maintext = timed_maintext(
+            "<html></html>",
+            "https://example.com/",
+            timeout=10,
+            extractor=slow_extractor,
+        )
+        assert maintext == "maintext of https://example.com/"
+
+    def test_not_forked(self, monkeypatch):
+        """The worker process doesn't inherit this process's state."""
+        monkeypatch.setattr(extraction, "FALLBACK_MIN_LENGTH", -1)
+        assert timed_maintext("", "", timeout=10, extractor=fallback_min_length) == (
+            FALLBACK_MIN_LENGTH
+        )
+
+    def test_no_timeout(self, fake_newsplease):
+        assert timed_maintext("<html></html>", "https://example.com/") == (
+            "maintext of https://example.com/"
+        )
+        assert fake_newsplease == ["https://example.com/"]
+
+    def test_set_article_maintext(self, slow_extractor):
+        nc = NewsContent(
+            "https://example.com/slow", FETCH_FUNCTION="request_active_url"
+        )
+        nc.resolved_url = nc.original_url
+        nc.resolved_text = "<html></html>"
+        nc.set_article_maintext(timeout=5, extractor=slow_extractor)
+        assert nc.maintext_status == "timeout"
+        assert nc.article_maintext == ""
+        nc.set_article_maintext(timeout=10, extractor=crash)
+        assert nc.maintext_status == "crashed"
+
+    def test_extract_maintext(self, tmpdir, slow_extractor):
+        lines = _deferred(3)
+        record = json.loads(lines[1])
+        record["resolved_url"] = "https://example.com/slow"
+        lines[1] = json.dumps(record)
+        _write(tmpdir, "fetched.jsonl", lines)
+        extract_maintext(tmpdir, "fetched.jsonl", timeout=5, extractor=slow_extractor)
+        records = _read(tmpdir, "fetched-extracted.jsonl")
+        assert [r["maintext_status"] for r in records] == [
+            "extracted",
+            "timeout",
+            "extracted",
+        ]
+        # the HTML is kept so that the record can be extracted again
+        assert records[1]["resolved_text"] == record["resolved_text"]
+
+
+def first_word(html, url):
+    return html.split()[0]
+
+
+class TestSelectExtractor(object):
+    def test_select(self):
+        assert select_extractor() == ("newsplease", extraction.newsplease_maintext)
+        assert select_extractor("fast") == ("fast", fast_maintext)
+        assert select_extractor(first_word) == ("first_word", first_word)
+        with pytest.raises(ValueError):
+            select_extractor("readability")
+
+    def test_domains(self):
+        extractors = {"cnn.com": "fast", "default": "auto"}
+        assert select_extractor(extractors, "cnn.com")[0] == "fast"
+        assert select_extractor(extractors, "foxnews.com")[0] == "auto"
+        assert select_extractor({"cnn.com": "fast"}, "foxnews.com")[0] == "newsplease"
+
+    def test_fallback(self, fake_newsplease):
+        long_text = "word " * FALLBACK_MIN_LENGTH
+        assert auto_maintext(f"<p>{long_text}</p>", "https://example.com/1") == (
+            long_text.strip()
+        )
+        assert fake_newsplease == []
+        assert auto_maintext("<p>short</p>", "https://example.com/2") == (
+            "maintext of https://example.com/2"
+        )
+        assert fake_newsplease == ["https://example.com/2"]
+
+    def test_extract_maintext(self, tmpdir, fake_newsplease):
+        _write(tmpdir, "fetched.jsonl", _deferred(4))
+        extract_maintext(tmpdir, "fetched.jsonl", extractor={"cnn.com": "fast"})
+        records = _read(tmpdir, "fetched-extracted.jsonl")
+        assert [r["article_maintext"] for r in records] == [
+            "maintext of https://example.com/0",
+            "story 1",
+            "maintext of https://example.com/2",
+            "story 3",
+        ]
+
+    def test_timeout(self):
+        """The extractor runs in the worker process."""
+        maintext = timed_maintext(
+            "<p>story</p>", "https://example.com/slow", timeout=10, extractor=first_word
+        )
+        assert maintext == "<p>story</p>"
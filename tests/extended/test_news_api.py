@@ -1,9 +1,15 @@
+import collections
 import datetime
 import json
+import threading
+import time
 
 import pytest
+from urlexpander.core import api, constants, url_utils
+from urlexpander.extended import blobstore, extraction, news_api, readers, writers
 from urlexpander.extended.news_api import (
     NewsContent,
+    _arrow_record,
     fetch_url,
     fetch_urls,
     fetch_urls_to_file,
@@ -77,6 +83,30 @@ class TestNewsContent(object):
         nc_dict = json.loads(nc_json)
         assert themes == nc_dict["themes"]
 
+    def test_compact(self, dummy_url):
+        """Check that fields are stored in slots and kwargs are reachable as attributes."""
+        nc = NewsContent(original_url=dummy_url, outlet="CNN")
+        assert not hasattr(nc, "__dict__")
+        assert nc.outlet == "CNN"
+        with pytest.raises(AttributeError):
+            nc.not_a_field
+
+    def test_key_order(self, dummy_url):
+        """Check that kwargs come first in the output and that fields override kwargs."""
+        nc = NewsContent(original_url=dummy_url, outlet="CNN", resolved_url="kwarg")
+        nc_dict = json.loads(nc.to_json())
+        assert list(nc_dict)[:2] == ["outlet", "resolved_url"]
+        assert list(nc_dict)[2:] == [
+            f for f in NewsContent.FIELDS if f != "resolved_url"
+        ]
+        assert nc_dict["resolved_url"] == ""
+
+    def test_fetch_function(self, dummy_url):
+        """Check that FETCH_FUNCTION defaults to the name of the caller."""
+        assert NewsContent(dummy_url).FETCH_FUNCTION == "test_fetch_function"
+        nc = NewsContent(dummy_url, FETCH_FUNCTION="request_active_url")
+        assert nc.FETCH_FUNCTION == "request_active_url"
+
 
 class TestRequestActiveUrl(object):
     def test_live_url(self, live_url):
@@ -326,3 +356,761 @@ class TestFetchUrlsToFile(object):
         gen_f3 = load_fetched_from_file(path=p3, filename=fn3)
         nc_f3 = [json.loads(r) for r in gen_f3]
         assert len(nc_f3) == 2
+
+
+class TestCanonicalDedup(object):
+    def test_reuse_maintext(self, fake_pages, fake_newsplease):
+        head = '<html><head><link rel="canonical" href="https://example.com/story"></head><body></body></html>'
+        amp_head = '<html><head><link rel="canonical" href="/story"></head><body></body></html>'
+        fake_pages["https://example.com/story?utm_source=x"] = head
+        fake_pages["https://example.com/story/amp"] = amp_head
+        fake_pages["https://example.com/other"] = "<html><head></head></html>"
+        url_dicts = [
+            {"url": "https://example.com/story?utm_source=x"},
+            {"url": "https://example.com/story/amp"},
+            {"url": "https://example.com/other"},
+        ]
+
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                dedup_canonical=True,
+            )
+        ]
+        assert fake_newsplease == [
+            "https://example.com/story?utm_source=x",
+            "https://example.com/other",
+        ]
+        assert fetched[1]["canonical_url"] == "https://example.com/story"
+        assert fetched[1]["article_maintext"] == fetched[0]["article_maintext"]
+        assert fetched[2]["canonical_url"] == ""
+
+    def test_disabled(self, fake_pages, fake_newsplease):
+        head = '<html><head><link rel="canonical" href="https://example.com/story"></head></html>'
+        fake_pages["https://example.com/a"] = head
+        fake_pages["https://example.com/b"] = head
+        url_dicts = [{"url": "https://example.com/a"}, {"url": "https://example.com/b"}]
+        list(fetch_urls(url_dicts, fetch_function=request_active_url, verbose=0))
+        assert len(fake_newsplease) == 2
+
+    def test_generic_canonical(self, fake_pages, fake_newsplease):
+        head = '<html><head><link rel="canonical" href="https://example.com/"></head></html>'
+        fake_pages["https://example.com/a"] = head
+        fake_pages["https://example.com/b"] = head
+        url_dicts = [{"url": "https://example.com/a"}, {"url": "https://example.com/b"}]
+        list(
+            fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                dedup_canonical=True,
+            )
+        )
+        assert len(fake_newsplease) == 2
+
+
+class TestConcurrentFetch(object):
+    @pytest.fixture
+    def tracked_pages(self, monkeypatch, fake_newsplease):
+        """Serve pages slowly while tracking how many requests are in flight per domain."""
+        lock = threading.Lock()
+        in_flight = collections.Counter()
+        stats = {"max_total": 0, "max_per_domain": 0}
+
+        def fake_expand_with_content(url, timeout=10, **kwargs):
+            domain = url_utils.get_domain(url)
+            with lock:
+                in_flight[domain] += 1
+                stats["max_per_domain"] = max(
+                    stats["max_per_domain"], in_flight[domain]
+                )
+                stats["max_total"] = max(stats["max_total"], sum(in_flight.values()))
+            time.sleep(0.05)
+            with lock:
+                in_flight[domain] -= 1
+            return dict(
+                original_url=url,
+                response_url=url,
+                resolved_url=url,
+                resolved_domain=domain,
+                response_code=200,
+                response_reason="OK",
+                resolved_text="<html></html>",
+            )
+
+        monkeypatch.setattr(api, "expand_with_content", fake_expand_with_content)
+        yield stats
+
+    @pytest.fixture
+    def url_dicts(self):
+        url_dicts = [
+            {"url": f"https://{domain}.com/story-{i}", "position": i}
+            for i, domain in enumerate(["cnn", "foxnews", "nytimes", "wsj"] * 4)
+        ]
+        yield url_dicts
+
+    def test_politeness(self, tracked_pages, url_dicts):
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                url_dicts, fetch_function=request_active_url, verbose=0, n_workers=8
+            )
+        ]
+        assert sorted(r["position"] for r in fetched) == list(range(len(url_dicts)))
+        assert tracked_pages["max_per_domain"] == 1
+        assert tracked_pages["max_total"] > 1
+
+    def test_preserve_order(self, tracked_pages, url_dicts, tmpdir):
+        fetch_urls_to_file(
+            url_dicts,
+            fetch_function=request_active_url,
+            path=tmpdir,
+            filename="fetched.jsonl",
+            verbose=0,
+            n_workers=3,
+            preserve_order=True,
+        )
+        fetched = [
+            json.loads(r) for r in load_fetched_from_file(tmpdir, "fetched.jsonl")
+        ]
+        assert [r["position"] for r in fetched] == list(range(len(url_dicts)))
+        assert [r["original_url"] for r in fetched] == [d["url"] for d in url_dicts]
+
+
+class TestOfflineFetchUrl(object):
+    def test_active(self, fake_pages, fake_newsplease):
+        url = "https://example.com/story"
+        fake_pages[url] = "<html></html>"
+        nc = json.loads(fetch_url(url, outlet="Example"))
+        assert nc["FETCH_FUNCTION"] == "request_active_url"
+        assert nc["fetch_error"] is False
+        assert nc["outlet"] == "Example"
+        assert nc["article_maintext"] == f"maintext of {url}"
+
+
+class TestExtractionPipeline(object):
+    """The worker processes are spawned, so they don't inherit the fake NewsPlease,
+    and the tests extract with a picklable stub instead."""
+
+    @pytest.fixture
+    def url_dicts(self, fake_pages):
+        url_dicts = []
+        for i, domain in enumerate(["cnn", "foxnews", "nytimes"] * 3):
+            url = f"https://{domain}.com/story-{i}"
+            fake_pages[url] = "<html></html>"
+            url_dicts.append({"url": url, "position": i})
+        yield url_dicts
+
+    def test_to_file(self, url_dicts, stub_extractor, tmpdir):
+        fetch_urls_to_file(
+            url_dicts,
+            fetch_function=fetch_url,
+            path=tmpdir,
+            filename="fetched.jsonl",
+            verbose=0,
+            n_workers=3,
+            preserve_order=True,
+            n_extract_processes=2,
+            queue_size=2,
+            extractor=stub_extractor,
+        )
+        fetched = [
+            json.loads(r) for r in load_fetched_from_file(tmpdir, "fetched.jsonl")
+        ]
+        assert [r["position"] for r in fetched] == list(range(len(url_dicts)))
+        for r in fetched:
+            assert r["article_maintext"] == f"maintext of {r['original_url']}"
+            assert r["FETCH_FUNCTION"] == "request_active_url"
+
+    def test_timeout(self, url_dicts, fake_pages, slow_extractor):
+        url_dicts[4]["url"] = "https://foxnews.com/slow"
+        fake_pages["https://foxnews.com/slow"] = "<html></html>"
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                n_extract_processes=2,
+                extract_timeout=5,
+                extractor=slow_extractor,
+            )
+        ]
+        statuses = [r["maintext_status"] for r in fetched]
+        assert statuses == ["extracted"] * 4 + ["timeout"] + ["extracted"] * 4
+
+    def test_same_as_inline(self, url_dicts, stub_extractor):
+        inline = list(
+            fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                extractor=stub_extractor,
+            )
+        )
+        pipelined = list(
+            fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                n_extract_processes=2,
+                extractor=stub_extractor,
+            )
+        )
+
+        def without_time(r):
+            return {k: v for k, v in json.loads(r).items() if k != "FETCH_AT"}
+
+        assert [without_time(r) for r in pipelined] == [without_time(r) for r in inline]
+
+    def test_dedup_canonical(self, fake_pages, stub_extractor):
+        head = '<html><head><link rel="canonical" href="https://example.com/story"></head></html>'
+        fake_pages["https://example.com/a"] = head
+        fake_pages["https://example.com/b"] = head
+        url_dicts = [{"url": "https://example.com/a"}, {"url": "https://example.com/b"}]
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                dedup_canonical=True,
+                n_extract_processes=1,
+                extractor=stub_extractor,
+            )
+        ]
+        assert [r["article_maintext"] for r in fetched] == [
+            "maintext of https://example.com/a"
+        ] * 2
+
+    def test_fetch_error(self, url_dicts, stub_extractor):
+        url_dicts.insert(3, {"url": "https://example.com/missing"})
+        fetched = fetch_urls(
+            url_dicts,
+            fetch_function=request_active_url,
+            verbose=0,
+            n_extract_processes=1,
+            extractor=stub_extractor,
+        )
+        with pytest.raises(KeyError):
+            list(fetched)
+
+    def test_custom_function(self, url_dicts):
+        fetched = fetch_urls(
+            url_dicts,
+            fetch_function=lambda url, **kwargs: url,
+            verbose=0,
+            n_extract_processes=1,
+        )
+        with pytest.raises(ValueError):
+            list(fetched)
+
+    @pytest.mark.parametrize(
+        "option, value",
+        [
+            ("blob_store", object()),
+            ("extractor", "fast"),
+            ("extract_timeout", 1),
+            ("hedge_after", 1),
+        ],
+    )
+    def test_custom_function_options(self, url_dicts, option, value):
+        fetched = fetch_urls(
+            url_dicts,
+            fetch_function=lambda url, **kwargs: url,
+            verbose=0,
+            **{option: value},
+        )
+        with pytest.raises(ValueError, match=f"{option} requires"):
+            list(fetched)
+
+
+class TestCustomDedupCanonical(object):
+    url_dicts = [{"url": "https://cnn.com/a", "n": 1}]
+
+    def test_accepts_index(self):
+        def fetch(url, canonical_index=None, **kwargs):
+            return json.dumps(dict(url=url, index=canonical_index))
+
+        fetched = fetch_urls(
+            self.url_dicts, fetch_function=fetch, verbose=0, dedup_canonical=True
+        )
+        assert [json.loads(r)["index"] for r in fetched] == [{}]
+
+    def test_no_index(self):
+        def fetch(url, n=None):
+            return url
+
+        fetched = fetch_urls(
+            self.url_dicts, fetch_function=fetch, verbose=0, dedup_canonical=True
+        )
+        with pytest.raises(ValueError, match="dedup_canonical requires"):
+            list(fetched)
+
+
+class TestDeferExtraction(object):
+    def test_defer(self, fake_pages, fake_newsplease, tmpdir):
+        url = "https://example.com/story"
+        fake_pages[url] = "<html><p>story</p></html>"
+        fetch_urls_to_file(
+            [{"url": url}],
+            fetch_function=fetch_url,
+            path=tmpdir,
+            filename="fetched.jsonl",
+            verbose=0,
+            defer_extraction=True,
+        )
+        assert fake_newsplease == []
+        (record,) = [
+            json.loads(r) for r in load_fetched_from_file(tmpdir, "fetched.jsonl")
+        ]
+        assert record["maintext_status"] == "deferred"
+        assert record["article_maintext"] == ""
+        assert record["resolved_text_encoding"] == "zlib+base64"
+
+        extraction.extract_maintext(tmpdir, "fetched.jsonl")
+        (record,) = [
+            json.loads(r)
+            for r in load_fetched_from_file(tmpdir, "fetched-extracted.jsonl")
+        ]
+        assert record["maintext_status"] == "extracted"
+        assert record["article_maintext"] == f"maintext of {url}"
+
+
+class LivePages(dict):
+    """Maps a URL to (gate, HTML or None for an error); the live response waits until the gate is set.
+    The order in which things happen is recorded in ``events``."""
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def gate(self, url, html, release_after=5):
+        """Hold the live response of a URL; it's released after ``release_after`` seconds at the latest"""
+        gate = threading.Event()
+        timer = threading.Timer(release_after, gate.set)
+        timer.daemon = True
+        timer.start()
+        self[url] = (gate, html)
+        return gate
+
+    def wait_for(self, event, timeout=10):
+        deadline = time.monotonic() + timeout
+        while event not in self.events and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert event in self.events
+
+
+class TestHedgedFetch(object):
+    @pytest.fixture
+    def live(self, monkeypatch):
+        pages = LivePages()
+
+        def fake_expand_with_content(url, timeout=10, cancel=None, **kwargs):
+            gate, html = pages[url]
+            pages.events.append(("live sent", url))
+            if gate is not None:
+                gate.wait()
+            pages.events.append(("live done", url))
+            return dict(
+                original_url=url,
+                response_url=url,
+                resolved_url=url if html is not None else "ERROR",
+                resolved_domain=url_utils.get_domain(url),
+                response_code=200 if html is not None else "ERROR",
+                response_reason="OK" if html is not None else "ERROR",
+                resolved_text=html or "",
+            )
+
+        monkeypatch.setattr(api, "expand_with_content", fake_expand_with_content)
+        yield pages
+
+    @pytest.fixture
+    def archived(self, live, monkeypatch):
+        """Record the start of each archive request and the result of each request in live.events"""
+        request_archived_url = news_api._request_archived_url
+        request_active_url = news_api._request_active_url
+
+        def _request_archived_url(url, **kwargs):
+            live.events.append(("archive sent", url))
+            fetched = request_archived_url(url, **kwargs)
+            live.events.append(("archive done", url, fetched.response_reason))
+            return fetched
+
+        def _request_active_url(url, **kwargs):
+            fetched = request_active_url(url, **kwargs)
+            live.events.append(("active done", url, fetched.response_reason))
+            return fetched
+
+        monkeypatch.setattr(news_api, "_request_archived_url", _request_archived_url)
+        monkeypatch.setattr(news_api, "_request_active_url", _request_active_url)
+
+    def test_archive_wins(self, live, archived, wayback, fake_newsplease):
+        url = "https://cnn.com/slow"
+        gate = live.gate(url, "<html></html>")
+        wayback.capture(url, "20200101000000")
+        nc = json.loads(
+            fetch_url(url, hedge_after=0.05, archive_backend=wayback.backend())
+        )
+        live.events.append("returned")
+        assert nc["FETCH_FUNCTION"] == "request_archived_url"
+        assert nc["fetch_error"] is False
+
+        gate.set()
+        # the cancelled live request skips the extraction
+        live.wait_for(
+            ("active done", url, "FetchCancelled, archived page arrived first")
+        )
+        assert live.events.index("returned") < live.events.index(("live done", url))
+        assert fake_newsplease == [url]
+
+    def test_live_wins(self, live, wayback, fake_newsplease):
+        url = "https://cnn.com/fast"
+        live[url] = (None, "<html></html>")
+        wayback.capture(url, "20200101000000")
+        nc = json.loads(
+            fetch_url(url, hedge_after=0.5, archive_backend=wayback.backend())
+        )
+        assert nc["FETCH_FUNCTION"] == "request_active_url"
+        assert wayback.queries == []
+
+    def test_cancel_archive(
+        self, live, archived, wayback, local_server, fake_newsplease, monkeypatch
+    ):
+        url = "https://cnn.com/story"
+        gate = live.gate(url, "<html></html>")
+        wayback.capture(url, "20200101000000")
+        backend = wayback.backend()
+        backend.prefetch([url])
+        # the archive request waits for its turn longer than the live request takes
+        monkeypatch.setattr(constants, "MIN_DELAY", 30)
+        monkeypatch.setattr(constants, "MAX_DELAY", 30)
+        # the live response arrives once the archive request has started
+        request_archived_url = news_api._request_archived_url
+
+        def _request_archived_url(url, **kwargs):
+            gate.set()
+            return request_archived_url(url, **kwargs)
+
+        monkeypatch.setattr(news_api, "_request_archived_url", _request_archived_url)
+
+        nc = json.loads(fetch_url(url, hedge_after=0.05, archive_backend=backend))
+        assert nc["FETCH_FUNCTION"] == "request_active_url"
+        live.wait_for(("archive done", url, "FetchCancelled, live page arrived first"))
+        assert not any(path.startswith("/web/") for path, _ in local_server.requests)
+
+    def test_dead_domains(self, live, archived, wayback, fake_newsplease):
+        live["https://cnn.com/a"] = (None, None)
+        gate = live.gate("https://cnn.com/b", "<html></html>")
+        wayback.capture("https://cnn.com/a", "20200101000000")
+        wayback.capture("https://cnn.com/b", "20200101000000")
+        backend = wayback.backend()
+        dead_domains = set()
+
+        nc = json.loads(
+            fetch_url(
+                "https://cnn.com/a",
+                hedge_after=10,
+                archive_backend=backend,
+                dead_domains=dead_domains,
+            )
+        )
+        assert nc["FETCH_FUNCTION"] == "request_archived_url"
+        assert dead_domains == {"cnn.com"}
+
+        # the archive is requested right away for a dead domain,
+        # so it wins while the live request is still outstanding
+        nc = json.loads(
+            fetch_url(
+                "https://cnn.com/b",
+                hedge_after=10,
+                archive_backend=backend,
+                dead_domains=dead_domains,
+            )
+        )
+        assert nc["FETCH_FUNCTION"] == "request_archived_url"
+        assert ("live done", "https://cnn.com/b") not in live.events
+        gate.set()
+
+    @pytest.mark.parametrize("n_workers", [1, 2])
+    def test_domain_busy(self, live, archived, wayback, fake_newsplease, n_workers):
+        urls = ["https://cnn.com/a", "https://cnn.com/b"]
+        gate = live.gate(urls[0], "<html></html>")
+        live[urls[1]] = (None, "<html></html>")
+        wayback.capture(urls[0], "20200101000000")
+        fetched = fetch_urls(
+            [{"url": url} for url in urls],
+            fetch_function=fetch_url,
+            verbose=0,
+            n_workers=n_workers,
+            hedge_after=0.05,
+            archive_backend=wayback.backend(),
+        )
+        first = json.loads(next(fetched))
+        assert first["FETCH_FUNCTION"] == "request_archived_url"
+        gate.set()
+        second = json.loads(next(fetched))
+        assert second["FETCH_FUNCTION"] == "request_active_url"
+        # the abandoned live request to the domain finished before the next one was sent
+        assert live.events.index(("live done", urls[0])) < live.events.index(
+            ("live sent", urls[1])
+        )
+
+    def test_requires_fetch_url(self):
+        with pytest.raises(ValueError):
+            list(
+                fetch_urls(
+                    [{"url": "https://cnn.com/a"}],
+                    fetch_function=request_active_url,
+                    hedge_after=1,
+                )
+            )
+
+
+class TestResume(object):
+    @pytest.fixture
+    def url_dicts(self, fake_pages):
+        url_dicts = []
+        for i in range(5):
+            url = f"https://example.com/story-{i}"
+            fake_pages[url] = "<html></html>"
+            url_dicts.append({"url": url, "story_id": i})
+        yield url_dicts
+
+    def _fetch(self, url_dicts, tmpdir, **kwargs):
+        fetch_urls_to_file(
+            url_dicts,
+            fetch_function=request_active_url,
+            path=tmpdir,
+            filename="fetched.jsonl",
+            verbose=0,
+            **kwargs,
+        )
+        return [json.loads(r) for r in load_fetched_from_file(tmpdir, "fetched.jsonl")]
+
+    def test_skip_fetched(self, url_dicts, fake_newsplease, tmpdir):
+        self._fetch(url_dicts[:3], tmpdir)
+        fetched = self._fetch(url_dicts, tmpdir, resume=True)
+        assert [r["story_id"] for r in fetched] == list(range(5))
+        assert len(fake_newsplease) == 5
+
+    def test_resume_key(self, url_dicts, fake_pages, fake_newsplease, tmpdir):
+        self._fetch(url_dicts[:2], tmpdir)
+        # the same stories behind different URLs
+        for d in url_dicts:
+            d["url"] += "?utm_source=x"
+            fake_pages[d["url"]] = "<html></html>"
+        fetched = self._fetch(url_dicts, tmpdir, resume=True, resume_key="story_id")
+        assert [r["story_id"] for r in fetched] == list(range(5))
+        assert len(fake_newsplease) == 5
+
+    def test_retry_errors(self, url_dicts, fake_pages, fake_newsplease, tmpdir):
+        self._fetch(url_dicts[:2], tmpdir)
+        with open(tmpdir.join("fetched.jsonl"), "a") as f:
+            f.write(
+                json.dumps({"original_url": url_dicts[2]["url"], "fetch_error": True})
+            )
+            f.write("\n")
+
+        fetched = self._fetch(url_dicts[:3], tmpdir, resume=True)
+        assert len(fetched) == 3
+        fetched = self._fetch(url_dicts[:3], tmpdir, resume=True, retry_errors=True)
+        assert len(fetched) == 4
+        assert fetched[-1]["fetch_error"] is False
+
+    def test_crashed_shards(self, url_dicts, fake_newsplease, tmpdir):
+        self._fetch(url_dicts[:3], tmpdir, rotate_records=2)
+        # a crash left a shard with a complete record and part of another
+        record = json.dumps({"original_url": url_dicts[3]["url"], "fetch_error": False})
+        with open(tmpdir.join("fetched-00002.jsonl.part"), "w") as f:
+            f.write(record + "\n" + record[:10])
+
+        self._fetch(url_dicts, tmpdir, resume=True, rotate_records=2)
+        shards = writers.list_shards(tmpdir, "fetched.jsonl")
+        fetched = [json.loads(line) for shard in shards for line in open(shard)]
+        assert [r["original_url"] for r in fetched] == [d["url"] for d in url_dicts]
+
+    def test_overwrite(self, url_dicts, tmpdir):
+        with pytest.raises(ValueError):
+            self._fetch(url_dicts, tmpdir, resume=True, write_mode="w")
+
+
+class TestConditionalRefresh(object):
+    @pytest.fixture
+    def page(self, local_server, no_delay):
+        """A page which replies 304 Not Modified to a request with its current ETag."""
+        page = {"etag": '"v1"', "html": "<html><p>v1</p></html>"}
+
+        def respond(handler):
+            if handler.headers.get("If-None-Match") == page["etag"]:
+                return 304, {"ETag": page["etag"]}, b""
+            headers = {"Content-Type": "text/html; charset=utf-8", "ETag": page["etag"]}
+            return 200, headers, page["html"].encode("utf-8")
+
+        local_server.routes["/story"] = (200, {}, respond)
+        page["url"] = local_server.url("/story")
+        yield page
+
+    def _crawl(self, page, tmpdir, filename, **kwargs):
+        fetch_urls_to_file(
+            [{"url": page["url"]}],
+            fetch_function=fetch_url,
+            path=tmpdir,
+            filename=filename,
+            verbose=0,
+            **kwargs,
+        )
+        (record,) = [json.loads(r) for r in load_fetched_from_file(tmpdir, filename)]
+        return record
+
+    def test_not_modified(self, page, fake_newsplease, tmpdir):
+        first = self._crawl(page, tmpdir, "week-1.jsonl")
+        assert first["response_etag"] == '"v1"'
+
+        index = readers.FetchedIndex.load_or_build(tmpdir, "week-1.jsonl")
+        second = self._crawl(page, tmpdir, "week-2.jsonl", refresh_from=index)
+        assert second["response_code"] == 304
+        assert second["fetch_error"] is False
+        assert second["FETCH_FUNCTION"] == "request_active_url"
+        for field in ["resolved_text", "article_maintext", "response_etag"]:
+            assert second[field] == first[field]
+        # NewsPlease only ran in the first crawl
+        assert len(fake_newsplease) == 1
+
+    def test_modified(self, page, fake_newsplease, tmpdir):
+        self._crawl(page, tmpdir, "week-1.jsonl")
+        page["etag"], page["html"] = '"v2"', "<html><p>v2</p></html>"
+        index = readers.FetchedIndex.load_or_build(tmpdir, "week-1.jsonl")
+        second = self._crawl(page, tmpdir, "week-2.jsonl", refresh_from=index)
+        assert second["response_code"] == 200
+        assert second["resolved_text"] == "<html><p>v2</p></html>"
+        assert second["response_etag"] == '"v2"'
+        assert len(fake_newsplease) == 2
+
+    def test_pipeline(self, page, fake_newsplease, tmpdir):
+        first = self._crawl(page, tmpdir, "week-1.jsonl")
+        index = readers.FetchedIndex.load_or_build(tmpdir, "week-1.jsonl")
+        second = self._crawl(
+            page, tmpdir, "week-2.jsonl", refresh_from=index, n_extract_processes=1
+        )
+        assert second["response_code"] == 304
+        assert second["article_maintext"] == first["article_maintext"]
+
+    def test_pipeline_deferred(self, page, fake_newsplease, tmpdir):
+        first = self._crawl(page, tmpdir, "week-1.jsonl", defer_extraction=True)
+        index = readers.FetchedIndex.load_or_build(tmpdir, "week-1.jsonl")
+        second = self._crawl(
+            page, tmpdir, "week-2.jsonl", refresh_from=index, n_extract_processes=1
+        )
+        assert second["response_code"] == 304
+        assert second["maintext_status"] == "deferred"
+        for field in ["resolved_text", "resolved_text_encoding", "article_maintext"]:
+            assert second[field] == first[field]
+        assert fake_newsplease == []
+
+    def test_pipeline_blob_store(self, page, fake_newsplease, tmpdir):
+        self._crawl(page, tmpdir, "week-1.jsonl", defer_extraction=True)
+        index = readers.FetchedIndex.load_or_build(tmpdir, "week-1.jsonl")
+        store = blobstore.BlobStore(str(tmpdir.join("blobs")))
+        second = self._crawl(
+            page,
+            tmpdir,
+            "week-2.jsonl",
+            refresh_from=index,
+            n_extract_processes=1,
+            blob_store=store,
+        )
+        assert second["maintext_status"] == "deferred"
+        # the stored HTML is decompressed
+        assert store.get(second["resolved_text_hash"]) == page["html"]
+
+
+class TestColumnarOutput(object):
+    @pytest.fixture
+    def url_dicts(self, fake_pages):
+        pytest.importorskip("pyarrow")
+        url_dicts = []
+        for i in range(3):
+            url = f"https://example.com/story-{i}"
+            fake_pages[url] = "<html></html>"
+            url_dicts.append({"url": url, "story_id": i})
+        yield url_dicts
+
+    @pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+    def test_fetch_to_file(self, url_dicts, output_format, fake_newsplease, tmpdir):
+        filename = f"fetched.{output_format}"
+        fetch_urls_to_file(
+            url_dicts,
+            fetch_function=request_active_url,
+            path=tmpdir,
+            filename=filename,
+            verbose=0,
+            output_format=output_format,
+        )
+        table = readers.read_fetched_table(
+            tmpdir, filename, fields=["original_url", "resolved_domain", "extra"]
+        )
+        assert table.column_names == ["original_url", "resolved_domain", "extra"]
+        assert table.schema.field("resolved_domain").type.value_type == "string"
+        records = table.to_pylist()
+        assert [r["original_url"] for r in records] == [d["url"] for d in url_dicts]
+        assert [r["resolved_domain"] for r in records] == ["example.com"] * 3
+        assert [json.loads(r["extra"])["story_id"] for r in records] == [0, 1, 2]
+
+    def test_arrow_record(self):
+        record = NewsContent(original_url="https://example.com/", story_id=1)
+        record.response_code = ""
+        record.fetch_error = True
+        record.FETCH_AT = "2021-06-01T12:00:00+00:00"
+        record = _arrow_record(record.to_json())
+        assert json.loads(record["extra"]) == {"story_id": 1}
+        assert record["response_code"] is None
+        assert record["fetch_error"] is True
+        assert record["FETCH_AT"].year == 2021
+
+    def test_resume(self, url_dicts, tmpdir):
+        with pytest.raises(ValueError):
+            fetch_urls_to_file(
+                url_dicts,
+                fetch_function=request_active_url,
+                path=tmpdir,
+                filename="fetched.parquet",
+                write_mode="a",
+                resume=True,
+                output_format="parquet",
+            )
+
+
+class TestExtractor(object):
+    @pytest.fixture
+    def url_dicts(self, fake_pages):
+        url_dicts = []
+        for domain in ["cnn", "foxnews"]:
+            url = f"https://{domain}.com/story"
+            fake_pages[url] = f"<html><body><p>{domain} story</p></body></html>"
+            url_dicts.append({"url": url})
+        yield url_dicts
+
+    @pytest.mark.parametrize("n_extract_processes", [None, 2])
+    def test_by_domain(self, url_dicts, n_extract_processes, stub_extractor):
+        fetched = [
+            json.loads(r)
+            for r in fetch_urls(
+                url_dicts,
+                fetch_function=request_active_url,
+                verbose=0,
+                n_extract_processes=n_extract_processes,
+                extractor={"cnn.com": "fast", "default": stub_extractor},
+            )
+        ]
+        assert [r["article_maintext"] for r in fetched] == [
+            "cnn story",
+            "maintext of https://foxnews.com/story",
+        ]
+
+    def test_custom_fetch_function(self, url_dicts):
+        with pytest.raises(ValueError):
+            list(fetch_urls(url_dicts, fetch_function=len, extractor="fast"))
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from urlexpander.extended.readers import FetchedIndex, read_fetched
+from urlexpander.extended.writers import JsonlWriter
+
+
+@pytest.fixture
+def records():
+    records = [
+        dict(
+            article_maintext=f"maintext {i}",
+            original_url=f"https://example.com/{i}",
+            resolved_url=f"https://www.example.com/{i}",
+            fetch_error=False,
+            resolved_text='<html><p class="a">"quoted" \\\\ text</p></html>' * 50,
+            FETCH_AT="2021-11-05T23:25:15.611729+00:00",
+        )
+        for i in range(20)
+    ]
+    yield records
+
+
+@pytest.fixture
+def fetched_file(tmpdir, records):
+    with JsonlWriter(tmpdir, "fetched.jsonl") as writer:
+        for record in records:
+            writer.write(json.dumps(record))
+    yield tmpdir, "fetched.jsonl"
+
+
+class TestReadFetched(object):
+    def test_all_fields(self, fetched_file, records):
+        assert list(read_fetched(*fetched_file)) == records
+
+    @pytest.mark.parametrize("parser", ["json", "auto"])
+    def test_projection(self, fetched_file, records, parser):
+        fields = ["original_url", "article_maintext"]
+        assert list(read_fetched(*fetched_file, fields=fields, parser=parser)) == [
+            {f: r[f] for f in fields} for r in records
+        ]
+
+    def test_projection_with_html(self, fetched_file, records):
+        fields = ["original_url", "resolved_text"]
+        assert list(read_fetched(*fetched_file, fields=fields)) == [
+            {f: r[f] for f in fields} for r in records
+        ]
+
+    def test_parallel(self, fetched_file, records):
+        fields = ["original_url", "fetch_error"]
+        assert list(
+            read_fetched(*fetched_file, fields=fields, n_processes=2, chunk_bytes=4096)
+        ) == [{f: r[f] for f in fields} for r in records]
+
+    def test_shards(self, tmpdir, records):
+        with JsonlWriter(tmpdir, "fetched.jsonl", rotate_records=7) as writer:
+            for record in records:
+                writer.write(json.dumps(record))
+        urls = [r["original_url"] for r in read_fetched(tmpdir, "fetched.jsonl")]
+        assert urls == [r["original_url"] for r in records]
+
+
+class TestFetchedIndex(object):
+    def test_get(self, fetched_file, records):
+        index = FetchedIndex.build(*fetched_file)
+        assert len(index) == len(records)
+        assert index.get(records[13]["original_url"]) == records[13]
+        assert index.get(records[5]["original_url"], fields=["article_maintext"]) == {
+            "article_maintext": "maintext 5"
+        }
+        assert index.get("https://example.com/missing") is None
+
+    def test_load(self, fetched_file, records):
+        FetchedIndex.build(*fetched_file)
+        index = FetchedIndex.load(*fetched_file)
+        assert records[0]["original_url"] in index
+        assert index.get(records[0]["original_url"]) == records[0]
+
+    def test_stale(self, fetched_file, records):
+        FetchedIndex.build(*fetched_file)
+        with JsonlWriter(*fetched_file) as writer:
+            writer.write(json.dumps(dict(records[0], article_maintext="updated")))
+        assert FetchedIndex.load(*fetched_file) is None
+        index = FetchedIndex.load_or_build(*fetched_file)
+        assert index.get(records[0]["original_url"])["article_maintext"] == "updated"
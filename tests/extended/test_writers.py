@@ -0,0 +1,175 @@
+import json
+import os
+import time
+
+import pytest
+from urlexpander.extended.writers import ArrowWriter, JsonlWriter, list_shards
+
+
+def _records(n, start=0):
+    return [
+        json.dumps({"original_url": f"https://example.com/{i}"})
+        for i in range(start, start + n)
+    ]
+
+
+def _read(files):
+    lines = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            lines.extend(line.rstrip("\n") for line in f)
+    return lines
+
+
+class TestJsonlWriter(object):
+    def test_batches(self, tmpdir):
+        records = _records(5)
+        writer = JsonlWriter(tmpdir, "fetched.jsonl", batch_size=3, flush_interval=60)
+        for data in records[:2]:
+            writer.write(data)
+        assert _read([os.path.join(tmpdir, "fetched.jsonl")]) == []
+        writer.write(records[2])
+        assert _read([os.path.join(tmpdir, "fetched.jsonl")]) == records[:3]
+        for data in records[3:]:
+            writer.write(data)
+        writer.close()
+        assert _read([os.path.join(tmpdir, "fetched.jsonl")]) == records
+
+    def test_flush_interval(self, tmpdir):
+        records = _records(2)
+        with JsonlWriter(tmpdir, "fetched.jsonl", flush_interval=0.2) as writer:
+            writer.write(records[0])
+            # without further writes, the buffered record reaches the file
+            deadline = time.monotonic() + 5
+            while not _read([os.path.join(tmpdir, "fetched.jsonl")]):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            assert _read([os.path.join(tmpdir, "fetched.jsonl")]) == records[:1]
+            writer.write(records[1])
+        assert _read([os.path.join(tmpdir, "fetched.jsonl")]) == records
+
+    def test_append(self, tmpdir):
+        with JsonlWriter(tmpdir, "fetched.jsonl") as writer:
+            writer.write(_records(1)[0])
+        with JsonlWriter(tmpdir, "fetched.jsonl", write_mode="a") as writer:
+            writer.write(_records(1, start=1)[0])
+        assert _read(list_shards(tmpdir, "fetched.jsonl")) == _records(2)
+
+    def test_rotate_records(self, tmpdir):
+        records = _records(7)
+        with JsonlWriter(
+            tmpdir, "fetched.jsonl", batch_size=2, rotate_records=3
+        ) as writer:
+            for data in records[:4]:
+                writer.write(data)
+            # the first shard is finished, the second one is still being written
+            assert [
+                os.path.basename(f) for f in list_shards(tmpdir, "fetched.jsonl")
+            ] == ["fetched-00000.jsonl"]
+            for data in records[4:]:
+                writer.write(data)
+        shards = list_shards(tmpdir, "fetched.jsonl")
+        assert [os.path.basename(f) for f in shards] == [
+            "fetched-00000.jsonl",
+            "fetched-00001.jsonl",
+            "fetched-00002.jsonl",
+        ]
+        assert _read(shards) == records
+        assert not os.path.exists(os.path.join(tmpdir, "fetched.jsonl"))
+
+    def test_rotate_bytes(self, tmpdir):
+        records = _records(6)
+        line_size = len(records[0]) + 1
+        with JsonlWriter(tmpdir, "fetched.jsonl", rotate_bytes=2 * line_size) as writer:
+            for data in records:
+                writer.write(data)
+        shards = list_shards(tmpdir, "fetched.jsonl")
+        assert len(shards) == 3
+        assert all(os.path.getsize(f) <= 2 * line_size for f in shards)
+        assert _read(shards) == records
+
+    def test_resume_numbering(self, tmpdir):
+        with JsonlWriter(tmpdir, "fetched.jsonl", rotate_records=2) as writer:
+            for data in _records(3):
+                writer.write(data)
+        # a shard left behind by a crashed run
+        with open(os.path.join(tmpdir, "fetched-00002.jsonl.part"), "w") as f:
+            f.write(_records(1, start=3)[0] + "\n")
+        with JsonlWriter(tmpdir, "fetched.jsonl", rotate_records=2) as writer:
+            writer.write(_records(1, start=4)[0])
+        shards = list_shards(tmpdir, "fetched.jsonl")
+        assert [os.path.basename(f) for f in shards][-1] == "fetched-00003.jsonl"
+        assert _read(shards) == _records(5)
+
+    def test_incomplete_line(self, tmpdir):
+        """A crash during a write leaves part of a line, which is removed before appending."""
+        file = os.path.join(tmpdir, "fetched.jsonl")
+        with open(file, "w") as f:
+            f.write(_records(1)[0] + "\n" + _records(1, start=1)[0][:10])
+        with JsonlWriter(tmpdir, "fetched.jsonl") as writer:
+            writer.write(_records(1, start=2)[0])
+        assert _read([file]) == [_records(1)[0], _records(1, start=2)[0]]
+
+    def test_closed(self, tmpdir):
+        writer = JsonlWriter(tmpdir, "fetched.jsonl")
+        writer.close()
+        with pytest.raises(ValueError):
+            writer.write("{}")
+
+
+class TestArrowWriter(object):
+    @pytest.fixture
+    def schema(self):
+        pa = pytest.importorskip("pyarrow")
+        yield pa.schema([("original_url", pa.string()), ("response_code", pa.int32())])
+
+    def _records(self, n):
+        return [
+            {"original_url": f"https://example.com/{i}", "response_code": 200}
+            for i in range(n)
+        ]
+
+    @pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+    def test_write(self, schema, output_format, tmpdir):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        filename = f"fetched.{output_format}"
+        with ArrowWriter(
+            tmpdir, filename, schema=schema, output_format=output_format, batch_size=2
+        ) as writer:
+            for record in self._records(5):
+                writer.write(record)
+            # the file is renamed once it's complete
+            assert not os.path.exists(os.path.join(tmpdir, filename))
+        file = os.path.join(tmpdir, filename)
+        if output_format == "parquet":
+            assert pq.ParquetFile(file).num_row_groups == 3
+            table = pq.read_table(file)
+        else:
+            table = pa.ipc.open_file(file).read_all()
+        assert table.to_pylist() == self._records(5)
+
+    def test_append(self, schema, tmpdir):
+        with ArrowWriter(tmpdir, schema=schema) as writer:
+            writer.write(self._records(1)[0])
+        with pytest.raises(ValueError):
+            ArrowWriter(tmpdir, schema=schema, write_mode="a")
+
+    def test_closed(self, schema, tmpdir):
+        writer = ArrowWriter(tmpdir, schema=schema)
+        writer.close()
+        with pytest.raises(ValueError):
+            writer.write({})
+
+    def test_exception(self, schema, tmpdir):
+        with pytest.raises(RuntimeError):
+            with ArrowWriter(tmpdir, schema=schema, batch_size=2) as writer:
+                for record in self._records(3):
+                    writer.write(record)
+                raise RuntimeError("fetching failed")
+        # the incomplete output isn't passed off as the finished file
+        assert not os.path.exists(os.path.join(tmpdir, "fetched.parquet"))
+        assert os.path.exists(os.path.join(tmpdir, "fetched.parquet.part"))
+        with pytest.raises(ValueError):
+            writer.write(self._records(1)[0])
@@ -0,0 +1,292 @@
+import csv
+import io
+import json
+import os
+
+import pytest
+from urlexpander import cli
+from urlexpander.core import api, constants
+from urlexpander.extended import readers, writers
+
+
+@pytest.fixture
+def fake_expand(monkeypatch):
+    """Expand each URL to '<url>/long' instead of sending requests. Records the URLs it's called with."""
+    calls = []
+
+    def _expand(url, timeout=10, use_head=True, **kwargs):
+        calls.append(url)
+        if "broken" in url:
+            raise RuntimeError("unshortenit failed")
+        return dict(
+            original_url=url,
+            resolved_url=f"{url}/long",
+            resolved_domain="example.com",
+        )
+
+    monkeypatch.setattr(api, "_expand", _expand)
+    yield calls
+
+
+def _write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+class TestReadRecords(object):
+    def test_formats(self, tmpdir):
+        text = os.path.join(tmpdir, "links.txt")
+        _write_lines(text, ["https://bit.ly/a", "", "https://bit.ly/b"])
+        assert list(cli.read_records(text)) == [
+            {"url": "https://bit.ly/a"},
+            {"url": "https://bit.ly/b"},
+        ]
+
+        table = os.path.join(tmpdir, "links.csv")
+        with open(table, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerows([["id", "link"], ["1", "https://bit.ly/a"], ["2", ""]])
+        assert list(cli.read_records(table, url_field="link")) == [
+            {"id": "1", "link": "https://bit.ly/a"}
+        ]
+
+        jsonl = os.path.join(tmpdir, "links.jsonl")
+        _write_lines(jsonl, [json.dumps({"url": "https://bit.ly/a", "n": 1})])
+        assert list(cli.read_records(jsonl)) == [{"url": "https://bit.ly/a", "n": 1}]
+
+    def test_tweets(self, tmpdir):
+        tweet = {
+            "id": 1,
+            "user": {"id": 2},
+            "created_at": "Mon Nov 01 00:00:00 +0000 2021",
+            "full_text": "tweet",
+            "entities": {
+                "urls": [{"url": "https://t.co/x", "expanded_url": "https://bit.ly/a"}]
+            },
+        }
+        path = os.path.join(tmpdir, "tweets.jsonl")
+        _write_lines(path, [json.dumps(tweet)])
+        records = list(cli.read_records(path, url_field="link_url_long", tweets=True))
+        assert [(r["tweet_id"], r["link_url_long"]) for r in records] == [
+            (1, "https://bit.ly/a")
+        ]
+
+
+class TestExpand(object):
+    def test_expand(self, tmpdir, fake_expand):
+        path = os.path.join(tmpdir, "links.txt")
+        urls = ["https://bit.ly/a", "https://bit.ly/b", "https://bit.ly/a"]
+        _write_lines(path, urls)
+        output = os.path.join(tmpdir, "expanded.jsonl")
+
+        assert cli.main(["expand", path, "-o", output, "--workers", "2"]) == 0
+        records = _read_jsonl(output)
+        assert [r["url"] for r in records] == urls
+        assert [r["resolved_url"] for r in records] == [f"{u}/long" for u in urls]
+        # duplicates within a chunk are expanded once
+        assert sorted(fake_expand) == ["https://bit.ly/a", "https://bit.ly/b"]
+
+    def test_failure(self, tmpdir, fake_expand):
+        path = os.path.join(tmpdir, "links.txt")
+        _write_lines(path, ["https://bit.ly/broken"])
+        output = os.path.join(tmpdir, "expanded.jsonl")
+        cli.main(["expand", path, "-o", output])
+        assert _read_jsonl(output)[0]["resolved_url"] == "https://bit.ly/broken"
+
+    def test_stdin_stdout(self, monkeypatch, capsys, fake_expand):
+        monkeypatch.setattr("sys.stdin", io.StringIO("https://bit.ly/a\n"))
+        cli.main(["expand", "-"])
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["resolved_url"] for line in lines] == [
+            "https://bit.ly/a/long"
+        ]
+
+    def test_cache_file(self, tmpdir, fake_expand):
+        path = os.path.join(tmpdir, "links.txt")
+        cache_file = os.path.join(tmpdir, "cache.jsonl")
+        output = os.path.join(tmpdir, "expanded.jsonl")
+        _write_lines(
+            cache_file,
+            [
+                json.dumps(
+                    dict(
+                        original_url="https://bit.ly/a",
+                        resolved_url="https://cached.com/a",
+                        resolved_domain="cached.com",
+                    )
+                )
+            ],
+        )
+        _write_lines(
+            path, ["https://bit.ly/a", "https://bit.ly/b", "https://bit.ly/broken"]
+        )
+
+        cli.main(["expand", path, "-o", output, "--cache-file", cache_file])
+        assert [r["resolved_url"] for r in _read_jsonl(output)] == [
+            "https://cached.com/a",
+            "https://bit.ly/b/long",
+            "https://bit.ly/broken",
+        ]
+        # failed expansions aren't cached
+        assert [r["original_url"] for r in _read_jsonl(cache_file)] == [
+            "https://bit.ly/a",
+            "https://bit.ly/b",
+        ]
+        assert fake_expand == ["https://bit.ly/b", "https://bit.ly/broken"]
+
+    def test_resume(self, tmpdir, fake_expand):
+        path = os.path.join(tmpdir, "links.txt")
+        urls = [f"https://bit.ly/{i}" for i in range(5)]
+        _write_lines(path, urls)
+        output = os.path.join(tmpdir, "expanded.jsonl")
+        first = json.dumps(dict(url=urls[0], resolved_url=f"{urls[0]}/long"))
+        # the second record was interrupted while it was being written
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(first + "\n" + first[:10])
+
+        cli.main(["expand", path, "-o", output, "--resume", "--chunksize", "2"])
+        assert [r["url"] for r in _read_jsonl(output)] == urls
+        assert fake_expand == urls[1:]
+
+    def test_parquet(self, tmpdir, fake_expand):
+        pytest.importorskip("pyarrow")
+        path = os.path.join(tmpdir, "links.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([["id", "link"], ["1", "https://bit.ly/a"]])
+
+        cli.main(
+            [
+                "expand",
+                path,
+                "--url-field",
+                "link",
+                "-o",
+                os.path.join(tmpdir, "expanded.parquet"),
+            ]
+        )
+        table = readers.read_fetched_table(tmpdir, "expanded.parquet").to_pylist()
+        assert table == [
+            dict(
+                extra=json.dumps({"id": "1", "link": "https://bit.ly/a"}),
+                original_url="https://bit.ly/a",
+                resolved_url="https://bit.ly/a/long",
+                resolved_domain="example.com",
+            )
+        ]
+
+    def test_invalid_options(self, tmpdir, fake_expand):
+        with pytest.raises(SystemExit):
+            cli.main(["expand", "-", "--output-format", "parquet"])
+        with pytest.raises(SystemExit):
+            cli.main(["expand", "-", "--resume"])
+        with pytest.raises(SystemExit):
+            cli.main(["expand", os.path.join(tmpdir, "missing.txt")])
+
+    def test_runtime_error(self, monkeypatch, tmpdir, fake_expand):
+        def write(self, data):
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(writers.JsonlWriter, "write", write)
+        path = os.path.join(tmpdir, "links.txt")
+        _write_lines(path, ["https://bit.ly/a"])
+        assert cli.main(["expand", path, "-o", os.path.join(tmpdir, "out.jsonl")]) == 1
+
+    @pytest.mark.parametrize(
+        "options, delays",
+        [
+            (["--min-delay", "0", "--max-delay", "1"], (0, 1)),
+            (["--max-delay", "2"], (2, 2)),
+            (["--min-delay", "20"], (20, 20)),
+        ],
+    )
+    def test_delay(self, monkeypatch, tmpdir, fake_expand, options, delays):
+        monkeypatch.setattr(constants, "MIN_DELAY", 8)
+        monkeypatch.setattr(constants, "MAX_DELAY", 12)
+        path = os.path.join(tmpdir, "links.txt")
+        _write_lines(path, [])
+        cli.main(["expand", path, "-o", os.path.join(tmpdir, "out.jsonl")] + options)
+        assert (constants.MIN_DELAY, constants.MAX_DELAY) == delays
+
+    def test_invalid_delay(self, monkeypatch, fake_expand):
+        monkeypatch.setattr(constants, "MIN_DELAY", 8)
+        monkeypatch.setattr(constants, "MAX_DELAY", 12)
+        with pytest.raises(SystemExit):
+            cli.main(["expand", "-", "--min-delay", "3", "--max-delay", "2"])
+
+    def test_cache_size(self, tmpdir, fake_expand):
+        path = os.path.join(tmpdir, "links.txt")
+        cache_file = os.path.join(tmpdir, "cache.jsonl")
+        output = os.path.join(tmpdir, "expanded.jsonl")
+        urls = ["https://bit.ly/a", "https://bit.ly/b", "https://bit.ly/a"]
+        _write_lines(path, urls + ["https://bit.ly/c", "https://bit.ly/a"])
+
+        cli.main(
+            [
+                "expand",
+                path,
+                "-o",
+                output,
+                "--cache-file",
+                cache_file,
+                "--cache-size",
+                "2",
+                "--chunksize",
+                "1",
+            ]
+        )
+        assert [r["resolved_url"] for r in _read_jsonl(output)] == [
+            f"{u}/long" for u in urls + ["https://bit.ly/c", "https://bit.ly/a"]
+        ]
+        # "a" was used more recently than "b", so "b" was dropped when "c" was cached
+        assert fake_expand == [
+            "https://bit.ly/a",
+            "https://bit.ly/b",
+            "https://bit.ly/c",
+        ]
+
+        # only the last URLs of the cache file are read
+        del fake_expand[:]
+        _write_lines(path, ["https://bit.ly/a", "https://bit.ly/b"])
+        cli.main(
+            ["expand", path, "-o", output, "--cache-file", cache_file]
+            + ["--cache-size", "2", "--overwrite"]
+        )
+        assert fake_expand == ["https://bit.ly/a"]
+
+
+class TestFetch(object):
+    def test_fetch(self, tmpdir, fake_pages, fake_newsplease):
+        path = os.path.join(tmpdir, "links.csv")
+        urls = [f"https://example.com/{i}" for i in range(3)]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "link"])
+            writer.writerows([str(i), url] for i, url in enumerate(urls))
+        for url in urls:
+            fake_pages[url] = f"<html><p>{url}</p></html>"
+
+        args = [
+            "fetch",
+            path,
+            "--url-field",
+            "link",
+            "-o",
+            os.path.join(tmpdir, "fetched.jsonl"),
+        ]
+        cli.main(args + ["--function", "request_active_url", "--preserve-order"])
+        records = list(readers.read_fetched(tmpdir, "fetched.jsonl"))
+        assert [r["original_url"] for r in records] == urls
+        assert [r["id"] for r in records] == ["0", "1", "2"]
+        assert [r["article_maintext"] for r in records] == [
+            f"maintext of {url}" for url in urls
+        ]
+
+        # resuming skips the URLs which are already in the output
+        cli.main(args + ["--function", "request_active_url", "--resume"])
+        assert len(list(readers.read_fetched(tmpdir, "fetched.jsonl"))) == 3
+        assert len(fake_newsplease) == 3
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+
+import pytest
+
+# dependencies which should only be imported when a function needs them
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "newsplease",
+    "newspaper",
+    "waybackpy",
+    "unshortenit",
+    "tqdm",
+]
+
+# generous upper bound for the import time, in seconds
+MAX_IMPORT_SECONDS = 1.0
+
+
+def _run(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip()
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import urlexpander",
+        "from urlexpander.core import url_utils",
+        "from urlexpander.core.api import expand",
+    ],
+)
+def test_no_heavy_imports(statement):
+    code = f"import sys; {statement}; print(','.join(sorted(sys.modules)))"
+    loaded = set(_run(code).split(","))
+    assert [m for m in HEAVY_MODULES if m in loaded] == []
+
+
+def test_import_time():
+    code = (
+        "import time; start = time.perf_counter(); import urlexpander; "
+        "print(time.perf_counter() - start)"
+    )
+    assert float(_run(code)) < MAX_IMPORT_SECONDS
+
+
+def test_public_names():
+    import urlexpander
+
+    for name in urlexpander.__all__:
+        assert getattr(urlexpander, name) is not None
+    assert urlexpander.url_utils.get_domain("https://www.nytimes.com/") == "nytimes.com"
+    with pytest.raises(AttributeError):
+        urlexpander.not_a_function
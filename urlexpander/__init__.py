@@ -1,15 +1,42 @@
-from urlexpander.core import constants, datasets, html_utils, tweet_utils, url_utils
+"""urlExpander expands, standardizes and fetches URLs.
 
-from urlexpander.core.api import expand, expand_with_content
+Submodules and their dependencies (e.g., pandas, news-please) are imported on first use,
+so that ``import urlexpander`` stays cheap for workers which only need a few functions.
+"""
 
-from urlexpander.extended.news_api import (
-    request_active_url,
-    request_archived_url,
-    fetch_url,
-    fetch_urls,
-    fetch_urls_to_file,
-    load_fetched_from_file,
-)
+import importlib
 
+# public name -> module which defines it
+_LAZY_ATTRIBUTES = {
+    "constants": "urlexpander.core",
+    "datasets": "urlexpander.core",
+    "html_utils": "urlexpander.core",
+    "tweet_utils": "urlexpander.core",
+    "url_utils": "urlexpander.core",
+    "expand": "urlexpander.core.api",
+    "expand_with_content": "urlexpander.core.api",
+    "request_active_url": "urlexpander.extended.news_api",
+    "request_archived_url": "urlexpander.extended.news_api",
+    "fetch_url": "urlexpander.extended.news_api",
+    "fetch_urls": "urlexpander.extended.news_api",
+    "fetch_urls_to_file": "urlexpander.extended.news_api",
+    "load_fetched_from_file": "urlexpander.extended.news_api",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
 __version__ = "0.0.38"
 __author__ = "Leon Yin"
+
+
+def __getattr__(name):
+    # https://peps.python.org/pep-0562/
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name])
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
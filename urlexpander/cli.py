@@ -0,0 +1,617 @@
+"""Command-line runner for expanding and fetching links in batch.
+
+    urlexpander expand links.txt -o expanded.jsonl --workers 8 --cache-file cache.jsonl
+    urlexpander fetch links.csv --url-field link -o fetched.jsonl --workers 8 --resume
+    cat tweets.jsonl | urlexpander expand - --input-format jsonl --tweets
+
+The input (a file or stdin) is read one record at a time and the output is written in batches,
+so memory use doesn't depend on the size of the input.
+"""
+
+__all__ = ["main", "read_records"]
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import gzip
+import itertools
+import json
+import logging
+import os
+import sys
+
+from urlexpander.core import api, constants, io_utils, tweet_utils, url_utils
+
+LOGGER = logging.getLogger(__name__)
+
+# fields added to each record by the expand command
+EXPAND_FIELDS = ["original_url", "resolved_url", "resolved_domain"]
+
+
+def _input_format(path, input_format):
+    """Infer the format of the input from its file extension, e.g. 'links.csv.gz' -> 'csv'"""
+    if input_format != "auto":
+        return input_format
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+def _open_input(path):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def read_records(
+    path, input_format="auto", url_field="url", tweets=False, parser="auto"
+):
+    """Stream the records of a JSONL, CSV, or plain text file (one URL per line), or of stdin.
+
+    Records without a URL are skipped with a warning.
+
+    :param path: path to the file (which may be gzipped), or "-" for stdin
+    :type path: str
+    :param input_format: "jsonl", "csv", "text", or "auto" to infer it from the file extension (Default value = "auto")
+    :type input_format: str
+    :param url_field: name of the field (or CSV column) with the URL (Default value = "url")
+    :type url_field: str
+    :param tweets: the records are Tweets, and each of their links becomes a record,
+        see tweet_utils.get_link() (Default value = False)
+    :type tweets: bool
+    :param parser: JSON parser, see io_utils.get_json_loads() (Default value = "auto")
+    :type parser: str
+    :returns: records
+    :rtype: Generator[dict]
+
+    """
+    input_format = _input_format(path, input_format)
+    if input_format not in ("jsonl", "csv", "text"):
+        raise ValueError(f"Unknown input format: {input_format}")
+    loads = io_utils.get_json_loads(parser)
+
+    with _open_input(path) as f:
+        if input_format == "csv":
+            rows = csv.DictReader(f)
+        elif input_format == "jsonl":
+            rows = (loads(line) for line in f if line.strip())
+        else:
+            rows = ({url_field: line.strip()} for line in f if line.strip())
+
+        if tweets:
+            rows = (link for tweet in rows for link in tweet_utils.get_link(tweet))
+
+        for n, row in enumerate(rows):
+            if not row.get(url_field):
+                LOGGER.warning(f"Skipping record {n}, which has no '{url_field}'")
+                continue
+            yield row
+
+
+def _batched(iterable, n):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+def _output_format(output, output_format):
+    """Infer the format of the output from its file extension, e.g. 'fetched.parquet' -> 'parquet'"""
+    if output_format != "auto":
+        return output_format
+    if output.endswith(".parquet"):
+        return "parquet"
+    if output.endswith(".arrow"):
+        return "arrow"
+    return "jsonl"
+
+
+class _StdoutWriter:
+    """Writes stringified JSON objects to stdout, with the interface of writers.JsonlWriter"""
+
+    def __init__(self):
+        self.n_records = 0
+
+    def write(self, data):
+        sys.stdout.write(data + "\n")
+        self.n_records += 1
+
+    def close(self):
+        sys.stdout.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def expand_arrow_schema():
+    """Schema of the expand command's Parquet and Arrow IPC output. Requires pyarrow.
+
+    The fields of the input record are stringified as a JSON object in the "extra" column.
+
+    :returns: schema
+    :rtype: pyarrow.Schema
+
+    """
+    import pyarrow as pa
+
+    return pa.schema(
+        [("extra", pa.string())] + [(field, pa.string()) for field in EXPAND_FIELDS]
+    )
+
+
+def _expand_one(url, timeout=10, use_head=True):
+    """Expand one URL, falling back to the URL itself if the expansion fails, like api.expand()"""
+    try:
+        return api._expand(url, timeout=timeout, use_head=use_head), True
+    except Exception as exc:
+        LOGGER.error(f"{url} failed to resolve due to error: {type(exc).__name__}")
+        return (
+            dict(
+                original_url=url,
+                resolved_url=url,
+                resolved_domain=url_utils.get_domain(url),
+            ),
+            False,
+        )
+
+
+def _add_to_cache(cache, expanded, cache_size):
+    """Add expanded URLs to the cache, dropping the least recently used beyond ``cache_size`` URLs"""
+    for url, data in expanded.items():
+        cache[url] = data
+        cache.move_to_end(url)
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+
+
+def _load_cache(cache_file, cache_size):
+    """Read the results of earlier expansions, one JSON object per line as written by api.expand().
+    The last ``cache_size`` URLs of the file are kept.
+    """
+    cache = collections.OrderedDict()
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.endswith("\n"):
+                    data = json.loads(line)
+                    _add_to_cache(cache, {data["original_url"]: data}, cache_size)
+        LOGGER.info(f"Read {len(cache)} expanded URLs from {cache_file}")
+    return cache
+
+
+def _count_records(output):
+    """Number of complete records in a .jsonl output file"""
+    if not os.path.exists(output):
+        return 0
+    return sum(1 for _, line in io_utils.iter_lines(output) if line.endswith(b"\n"))
+
+
+def _set_delay(args):
+    """Set the politeness delay before each request.
+    The default of the bound which isn't given moves to the bound which is, if they'd cross.
+    """
+    if (
+        args.min_delay is not None
+        and args.max_delay is not None
+        and args.min_delay > args.max_delay
+    ):
+        raise ValueError("--min-delay can't be greater than --max-delay")
+    if args.min_delay is not None:
+        constants.MIN_DELAY = args.min_delay
+    if args.max_delay is not None:
+        constants.MAX_DELAY = args.max_delay
+    if constants.MIN_DELAY > constants.MAX_DELAY:
+        if args.max_delay is not None:
+            constants.MIN_DELAY = constants.MAX_DELAY
+        else:
+            constants.MAX_DELAY = constants.MIN_DELAY
+
+
+def _check_args(args):
+    """Raise a ValueError for arguments which can't be run, before any work is done"""
+    if args.input != "-" and not os.path.exists(args.input):
+        raise ValueError(f"No such input file: {args.input}")
+    if args.run is run_expand:
+        output_format = _output_format(args.output, args.output_format)
+        if args.output == "-" and output_format != "jsonl":
+            raise ValueError("Only JSONL output can be written to stdout")
+        if args.resume and (args.output == "-" or output_format != "jsonl"):
+            raise ValueError("--resume requires a .jsonl output file")
+        if args.resume and args.overwrite:
+            raise ValueError("--resume can't be combined with --overwrite")
+
+
+def run_expand(args):
+    """Expand the URLs of the input, writing each record with its resolved URL in the order of the input.
+
+    :param args: parsed command-line arguments of the expand command
+    :type args: argparse.Namespace
+    :returns: n_records-> number of records written
+    :rtype: int
+
+    """
+    from urlexpander.extended import writers
+
+    output_format = _output_format(args.output, args.output_format)
+    write_mode = "w" if args.overwrite else "a"
+
+    records = read_records(
+        args.input,
+        input_format=args.input_format,
+        url_field=args.url_field,
+        tweets=args.tweets,
+    )
+    cache = _load_cache(args.cache_file, args.cache_size)
+    expand_one = functools.partial(
+        _expand_one, timeout=args.timeout, use_head=not args.get
+    )
+
+    if args.output == "-":
+        writer = _StdoutWriter()
+        to_line = json.dumps
+    elif output_format == "jsonl":
+        # the writer removes an incomplete last line before the records are counted
+        writer = writers.JsonlWriter(
+            *os.path.split(args.output),
+            write_mode=write_mode,
+            batch_size=args.batch_size,
+        )
+        to_line = json.dumps
+    else:
+        writer = writers.ArrowWriter(
+            *os.path.split(args.output),
+            schema=expand_arrow_schema(),
+            output_format=output_format,
+            write_mode=write_mode,
+            batch_size=args.batch_size,
+        )
+        to_line = _expand_arrow_record
+
+    with writer:
+        if args.resume:
+            n_done = _count_records(args.output)
+            LOGGER.info(f"Resuming after {n_done} records")
+            records = itertools.islice(records, n_done, None)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.workers
+        ) as executor:
+            for chunk in _batched(records, args.chunksize):
+                cached = {
+                    row[args.url_field]: cache[row[args.url_field]]
+                    for row in chunk
+                    if row[args.url_field] in cache
+                }
+                urls = list(
+                    dict.fromkeys(
+                        row[args.url_field]
+                        for row in chunk
+                        if row[args.url_field] not in cached
+                    )
+                )
+                resolved = dict(zip(urls, executor.map(expand_one, urls)))
+                new = {url: data for url, (data, ok) in resolved.items() if ok}
+                if args.cache_file:
+                    if new:
+                        with open(args.cache_file, "a", encoding="utf-8") as f:
+                            f.writelines(
+                                json.dumps(data) + "\n" for data in new.values()
+                            )
+                    _add_to_cache(cache, {**cached, **new}, args.cache_size)
+
+                for row in chunk:
+                    url = row[args.url_field]
+                    data = cached.get(url) or resolved[url][0]
+                    writer.write(to_line({**row, **data}))
+    return writer.n_records
+
+
+def _expand_arrow_record(record):
+    """Convert one record of the expand command to a row of expand_arrow_schema()"""
+    row = {
+        field: None if record.get(field) is None else str(record[field])
+        for field in EXPAND_FIELDS
+    }
+    extra = {k: v for k, v in record.items() if k not in EXPAND_FIELDS}
+    row["extra"] = json.dumps(extra, default=str)
+    return row
+
+
+def run_fetch(args):
+    """Fetch the URLs of the input with news_api.fetch_urls_to_file().
+
+    :param args: parsed command-line arguments of the fetch command
+    :type args: argparse.Namespace
+
+    """
+    from urlexpander.extended import news_api
+
+    fetch_function = getattr(news_api, args.function)
+    archive_backend = None
+    if args.archive_cache:
+        from urlexpander.extended.archive import ArchiveBackend
+
+        archive_backend = ArchiveBackend(cache_path=args.archive_cache)
+    blob_store = None
+    if args.blob_store:
+        from urlexpander.extended.blobstore import BlobStore
+
+        blob_store = BlobStore(args.blob_store)
+
+    def url_dicts():
+        for row in read_records(
+            args.input,
+            input_format=args.input_format,
+            url_field=args.url_field,
+            tweets=args.tweets,
+        ):
+            d = dict(row)
+            d["url"] = d.pop(args.url_field)
+            yield d
+
+    path, filename = os.path.split(args.output)
+    news_api.fetch_urls_to_file(
+        url_dicts(),
+        fetch_function,
+        path=path,
+        filename=filename,
+        write_mode="w" if args.overwrite else "a",
+        verbose=1 if args.verbose else 0,
+        dedup_canonical=args.dedup_canonical,
+        n_workers=args.workers,
+        preserve_order=args.preserve_order,
+        n_extract_processes=args.extract_processes,
+        defer_extraction=args.defer_extraction,
+        archive_backend=archive_backend,
+        hedge_after=args.hedge_after,
+        blob_store=blob_store,
+        extract_timeout=args.extract_timeout,
+        extractor=args.extractor,
+        resume=args.resume,
+        retry_errors=args.retry_errors,
+        output_format=_output_format(args.output, args.output_format),
+        batch_size=args.batch_size,
+        fsync=args.fsync,
+        rotate_records=args.rotate_records,
+    )
+
+
+def _build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "input", nargs="?", default="-", help="input file, or - for stdin (default: -)"
+    )
+    common.add_argument(
+        "--input-format",
+        choices=["auto", "jsonl", "csv", "text"],
+        default="auto",
+        help="format of the input; 'auto' uses the file extension, and reads stdin as one URL per line",
+    )
+    common.add_argument(
+        "--url-field",
+        default=None,
+        help="field or CSV column with the URL (default: url, or link_url_long with --tweets)",
+    )
+    common.add_argument(
+        "--tweets",
+        action="store_true",
+        help="the input is Tweets in JSONL, whose links are extracted with tweet_utils.get_link()",
+    )
+    common.add_argument(
+        "--output-format",
+        choices=["auto", "jsonl", "parquet", "arrow"],
+        default="auto",
+        help="format of the output; 'auto' uses the file extension",
+    )
+    common.add_argument(
+        "--workers", type=int, default=1, help="number of threads (default: 1)"
+    )
+    common.add_argument(
+        "--min-delay",
+        type=int,
+        default=None,
+        help=f"minimum number of seconds to wait before each request (default: {constants.MIN_DELAY})",
+    )
+    common.add_argument(
+        "--max-delay",
+        type=int,
+        default=None,
+        help=f"maximum number of seconds to wait before each request (default: {constants.MAX_DELAY})",
+    )
+    common.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run, skipping the input which is already in the output",
+    )
+    common.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="overwrite the output instead of appending to it",
+    )
+    common.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="number of records written to the output at a time (default: 100)",
+    )
+    common.add_argument(
+        "-v", "--verbose", action="store_true", help="log progress messages"
+    )
+
+    parser = argparse.ArgumentParser(
+        prog="urlexpander", description="Expand and fetch links in batch."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    expand = subparsers.add_parser(
+        "expand",
+        parents=[common],
+        help="expand shortened URLs",
+        description="Expand the URLs of the input, writing each record with its "
+        "original_url, resolved_url and resolved_domain in the order of the input.",
+    )
+    expand.add_argument(
+        "-o", "--output", default="-", help="output file, or - for stdout (default: -)"
+    )
+    expand.add_argument(
+        "--cache-file",
+        default=None,
+        help="JSONL file of expanded URLs to read and append to, as written by urlexpander.expand()",
+    )
+    expand.add_argument(
+        "--cache-size",
+        type=int,
+        default=1000000,
+        help="maximum number of expanded URLs of --cache-file kept in memory; "
+        "the least recently used are dropped (default: 1000000)",
+    )
+    expand.add_argument(
+        "--chunksize",
+        type=int,
+        default=1280,
+        help="number of input records expanded at a time (default: 1280)",
+    )
+    expand.add_argument(
+        "--timeout",
+        type=int,
+        default=10,
+        help="number of seconds to wait for a response (default: 10)",
+    )
+    expand.add_argument(
+        "--get", action="store_true", help="send GET requests instead of HEAD requests"
+    )
+    expand.set_defaults(run=run_expand)
+
+    fetch = subparsers.add_parser(
+        "fetch",
+        parents=[common],
+        help="fetch the webpages and article text of URLs",
+        description="Fetch the URLs of the input with fetch_urls_to_file(). "
+        "The other fields of the input records are passed along to the output.",
+    )
+    fetch.add_argument("-o", "--output", required=True, help="output file")
+    fetch.add_argument(
+        "--function",
+        choices=["fetch_url", "request_active_url", "request_archived_url"],
+        default="fetch_url",
+        help="how each URL is fetched (default: fetch_url)",
+    )
+    fetch.add_argument(
+        "--preserve-order",
+        action="store_true",
+        help="write the output in the order of the input",
+    )
+    fetch.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="with --resume, fetch the URLs whose last record has a fetch error again",
+    )
+    fetch.add_argument(
+        "--dedup-canonical",
+        action="store_true",
+        help="reuse the article text of pages which share a canonical URL",
+    )
+    fetch.add_argument(
+        "--extractor",
+        choices=["newsplease", "fast", "auto"],
+        default=None,
+        help="how the article text is extracted (default: newsplease)",
+    )
+    fetch.add_argument(
+        "--extract-processes",
+        type=int,
+        default=None,
+        help="extract the article text in this many worker processes",
+    )
+    fetch.add_argument(
+        "--extract-timeout",
+        type=float,
+        default=None,
+        help="number of seconds the extraction of one page may take",
+    )
+    fetch.add_argument(
+        "--defer-extraction",
+        action="store_true",
+        help="store the HTML compressed and don't extract the article text",
+    )
+    fetch.add_argument(
+        "--blob-store",
+        default=None,
+        help="directory of a content-addressed store for the HTML",
+    )
+    fetch.add_argument(
+        "--archive-cache",
+        default=None,
+        help="look up archived snapshots with archive.ArchiveBackend, caching the lookups in this file",
+    )
+    fetch.add_argument(
+        "--hedge-after",
+        type=float,
+        default=None,
+        help="with fetch_url, request the archive once a live request has been outstanding this long",
+    )
+    fetch.add_argument(
+        "--rotate-records",
+        type=int,
+        default=None,
+        help="split a JSONL output into shards of this many records",
+    )
+    fetch.add_argument(
+        "--fsync", action="store_true", help="sync the output to disk after each batch"
+    )
+    fetch.set_defaults(run=run_fetch)
+
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the `urlexpander` command.
+
+    :param argv: command-line arguments, or None to use sys.argv (Default value = None)
+    :type argv: list
+    :returns: exit status
+    :rtype: int
+
+    """
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if args.url_field is None:
+        args.url_field = "link_url_long" if args.tweets else "url"
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    try:
+        _check_args(args)
+        _set_delay(args)
+    except ValueError as exc:
+        parser.error(str(exc))
+    try:
+        args.run(args)
+    except KeyboardInterrupt:
+        LOGGER.warning("Interrupted, run again with --resume to continue")
+        return 130
+    except Exception as exc:
+        LOGGER.error(f"Failed with {type(exc).__name__}: {exc}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
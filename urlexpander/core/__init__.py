@@ -1,4 +1,24 @@
-from . import api, constants, datasets, html_utils, tweet_utils, url_utils
+import importlib
 
-__all__ = ["api", "constants", "datasets", "html_utils", "tweet_utils", "url_utils"]
+__all__ = [
+    "api",
+    "constants",
+    "datasets",
+    "html_utils",
+    "io_utils",
+    "tweet_utils",
+    "url_rules",
+    "url_utils",
+]
 __author__ = "Leon Yin"
+
+
+def __getattr__(name):
+    # submodules are imported on first access, see urlexpander/__init__.py
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -3,26 +3,44 @@ This is the main module of the urlExpander package.
 It has the multi-threaded expand function, which is the crux of this package.
 """
 
-__all__ = ["expand_with_content", "expand", "multithread_function"]
+__all__ = [
+    "expand_with_content",
+    "decode_html",
+    "expand",
+    "multithread_function",
+    "FetchCancelled",
+]
 __author__ = "Leon Yin"
 
+import codecs
 import concurrent.futures
 import json
 import logging
 import os
+import re
 import time
 from random import randint
 
-import numpy as np
-import pandas as pd
 import requests
-import unshortenit
-from newsplease.crawler import response_decoder
-from tqdm import tqdm
-from urlexpander.core import constants, url_utils
+from urlexpander.core import constants, html_utils, url_utils
+
+# numpy, pandas, tqdm, unshortenit and news-please are slow to import,
+# so they are imported by the functions which need them.
 
 LOGGER = logging.getLogger(__name__)
 
+# e.g., <meta charset="utf-8"> or <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+META_CHARSET_REGEX = re.compile(
+    rb"""<meta[^>]+?charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE
+)
+
+# declared charsets which pages that are actually UTF-8 often get wrong
+_SINGLE_BYTE_CODECS = frozenset(["iso8859-1", "cp1252", "ascii"])
+
+
+class FetchCancelled(Exception):
+    """The request was cancelled while it waited for its turn, see news_api.fetch_url(hedge_after=...)"""
+
 
 def _pick_headers(url):
     """workaround for expanding t.co links. See constants.py for details.
@@ -96,13 +114,167 @@ def _parse_error(error, verbose=False):
     return domain, url_endpoint
 
 
-def _expand_with_content(url, timeout=10):
+def _response_charset(r):
+    """Return the charset declared in the response's Content-Type header.
+
+    :param r: server response
+    :type r: requests.Response
+    :returns: charset-> charset, or None if the header doesn't declare one
+    :rtype: str, None
+
+    """
+    content_type = r.headers.get("content-type", "")
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip(" \"'") or None
+    return None
+
+
+def _codec_name(charset):
+    """Normalize a charset name, e.g. 'ISO-8859-1' -> 'iso8859-1', or None if Python doesn't know it"""
+    try:
+        return codecs.lookup(charset).name
+    except (LookupError, TypeError, ValueError):
+        return None
+
+
+def decode_html(content, charset=None):
+    """Decode the HTML of a response.
+
+    The charset declared by the server's Content-Type header is trusted, then the one in the HTML's
+    <meta> tags (searched for in the first constants.CHARSET_META_BYTES bytes). A declared charset
+    is skipped if the HTML can't be decoded with it. Otherwise, the HTML is decoded as UTF-8 if it's
+    valid UTF-8, and if not, the charset is guessed from the first constants.CHARSET_DETECT_BYTES bytes.
+
+    :param content: HTML
+    :type content: bytes
+    :param charset: charset declared by the Content-Type header, see _response_charset() (Default value = None)
+    :type charset: str
+    :returns: text-> decoded HTML
+    :rtype: str
+
+    """
+    if not content:
+        return ""
+
+    match = META_CHARSET_REGEX.search(content, 0, constants.CHARSET_META_BYTES)
+    meta_charset = match.group(1).decode("ascii") if match else None
+    for declared in (charset, meta_charset):
+        codec = _codec_name(declared)
+        if codec is None:
+            continue
+        if codec in _SINGLE_BYTE_CODECS:
+            # these decode any bytes, so valid UTF-8 is checked for first
+            try:
+                return content.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                pass
+        elif codec == "utf-8":
+            codec = "utf-8-sig"
+        try:
+            return content.decode(codec)
+        except UnicodeDecodeError:
+            LOGGER.info(f"HTML isn't {declared} as declared")
+
+    try:
+        return content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        pass
+
+    import cchardet
+
+    guess = cchardet.detect(content[: constants.CHARSET_DETECT_BYTES])["encoding"]
+    codec = _codec_name(guess) or "cp1252"
+    LOGGER.debug(f"guessed encoding: {codec}")
+    return content.decode(codec, errors="replace")
+
+
+def _read_head(r, max_bytes):
+    """Stream the response until the end of the HTML's <head> or until ``max_bytes`` have been read.
+
+    :param r: server response, requested with stream=True
+    :type r: requests.Response
+    :param max_bytes: maximum number of (decompressed) bytes to read
+    :type max_bytes: int
+    :returns: text, meta-> partial HTML and the metadata found in it (see html_utils.HeadMetaParser)
+    :rtype: tuple
+
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(_response_charset(r) or "utf-8")(
+            errors="replace"
+        )
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    parser = html_utils.HeadMetaParser()
+    chunks = []
+    n_bytes = 0
+    try:
+        for chunk in r.iter_content(chunk_size=constants.HEAD_ONLY_CHUNK_SIZE):
+            n_bytes += len(chunk)
+            text = decoder.decode(chunk)
+            chunks.append(text)
+            if parser.feed(text) or n_bytes >= max_bytes:
+                break
+    finally:
+        # closing the response drops the connection instead of downloading the rest
+        r.close()
+    parser.close()
+    LOGGER.info(f"read {n_bytes} bytes, end of <head> found: {parser.done}")
+    return "".join(chunks), parser.meta
+
+
+def _conditional_headers(url, validators):
+    """Request headers which ask the server to only send the page if it changed.
+
+    :param url: URL
+    :type url: str
+    :param validators: "etag" and/or "last_modified" of the previous response
+    :type validators: dict
+    :returns: headers
+    :rtype: dict
+
+    """
+    headers = dict(_pick_headers(url))
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def _expand_with_content(
+    url,
+    timeout=10,
+    head_only=False,
+    max_bytes=constants.HEAD_ONLY_MAX_BYTES,
+    validators=None,
+    decode_text=True,
+    cancel=None,
+):
     """Expands a URL and retrieves the HTML and status info from the server response.
 
     :param url: URL
     :type url: str
     :param timeout: number of seconds to wait for a reseponse (Default value = 10)
     :type timeout: int
+    :param head_only: stop downloading at the end of the HTML's <head> (Default value = False)
+        - useful for link previews, which only need html_utils.search_webpage_meta()
+    :type head_only: bool
+    :param max_bytes: when head_only is True, stop downloading after this many bytes even if
+        the end of the <head> wasn't found (Default value = constants.HEAD_ONLY_MAX_BYTES)
+    :type max_bytes: int
+    :param validators: "etag" and/or "last_modified" of a previous response, to send a conditional request;
+        if the page didn't change, the response code is 304 and there's no HTML (Default value = None)
+    :type validators: dict
+    :param decode_text: decode the HTML into `resolved_text`; if False, the HTML is returned as bytes
+        in `resolved_content`, to be decoded with decode_html() only if it's needed (Default value = True)
+        - ignored if head_only is True
+    :type decode_text: bool
+    :param cancel: if this event is set before the request is sent, raise FetchCancelled (Default value = None)
+    :type cancel: threading.Event
     :rtype: a dictionary containing the following keys
        - original_url (str): the input URL
        - response_url (str): expanded URL, as-is from the server's response
@@ -110,30 +282,64 @@ def _expand_with_content(url, timeout=10):
        - resolved_domain (str): extracted URL domain
        - response_code (int): HTTP status code
        - response_reason (str): reason for HTTP status
-       - response_text (str): HTML of webpage
+       - response_text (str): HTML of webpage (only up to the end of the <head> if head_only is True)
+       - response_etag (str): ETag header of the response
+       - response_last_modified (str): Last-Modified header of the response
+       - meta (dict): only if head_only is True, the metadata found in the <head>
+       - resolved_content (bytes): only if decode_text is False, HTML of webpage
+       - resolved_charset (str): only if decode_text is False, charset of the Content-Type header, or None
 
     """
-
+    raw = not (decode_text or head_only)
     status_code = ""
     reason = ""
     response_url = ""
     text = ""
+    content = b""
+    charset = None
+    etag = ""
+    last_modified = ""
+    meta = html_utils.HeadMetaParser().meta if head_only else None
 
     try:
-        time.sleep(randint(constants.MIN_DELAY, constants.MAX_DELAY))
+        delay = randint(constants.MIN_DELAY, constants.MAX_DELAY)
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            raise FetchCancelled(url)
         LOGGER.info(f"_expand_with_content: {url}")
 
         r = requests.get(
-            url, allow_redirects=True, timeout=timeout, headers=_pick_headers(url)
+            url,
+            allow_redirects=True,
+            timeout=timeout,
+            headers=(
+                _conditional_headers(url, validators)
+                if validators
+                else _pick_headers(url)
+            ),
+            stream=head_only,
         )
+        if head_only and not r.ok:
+            r.close()
         r.raise_for_status()
         status_code = r.status_code
         reason = r.reason
         response_url = r.url
         url_long = r.url
         domain = url_utils.get_domain(url_long)
-        # falls back to r.text if it can't figure out the encoding
-        text = response_decoder.decode_response(r)
+        etag = r.headers.get("ETag", "")
+        last_modified = r.headers.get("Last-Modified", "")
+        if r.status_code == 304:
+            # not modified, the body is empty
+            r.close()
+        elif head_only:
+            text, meta = _read_head(r, max_bytes=max_bytes)
+        elif raw:
+            content = r.content
+            charset = _response_charset(r)
+        else:
+            text = decode_html(r.content, _response_charset(r))
         LOGGER.info(f"success, response URL: {r.url}")
 
     except requests.exceptions.RequestException as exc:
@@ -146,11 +352,13 @@ def _expand_with_content(url, timeout=10):
 
     elif domain in constants.short_domain_ad_redirects or domain == -1:
         LOGGER.debug("domain in ad redirect")
+        import unshortenit
+
         url_long = unshortenit.UnshortenIt().unshorten(url, timeout=timeout)
         domain = url_utils.get_domain(url_long)
 
     LOGGER.info(f"resolved URL: {url_long}")
-    return dict(
+    url_content = dict(
         original_url=url,
         response_url=response_url,
         resolved_url=url_long,
@@ -158,21 +366,55 @@ def _expand_with_content(url, timeout=10):
         response_code=status_code,
         response_reason=reason,
         resolved_text=text,
+        response_etag=etag,
+        response_last_modified=last_modified,
     )
+    if head_only:
+        url_content["meta"] = meta
+    if raw:
+        url_content["resolved_content"] = content
+        url_content["resolved_charset"] = charset
+    return url_content
 
 
-def expand_with_content(url, timeout=10):
+def expand_with_content(
+    url,
+    timeout=10,
+    head_only=False,
+    max_bytes=constants.HEAD_ONLY_MAX_BYTES,
+    validators=None,
+    decode_text=True,
+    cancel=None,
+):
     """Wrapper for _expand_with_content
 
     :param url: URL
     :type url: str
     :param timeout: number of seconds to wait for a reseponse (Default value = 10)
     :type timeout: int
+    :param head_only: stop downloading at the end of the HTML's <head> (Default value = False)
+    :type head_only: bool
+    :param max_bytes: byte budget when head_only is True (Default value = constants.HEAD_ONLY_MAX_BYTES)
+    :type max_bytes: int
+    :param validators: validators of a previous response, see _expand_with_content() (Default value = None)
+    :type validators: dict
+    :param decode_text: decode the HTML, or return it as bytes, see _expand_with_content() (Default value = True)
+    :type decode_text: bool
+    :param cancel: if this event is set before the request is sent, raise FetchCancelled (Default value = None)
+    :type cancel: threading.Event
     :returns: url_content-> see _expand_with_content()
     :rtype: dict
     """
 
-    url_content = _expand_with_content(url=url, timeout=timeout)
+    url_content = _expand_with_content(
+        url=url,
+        timeout=timeout,
+        head_only=head_only,
+        max_bytes=max_bytes,
+        validators=validators,
+        decode_text=decode_text,
+        cancel=cancel,
+    )
 
     return url_content
 
@@ -228,6 +470,8 @@ def _expand(url, timeout=10, verbose=False, use_head=True, **kwargs):
     elif domain in constants.short_domain_ad_redirects or domain == -1:
         if verbose:
             print("domain in ad redirect")
+        import unshortenit
+
         url_long = unshortenit.UnshortenIt().unshorten(url, timeout=timeout)
         domain = url_utils.get_domain(url_long)
 
@@ -272,6 +516,10 @@ def expand(
         return _expand(urls_to_expand, **kwargs)["resolved_url"]
 
     else:
+        import numpy as np
+        import pandas as pd
+        from tqdm import tqdm
+
         urls_to_expand_ = urls_to_expand.copy()
 
         # get uniques
@@ -377,6 +625,9 @@ def multithread_function(
     :rtype: list
 
     """
+    import numpy as np
+    from tqdm import tqdm
+
     # shuffle the inputs, this is to reduce the changes of making requests to the same domain.
     np.random.seed(random_seed)
     np.random.shuffle(urls_to_expand)
@@ -27,6 +27,30 @@ headers_tw = {
 MIN_DELAY = 8
 MAX_DELAY = 12
 
+# number of concurrent fetches which may request the Wayback Machine at the same time
+ARCHIVE_MAX_CONCURRENCY = 1
+
+# endpoints of the Wayback Machine (see extended/archive.py)
+WAYBACK_CDX_URL = "https://web.archive.org/cdx/search/cdx"
+WAYBACK_URL = "https://web.archive.org/web"
+
+# head-only fetching (see api.expand_with_content):
+# stop reading a response after this many bytes even if </head> wasn't found
+HEAD_ONLY_MAX_BYTES = 131072
+# number of bytes to read from the response at a time
+HEAD_ONLY_CHUNK_SIZE = 8192
+
+# decoding the HTML (see api.decode_html):
+# search this many bytes for a <meta> charset declaration
+CHARSET_META_BYTES = 4096
+# guess the charset from this many bytes if it isn't declared and the HTML isn't UTF-8
+CHARSET_DETECT_BYTES = 65536
+
+# how worker processes are started, see multiprocessing.get_context():
+# they're spawned rather than forked, because forking a process with threads
+# (e.g., fetching threads) can copy a lock which another thread holds
+PROCESS_START_METHOD = "spawn"
+
 """
 Google Analytics
  - https://ga-dev-tools.appspot.com/campaign-url-builder/
@@ -50,7 +74,6 @@ analytics_parameters = [
     "cid",
     "cmpid",
     "custom_click",
-    "dkt_nbr",  # newsmax
     "ns_mail_job",
     "ns_mail_uid",
     "can_id",
@@ -80,6 +103,21 @@ analytics_parameters = [
     "hss_channel",
 ]
 
+# per-domain rules applied by url_utils.standardize_url()
+# each dictionary holds the keyword arguments of url_rules.DomainRules.register()
+domain_rules = [
+    {"domain": "newsmax.com", "params": ["dkt_nbr"]},
+    {
+        "domain": "dailycaller.com",
+        "host_aliases": {"amp.dailycaller.com": "dailycaller.com"},
+    },
+    {
+        "domain": "foxnews.com",
+        "host_aliases": {"m.foxnews.com": "www.foxnews.com"},
+    },
+    {"domain": "nypost.com", "path_rewrites": [("/amp/?$", "/")]},
+]
+
 # these domains need a redirect (Leon Yin + UnshortenIT 2018)
 short_domain_ad_redirects = [
     "sh.st",
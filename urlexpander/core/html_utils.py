@@ -1,18 +1,294 @@
 """This module has utility functions for parsing text from HTML.
 It helps extract the title, description (e.g., what shows up on Google), paragraphs, and images.
 A URL and the HTML of its associated webpage can be collected using expand_with_content().
+
+HeadMetaParser collects the metadata in a webpage's <head> in a single pass,
+and it can be fed the HTML in chunks as they are downloaded.
+MaintextParser finds the article text by the density of the paragraphs in each container,
+a much cheaper (and rougher) estimate than NewsPlease's.
 """
 __all__ = [
+    "HeadMetaParser",
+    "MaintextParser",
     "search_webpage_title",
     "search_webpage_description",
     "search_webpage_paragraphs",
     "search_webpage_image",
     "search_webpage_meta",
+    "search_webpage_canonical_url",
+    "search_webpage_maintext",
 ]
 __author__ = "Leon Yin"
 
-import re
 import html
+import re
+from html.parser import HTMLParser
+
+TITLE_REGEX = re.compile("<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+DESCRIPTION_REGEX = re.compile(
+    '<meta property="og?:description" content="(.*?)>', re.IGNORECASE | re.DOTALL
+)
+IMAGE_REGEX = re.compile(
+    '<meta property="og?:image" content="(.*?)>', re.IGNORECASE | re.DOTALL
+)
+PARAGRAPH_REGEX = re.compile(r"<p>(.*?)</p>")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+# meta tag keys (property, name, or itemprop) for each field, in order of preference
+HEAD_META_KEYS = dict(
+    description=["og:description", "twitter:description", "description"],
+    image_url=["og:image", "og:image:url", "og:image:secure_url", "twitter:image"],
+    og_url=["og:url"],
+    published_time=[
+        "article:published_time",
+        "og:published_time",
+        "datepublished",
+        "pubdate",
+        "publishdate",
+        "date",
+        "dc.date",
+    ],
+    author=["author", "article:author", "twitter:creator", "dc.creator"],
+)
+
+
+class _StopParsing(Exception):
+    """Raised by HeadMetaParser to stop scanning the rest of the HTML."""
+
+
+class HeadMetaParser(HTMLParser):
+    """Extract metadata from a webpage's <head> in a single scan.
+
+    Attributes may appear in any order, e.g. both <meta property="og:url" content="...">
+    and <meta content="..." property="og:url"> are recognized.
+    Scanning stops at </head> (or at <body> if </head> is missing).
+
+    e.g.,
+        parser = HeadMetaParser()
+        for chunk in chunks:
+            if parser.feed(chunk):
+                break
+        parser.meta
+
+    """
+
+    # the priority of each meta key within its field, e.g. {"og:description": ("description", 0), ...}
+    _KEY_RANKS = {
+        key: (field, rank)
+        for field, keys in HEAD_META_KEYS.items()
+        for rank, key in enumerate(keys)
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self._in_title = False
+        self._title = []
+        self._canonical_url = None
+        self._found = {}
+
+    def feed(self, data):
+        """Scan a chunk of HTML.
+
+        :param data: HTML
+        :type data: str
+        :returns done: True once the end of <head> has been reached
+        :rtype: bool
+
+        """
+        if not self.done and data:
+            try:
+                super().feed(data)
+            except _StopParsing:
+                pass
+        return self.done
+
+    def close(self):
+        """Scan whatever HTML is still buffered."""
+        if not self.done:
+            try:
+                super().close()
+            except _StopParsing:
+                pass
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            key = attrs.get("property") or attrs.get("name") or attrs.get("itemprop")
+            content = attrs.get("content")
+            if key and content:
+                field_rank = self._KEY_RANKS.get(key.strip().lower())
+                if field_rank is not None:
+                    field, rank = field_rank
+                    if field not in self._found or rank < self._found[field][0]:
+                        self._found[field] = (rank, content.strip())
+        elif tag == "link":
+            attrs = dict(attrs)
+            rel = (attrs.get("rel") or "").lower().split()
+            if "canonical" in rel and attrs.get("href") and not self._canonical_url:
+                self._canonical_url = attrs["href"].strip()
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "body":
+            self._stop()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "head":
+            self._stop()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title.append(data)
+
+    def _stop(self):
+        self.done = True
+        raise _StopParsing()
+
+    @property
+    def meta(self):
+        """The metadata collected so far.
+
+        :returns meta: title, description, image_url, canonical_url, og_url, published_time, author
+            - a value is None if it wasn't found
+        :rtype: dict
+
+        """
+        title = "".join(self._title).strip() or None
+        meta = dict(title=title)
+        for field in HEAD_META_KEYS:
+            meta[field] = self._found[field][1] if field in self._found else None
+        meta["canonical_url"] = self._canonical_url
+        return meta
+
+
+class MaintextParser(HTMLParser):
+    """Find a webpage's article text by the density of its paragraphs, in a single scan.
+
+    Each paragraph (<p>) is scored by its length, discounted by the share of its text in links.
+    A paragraph's score counts fully towards its parent element and half towards its grandparent,
+    so that an article body which is split across sibling containers is still found.
+    The article text is the paragraphs within the highest-scoring element.
+    Paragraphs in navigation, headers, footers, asides, forms, and scripts are ignored.
+
+    e.g.,
+        parser = MaintextParser()
+        parser.feed(html)
+        parser.close()
+        parser.maintext
+
+    """
+
+    # the text in these elements is never part of the article
+    SKIP_TAGS = frozenset(
+        ["script", "style", "noscript", "nav", "header", "footer", "aside", "form"]
+    )
+    # elements which have no end tag
+    VOID_TAGS = frozenset(
+        ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta"]
+        + ["param", "source", "track", "wbr"]
+    )
+    # paragraphs with a larger share of their text in links are ignored, e.g. lists of related stories
+    MAX_LINK_DENSITY = 0.5
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # open elements, as (tag, id) pairs, below the document's root
+        self._stack = [("", 0)]
+        self._next_id = 1
+        self._skip_depth = 0
+        self._link_depth = 0
+        # the paragraph which is open: its ancestors' ids and its text
+        self._paragraph = None
+        self._text = []
+        self._link_chars = 0
+        # (ancestor ids, text, link density) of each paragraph
+        self.paragraphs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            # a paragraph which isn't closed ends where the next one starts
+            self.handle_endtag("p")
+            self._end_paragraph()
+            self._paragraph = tuple(i for _, i in self._stack)
+        elif tag == "a":
+            self._link_depth += 1
+        if tag in self.VOID_TAGS:
+            return
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        self._stack.append((tag, self._next_id))
+        self._next_id += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in ("p", "a"):
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._link_depth = max(0, self._link_depth - 1)
+        # close the element and any elements left open inside it
+        for depth in range(len(self._stack) - 1, -1, -1):
+            if self._stack[depth][0] == tag:
+                break
+        else:
+            return
+        for open_tag, _ in self._stack[depth:]:
+            if open_tag in self.SKIP_TAGS:
+                self._skip_depth -= 1
+        del self._stack[depth:]
+        if self._paragraph is not None and len(self._stack) < len(self._paragraph) + 1:
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if self._paragraph is not None and not self._skip_depth:
+            self._text.append(data)
+            if self._link_depth:
+                self._link_chars += len(data.strip())
+
+    def _end_paragraph(self):
+        if self._paragraph is None:
+            return
+        text = WHITESPACE_REGEX.sub(" ", "".join(self._text)).strip()
+        if text:
+            link_density = min(1.0, self._link_chars / len(text))
+            self.paragraphs.append((self._paragraph, text, link_density))
+        self._paragraph = None
+        self._text = []
+        self._link_chars = 0
+
+    def close(self):
+        super().close()
+        self._end_paragraph()
+
+    @property
+    def maintext(self):
+        """The article text found so far.
+
+        :returns maintext: paragraphs separated by line breaks, or "" if none were found
+        :rtype: str
+
+        """
+        scores = {}
+        for ancestors, text, link_density in self.paragraphs:
+            if link_density > self.MAX_LINK_DENSITY:
+                continue
+            score = len(text) * (1 - link_density)
+            scores[ancestors[-1]] = scores.get(ancestors[-1], 0) + score
+            if len(ancestors) > 1:
+                scores[ancestors[-2]] = scores.get(ancestors[-2], 0) + score / 2
+        if not scores:
+            return ""
+        best = max(scores, key=scores.get)
+        return "\n".join(
+            text
+            for ancestors, text, link_density in self.paragraphs
+            if best in ancestors and link_density <= self.MAX_LINK_DENSITY
+        )
 
 
 def search_webpage_title(text):
@@ -25,9 +301,8 @@ def search_webpage_title(text):
 
     """
     title = None
-    regex = re.compile("<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
     try:
-        title = regex.search(text).group(1)
+        title = TITLE_REGEX.search(text).group(1)
         title = html.unescape(title)
     except:
         pass
@@ -44,11 +319,10 @@ def search_webpage_description(text):
 
     """
     desc = None
-    regex = re.compile(
-        '<meta property="og?:description" content="(.*?)>', re.IGNORECASE | re.DOTALL
-    )
     try:
-        desc = regex.search(text).group(1).rstrip("/").rstrip(" ").rstrip('"')
+        desc = (
+            DESCRIPTION_REGEX.search(text).group(1).rstrip("/").rstrip(" ").rstrip('"')
+        )
         desc = html.unescape(desc)
     except:
         pass
@@ -66,7 +340,7 @@ def search_webpage_paragraphs(text):
     """
     paragraphs = []
     try:
-        paragraphs = re.findall(r"<p>(.*?)</p>", text)
+        paragraphs = PARAGRAPH_REGEX.findall(text)
         paragraphs = [html.unescape(p) for p in paragraphs]
     except:
         pass
@@ -83,11 +357,8 @@ def search_webpage_image(text):
 
     """
     img_url = None
-    regex = re.compile(
-        '<meta property="og?:image" content="(.*?)>', re.IGNORECASE | re.DOTALL
-    )
     try:
-        img_url = regex.search(text).group(1).rstrip("/").rstrip(" ").rstrip('"')
+        img_url = IMAGE_REGEX.search(text).group(1).rstrip("/").rstrip(" ").rstrip('"')
         img_url = html.unescape(img_url)
     except:
         pass
@@ -95,20 +366,56 @@ def search_webpage_image(text):
 
 
 def search_webpage_meta(url, text):
-    """Collect title, description, and image.
+    """Collect the title, description, image, and other metadata from the webpage's <head>.
+    The HTML is scanned once, and scanning stops at the end of the <head>.
 
     :param url: URL
     :type url: str
     :param text: HTML
     :type text: str
     :returns meta: extracted info from the webpage
+        - url, title, description, image_url, canonical_url, og_url, published_time, author
     :rtype: dict
 
     """
-    meta = dict(
-        url=url,
-        title=search_webpage_title(text),
-        description=search_webpage_description(text),
-        image_url=search_webpage_image(text),
-    )
+    parser = HeadMetaParser()
+    if text:
+        parser.feed(text)
+        parser.close()
+    meta = dict(url=url, **parser.meta)
     return meta
+
+
+def search_webpage_canonical_url(text):
+    """Collect the webpage's canonical URL from <link rel="canonical">, or from og:url if it's missing.
+    Only the <head> is scanned.
+
+    :param text: HTML
+    :type text: str
+    :returns canonical_url: webpage's canonical URL, as written in the HTML (it may be relative)
+    :rtype: str, None
+
+    """
+    parser = HeadMetaParser()
+    if text:
+        parser.feed(text)
+        parser.close()
+    meta = parser.meta
+    canonical_url = meta["canonical_url"] or meta["og_url"]
+    return canonical_url
+
+
+def search_webpage_maintext(text):
+    """Collect the webpage's article text, see MaintextParser
+
+    :param text: HTML
+    :type text: str
+    :returns maintext: paragraphs of the article separated by line breaks, or "" if none were found
+    :rtype: str
+
+    """
+    parser = MaintextParser()
+    if text:
+        parser.feed(text)
+        parser.close()
+    return parser.maintext
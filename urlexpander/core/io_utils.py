@@ -0,0 +1,131 @@
+"""Functions for reading large .jsonl files quickly.
+The files are split into byte ranges which start at a line, so that they can be parsed in parallel,
+and each line is parsed with the fastest JSON parser that is installed.
+map_in_processes() parses the ranges (or any other tasks) in a pool of worker processes.
+"""
+
+__all__ = ["get_json_loads", "line_ranges", "iter_lines", "map_in_processes"]
+__author__ = "Leon Yin"
+
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+
+from urlexpander.core import constants
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+def get_json_loads(parser="auto"):
+    """Return a function which parses a JSON document (str or bytes).
+
+    :param parser: "orjson", "json", or "auto" to use orjson if it is installed (Default value = "auto")
+    :type parser: str
+    :returns: loads-> JSON parsing function
+    :rtype: function
+
+    """
+    if parser == "auto":
+        parser = "orjson" if orjson is not None else "json"
+    if parser == "orjson":
+        if orjson is None:
+            raise ImportError("parser='orjson' requires the orjson package")
+        return orjson.loads
+    if parser == "json":
+        return json.loads
+    raise ValueError(f"Unknown JSON parser: {parser}")
+
+
+def line_ranges(path, chunk_bytes=67108864):
+    """Split a file into byte ranges of roughly ``chunk_bytes`` bytes which start and end at line boundaries.
+
+    :param path: path to the file
+    :type path: str
+    :param chunk_bytes: approximate size of each range (Default value = 67108864)
+    :type chunk_bytes: int
+    :returns: ranges-> (start, end) byte offsets
+    :rtype: list
+
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as file:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                # move the end of the range to the end of the line it falls in
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_lines(path, start=0, end=None):
+    """Yield the lines of a file within a byte range, along with their offsets.
+
+    :param path: path to the file
+    :type path: str
+    :param start: offset of the first line (Default value = 0)
+    :type start: int
+    :param end: offset to stop at, or None to read to the end of the file (Default value = None)
+    :type end: int
+    :returns: offset, line-> offset of the line and the line as bytes (including the line break)
+    :rtype: Generator[tuple]
+
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for line in file:
+            if end is not None and offset >= end:
+                break
+            yield offset, line
+            offset += len(line)
+
+
+def map_in_processes(function, tasks, n_processes=1, initializer=None):
+    """Call a function on each task's arguments in a pool of worker processes, like executor.map(),
+    but with a bounded number of tasks in flight, so that memory use doesn't depend on
+    the number of tasks.
+
+    e.g., map_in_processes(parse_range, ((file, start, end) for ...), n_processes=8)
+
+    :param function: picklable function; the worker processes are spawned, see constants.PROCESS_START_METHOD
+    :type function: function
+    :param tasks: tuples of arguments of the function, which are read as the results are yielded
+    :type tasks: Iterable[tuple]
+    :param n_processes: number of worker processes, or 1 to call the function in this process (Default value = 1)
+    :type n_processes: int
+    :param initializer: function which each worker process calls when it starts (Default value = None)
+    :type initializer: function
+    :returns: results-> results of the function, in the order of the tasks
+    :rtype: Generator
+
+    """
+    if n_processes <= 1:
+        for args in tasks:
+            yield function(*args)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_processes,
+        initializer=initializer,
+        mp_context=multiprocessing.get_context(constants.PROCESS_START_METHOD),
+    ) as executor:
+        futures = collections.deque()
+        for args in tasks:
+            futures.append(executor.submit(function, *args))
+            if len(futures) >= 2 * n_processes:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
@@ -1,12 +1,70 @@
 """This module has utility functions for parsing links from Tweets.
 Check out the smappdragon package for Tweet parsing.
 https://github.com/SMAPPNYU/smappdragon
+
+links_from_jsonl() parses large .jsonl files of Tweets in parallel,
+and returns the links in batches of columns rather than one dictionary per link.
+DomainCountAccumulator keeps the counts of count_matrix() up to date as new links arrive.
 """
-__all__ = ["get_link", "count_matrix"]
+__all__ = [
+    "get_link",
+    "links_from_jsonl",
+    "count_matrix",
+    "sparse_count_matrix",
+    "DomainCountAccumulator",
+]
 __author__ = "Leon Yin"
 
+import collections
+import logging
+import threading
+
+from urlexpander.core import io_utils
 from urlexpander.core.url_utils import get_domain
 
+LOGGER = logging.getLogger(__name__)
+
+# the columns of get_link() and links_from_jsonl(), in order
+LINK_COLUMNS = [
+    "user_id",
+    "tweet_id",
+    "tweet_created_at",
+    "tweet_text",
+    "tweet_type",
+    "link_url_long",
+    "link_domain",
+    "link_url_short",
+]
+
+# maximum number of network locations in _domain_index
+DOMAIN_INDEX_SIZE = 65536
+
+# network location -> domain, in order of use; each process (e.g., each worker of
+# links_from_jsonl()) has its own, which keeps the DOMAIN_INDEX_SIZE most recently used.
+# Threads of a process share it, under _domain_index_lock
+_domain_index = collections.OrderedDict()
+_domain_index_lock = threading.Lock()
+
+
+def _get_domain(url):
+    """Memoized get_domain(), keyed by the URL's network location"""
+    netloc = url.partition("//")[2].partition("/")[0] if "//" in url else None
+    if netloc:
+        with _domain_index_lock:
+            domain = _domain_index.get(netloc)
+            if domain is not None:
+                _domain_index.move_to_end(netloc)
+                return domain
+    domain = get_domain(url)
+    # get_domain() returns the whole URL (or "ERROR") if it has no domain,
+    # which doesn't only depend on the network location
+    if netloc and domain != url.lower() and domain != "ERROR":
+        with _domain_index_lock:
+            _domain_index[netloc] = domain
+            if len(_domain_index) > DOMAIN_INDEX_SIZE:
+                _domain_index.popitem(last=False)
+    return domain
+
 
 def _get_full_text(tweet):
     """Parses a tweet json to retrieve the full text.
@@ -21,7 +79,7 @@ def _get_full_text(tweet):
         if "extended_tweet" in tweet and "full_text" in tweet["extended_tweet"]:
             return tweet["extended_tweet"]["full_text"]
         elif "full_text" in tweet:
-            tweet["full_text"]
+            return tweet["full_text"]
         else:
             return tweet.get("text")
     else:
@@ -64,47 +122,285 @@ def get_link(tweet):
     except:
         return
 
-    list_urls = tweet["entities"]["urls"]
+    for tweet_type, url in _tweet_urls(tweet):
+        r = row.copy()
+        r["tweet_type"] = tweet_type
+        r["link_url_long"] = url.get("expanded_url")
+
+        if r["link_url_long"]:
+            r["link_domain"] = _get_domain(r["link_url_long"])
+            r["link_url_short"] = url.get("url")
 
-    if list_urls:
-        for url in list_urls:
-            r = row.copy()
-            r["tweet_type"] = "OG"
-            r["link_url_long"] = url.get("expanded_url")
+            yield r
 
-            if r["link_url_long"]:
-                r["link_domain"] = get_domain(r["link_url_long"])
-                r["link_url_short"] = url.get("url")
 
-                yield r
+def _tweet_urls(tweet):
+    """Yield the URL entities of a Tweet and of the Tweet it retweets or quotes.
+
+    :param tweet: a Tweet either from the streaming or search API
+    :type tweet: a nested dictionary
+    :returns: tweet_type, url-> "OG", "RT", or "Q", and the URL entity
+    :rtype: Generator[tuple]
 
+    """
+    for url in tweet["entities"]["urls"] or []:
+        yield "OG", url
     if "retweeted_status" in tweet:
-        retweeted_list_urls = tweet["retweeted_status"]["entities"]["urls"]
-        if retweeted_list_urls:
-            for url in retweeted_list_urls:
-                r = row.copy()
-                r["tweet_type"] = "RT"
-                r["link_url_long"] = url.get("expanded_url")
+        for url in tweet["retweeted_status"]["entities"]["urls"] or []:
+            yield "RT", url
+    if "quoted_status" in tweet:
+        for url in tweet["quoted_status"]["entities"]["urls"] or []:
+            yield "Q", url
 
-                if r["link_url_long"]:
-                    r["link_domain"] = get_domain(r["link_url_long"])
-                    r["link_url_short"] = url.get("url")
 
-                    yield r
+def _to_batch(columns, output):
+    """Convert columns of links into a DataFrame or an Arrow table"""
+    if output == "arrow":
+        import pyarrow as pa
 
-    if "quoted_status" in tweet:
-        quoted_list_urls = tweet["quoted_status"]["entities"]["urls"]
-        if quoted_list_urls:
-            for url in quoted_list_urls:
-                r = row.copy()
-                r["tweet_type"] = "Q"
-                r["link_url_long"] = url.get("expanded_url")
+        return pa.table(columns)
+    import pandas as pd
+
+    return pd.DataFrame(columns, columns=list(columns))
+
+
+def _links_from_range(file, start, end, parser, include_text, output):
+    """Parse the links of the Tweets within a byte range of a .jsonl file.
+
+    :returns: batch-> links, see links_from_jsonl()
+    :rtype: pandas.DataFrame, pyarrow.Table
+
+    """
+    loads = io_utils.get_json_loads(parser)
+    columns = {column: [] for column in LINK_COLUMNS}
+    if not include_text:
+        del columns["tweet_text"]
+    # bound methods, so that the attribute lookups aren't repeated for every link
+    appends = [(column, values.append) for column, values in columns.items()]
+    n_errors = 0
+    for _, line in io_utils.iter_lines(file, start, end):
+        if not line.strip():
+            continue
+        try:
+            tweet = loads(line)
+            row = dict(
+                user_id=tweet["user"]["id"],
+                tweet_id=tweet["id"],
+                tweet_created_at=tweet["created_at"],
+            )
+            if include_text:
+                row["tweet_text"] = _get_full_text(tweet)
+            urls = list(_tweet_urls(tweet))
+        except Exception:
+            n_errors += 1
+            continue
+        for tweet_type, url in urls:
+            url_long = url.get("expanded_url")
+            if url_long:
+                row["tweet_type"] = tweet_type
+                row["link_url_long"] = url_long
+                row["link_domain"] = _get_domain(url_long)
+                row["link_url_short"] = url.get("url")
+                for column, append in appends:
+                    append(row[column])
+    if n_errors:
+        LOGGER.info(f"Skipped {n_errors} lines which aren't Tweets in {file}")
+    return _to_batch(columns, output)
+
+
+def links_from_jsonl(
+    path_or_files,
+    n_processes=1,
+    output="pandas",
+    include_text=True,
+    parser="auto",
+    chunk_bytes=67108864,
+):
+    """Parse the links of the Tweets in .jsonl files (one Tweet per line), like get_link().
+
+    The files are split into chunks of about ``chunk_bytes`` bytes, which are parsed in parallel,
+    and the links of each chunk are returned as one batch. Lines which aren't Tweets are skipped.
+
+    e.g.,
+        for df in links_from_jsonl(["2021-11-01.jsonl", "2021-11-02.jsonl"], n_processes=8):
+            df.to_parquet(...)
+
+    :param path_or_files: path of a .jsonl file, or a list of paths
+    :type path_or_files: str, list
+    :param n_processes: number of worker processes (Default value = 1)
+    :type n_processes: int
+    :param output: "pandas" for DataFrames or "arrow" for pyarrow Tables (Default value = "pandas")
+    :type output: str
+    :param include_text: include the `tweet_text` column (Default value = True)
+    :type include_text: bool
+    :param parser: JSON parser, see io_utils.get_json_loads() (Default value = "auto")
+    :type parser: str
+    :param chunk_bytes: size of the chunks parsed by each process (Default value = 67108864)
+    :type chunk_bytes: int
+    :returns batches: links with the columns of get_link(), in the order of the files
+    :rtype batches: Generator[pandas.DataFrame, pyarrow.Table]
+
+    """
+    if output not in ("pandas", "arrow"):
+        raise ValueError(f"Unknown output: {output}")
+    files = [path_or_files] if isinstance(path_or_files, str) else list(path_or_files)
+    ranges = (
+        (file, start, end, parser, include_text, output)
+        for file in files
+        for start, end in io_utils.line_ranges(file, chunk_bytes=chunk_bytes)
+    )
+    yield from io_utils.map_in_processes(
+        _links_from_range, ranges, n_processes=n_processes
+    )
+
+
+def _check_columns(df, columns):
+    """Raise a ValueError if any of the columns is missing from the dataframe"""
+    for col in columns:
+        if col not in df.columns:
+            raise ValueError("{} is not a column in the input dataframe".format(col))
+
+
+def _build_count_matrix(
+    users, domains, counts, domain_order, user_col, normalize, min_freq, as_dataframe
+):
+    """Build the sparse count matrix of (user, domain) pairs, see sparse_count_matrix().
+
+    :param users: the user of each pair
+    :type users: numpy.ndarray, list
+    :param domains: the domain of each pair
+    :type domains: numpy.ndarray, list
+    :param counts: the count of each pair, or None if each pair counts once; duplicate pairs are summed
+    :type counts: numpy.ndarray, list, None
+    :param domain_order: the order of the columns, or None to sort them
+    :type domain_order: list
+    :returns: see sparse_count_matrix()
+    :rtype: tuple, Pandas dataframe
+
+    """
+    import numpy as np
+    import pandas as pd
+    from scipy import sparse
+
+    # rows and columns are sorted, like the index and columns of a pivot table
+    user_codes, users = pd.factorize(pd.Index(users), sort=True)
+    domain_codes, domains = pd.factorize(pd.Index(domains), sort=True)
+    if counts is None:
+        counts = np.ones(len(user_codes), dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.asarray(counts, dtype=np.int64), (user_codes, domain_codes)),
+        shape=(len(users), len(domains)),
+    )
+    users = pd.Index(users, name=user_col)
+    domains = pd.Index(domains)
+
+    # with a domain list, the columns are in the order in which the domains first appear
+    if domain_order is not None:
+        order = domains.get_indexer(domain_order)
+        matrix = matrix[:, order]
+        domains = domains[order]
+
+    # filter out domains that don't show up more than `min_freq` times
+    if min_freq:
+        if isinstance(min_freq, int):
+            keep = np.flatnonzero(np.asarray(matrix.sum(axis=0)).ravel() > min_freq)
+            matrix = matrix[:, keep]
+            domains = domains[keep]
+
+    # normalize row counts
+    if normalize:
+        row_sums = np.asarray(matrix.sum(axis=1), dtype=float).ravel()
+        scale = np.divide(
+            1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0
+        )
+        matrix = sparse.diags(scale) @ matrix
+
+    if as_dataframe:
+        return pd.DataFrame.sparse.from_spmatrix(matrix, index=users, columns=domains)
+    return matrix.tocsr(), users, domains
+
+
+def sparse_count_matrix(
+    df,
+    user_col="user_id",
+    domain_col="link_domain",
+    unique_count_col="tweet_id",
+    normalize=False,
+    min_freq=None,
+    domain_list=[],
+    exclude_domain_list=[],
+    as_dataframe=False,
+):
+    """Creates a sparse count matrix of number of domains shared per user, see count_matrix().
+
+    Users and domains are factorized into integer codes, and the unique
+    (user, domain, `unique_count_col`) triples are counted without building a dense table,
+    so the memory use depends on the number of distinct pairs rather than users × domains.
 
-                if r["link_url_long"]:
-                    r["link_domain"] = get_domain(r["link_url_long"])
-                    r["link_url_short"] = url.get("url")
+    :param df: an un-aggregrated dataframe of links shared by user.
+    :type df: Pandas dataframe
+    :param user_col: the name of the column in input dataframe to aggragate on (Default value = "user_id")
+    :type user_col: str
+    :param domain_col: the name of the column in the input dataframe to count (Default value = "link_domain")
+    :type domain_col: str
+    :param unique_count_col: the name of the column to count unique values amongst domain_col.
+                             (Default value = "tweet_id")
+    :type unique_count_col: str
+    :param normalize: normalize row counts; unlike count_matrix(), users without any counts
+                      keep a row of zeros rather than NaN (Default value = False)
+    :type normalize: bool
+    :param min_freq: keep the domains which occur more than this many times, see count_matrix() (Default value = None)
+    :type min_freq: int
+    :param domain_list: standardized domains to create the count matrix with (Default value = [])
+    :type domain_list: list
+    :param exclude_domain_list: standardized domains to exclude in the count matrix on (Default value = [])
+    :type exclude_domain_list: list
+    :param as_dataframe: return a pandas DataFrame with sparse columns instead (Default value = False)
+    :type as_dataframe: bool
+    :returns: matrix, users, domains-> counts per domain by user, the user of each row, and the domain of each column
+    :rtype: tuple(scipy.sparse.csr_matrix, pandas.Index, pandas.Index), or Pandas dataframe if as_dataframe is True
+
+    """
+    import pandas as pd
+
+    _check_columns(df, [user_col, domain_col, unique_count_col])
+
+    # filter to only those in the domain list
+    if domain_list:
+        df = df[df[domain_col].isin(domain_list)]
+    if exclude_domain_list:
+        df = df[~df[domain_col].isin(exclude_domain_list)]
+    # like a pivot table, links without a user or domain are dropped
+    df = df[df[user_col].notna() & df[domain_col].notna()]
+
+    # count each (user, domain, tweet) once
+    triples = df[[user_col, domain_col, unique_count_col]].drop_duplicates()
+    return _build_count_matrix(
+        triples[user_col].to_numpy(),
+        triples[domain_col].to_numpy(),
+        None,
+        domain_order=(
+            df[domain_col].unique() if domain_list or exclude_domain_list else None
+        ),
+        user_col=user_col,
+        normalize=normalize,
+        min_freq=min_freq,
+        as_dataframe=as_dataframe,
+    )
+
+
+def _to_dense(matrix, users, domains, normalize):
+    """Convert the output of sparse_count_matrix() into the dataframe of count_matrix()"""
+    import pandas as pd
+
+    matrix = pd.DataFrame(matrix.toarray(), index=users, columns=domains)
+    matrix.columns.name = None
+
+    # normalize row counts; users without any counts get NaN, like with a pivot table
+    if normalize:
+        matrix = matrix.div(matrix.sum(axis=1), axis=0)
 
-                    yield r
+    return matrix
 
 
 def count_matrix(
@@ -119,6 +415,7 @@ def count_matrix(
 ):
     """Creates a count matrix of number of domains shared per user.
     Where each column is a count of domains, and each row represents on user.
+    The counts are built with sparse_count_matrix(), and only the filtered matrix is made dense.
 
     :param df: an un-aggregrated dataframe of links shared by user.
     :type df: Pandas dataframe
@@ -153,48 +450,181 @@ def count_matrix(
     :rtype: Pandas dataframe
 
     """
-    # check the correct columns are present
-    for col in [user_col, domain_col, unique_count_col]:
-        try:
-            assert col in df.columns
-        except:
-            raise ValueError("{} is not a column in the input dataframe".format(col))
-
-    # filter to only those in the domain list
-    if domain_list:
-        df = df[df[domain_col].isin(domain_list)]
-    if exclude_domain_list:
-        df = df[df[~domain_col].isin(exclude_domain_list)]
-
-    # what are all the domains available?
-    all_domains = df[domain_col].unique()
-
-    # create a count matrix
-    matrix = df.pivot_table(
-        index=user_col,
-        columns=[domain_col],
-        values=[unique_count_col],
-        aggfunc=lambda x: len(x.unique()),
-        fill_value=0,
+    matrix, users, domains = sparse_count_matrix(
+        df,
+        user_col=user_col,
+        domain_col=domain_col,
+        unique_count_col=unique_count_col,
+        min_freq=min_freq,
+        domain_list=domain_list,
+        exclude_domain_list=exclude_domain_list,
     )
+    return _to_dense(matrix, users, domains, normalize)
 
-    # standardize the column names, and remove any hierarchys for readability.
-    matrix = matrix.T.reset_index(level=0, drop=True).T
-    matrix.columns.name = None
 
-    # filter out columns not included in domain_list and re-orders the columns
-    if domain_list:
-        matrix = matrix[[c for c in all_domains if c in domain_list]]
-    if exclude_domain_list:
-        matrix = matrix[[c for c in all_domains if c not in exclude_domain_list]]
+class DomainCountAccumulator:
+    """Incremental counts of the domains shared per user, see count_matrix().
 
-    # filter out domains that don't show up more than `min_freq` times
-    if min_freq:
-        if isinstance(min_freq, int):
-            matrix = matrix[matrix.columns[matrix.sum() > min_freq]]
+    Batches of links (e.g., from get_link() or links_from_jsonl()) update the counts in place,
+    so a daily update only costs as much as the day's links. Each (user, domain, tweet) is
+    counted once, even if it's ingested again. Accumulators are picklable, and the accumulators
+    of different shards or processes can be merged.
 
-    # normalize row counts
-    if normalize:
-        matrix = matrix.div(matrix.sum(axis=1), axis=0)
+    e.g.,
+        accumulator = DomainCountAccumulator()
+        for df in links_from_jsonl(files, n_processes=8):
+            accumulator.update(df)
+        matrix = accumulator.count_matrix(min_freq=5)
 
-    return matrix
+    :param user_col: the name of the user field (Default value = "user_id")
+    :type user_col: str
+    :param domain_col: the name of the domain field (Default value = "link_domain")
+    :type domain_col: str
+    :param unique_count_col: the name of the field whose unique values are counted (Default value = "tweet_id")
+    :type unique_count_col: str
+
+    """
+
+    def __init__(
+        self, user_col="user_id", domain_col="link_domain", unique_count_col="tweet_id"
+    ):
+        self.user_col = user_col
+        self.domain_col = domain_col
+        self.unique_count_col = unique_count_col
+        # domain -> domain, in the order in which the domains first appeared;
+        # also used to keep a single copy of each domain's string
+        self._domains = {}
+        # the (user, domain, tweet) triples which were counted
+        self._seen = set()
+        # (user, domain) -> count
+        self._counts = collections.Counter()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _add(self, user, domain, item):
+        """Count one link, unless its (user, domain, tweet) was already counted"""
+        domain = self._domains.setdefault(domain, domain)
+        triple = (user, domain, item)
+        if triple in self._seen:
+            return 0
+        self._seen.add(triple)
+        self._counts[user, domain] += 1
+        return 1
+
+    def update(self, rows):
+        """Count a batch of links. Links without a user or domain are skipped.
+
+        :param rows: links, as rows from get_link() or a dataframe, e.g. from links_from_jsonl()
+        :type rows: Pandas dataframe, Iterable[dict]
+        :returns: n_new-> number of links which weren't counted before
+        :rtype: int
+
+        """
+        import pandas as pd
+
+        if isinstance(rows, pd.DataFrame):
+            _check_columns(
+                rows, [self.user_col, self.domain_col, self.unique_count_col]
+            )
+            rows = rows[rows[self.user_col].notna() & rows[self.domain_col].notna()]
+            items = rows[self.unique_count_col]
+            triples = zip(
+                rows[self.user_col].tolist(),
+                rows[self.domain_col].tolist(),
+                items.astype(object).where(items.notna(), None).tolist(),
+            )
+        else:
+            triples = (
+                (
+                    r.get(self.user_col),
+                    r.get(self.domain_col),
+                    r.get(self.unique_count_col),
+                )
+                for r in rows
+            )
+
+        n_new = 0
+        for user, domain, item in triples:
+            if user is None or domain is None:
+                continue
+            n_new += self._add(user, domain, item)
+        return n_new
+
+    def merge(self, other):
+        """Add the counts of another accumulator, e.g. of another shard.
+        Links which both accumulators counted are only counted once.
+
+        :param other: accumulator with the same fields
+        :type other: DomainCountAccumulator
+        :returns: self
+        :rtype: DomainCountAccumulator
+
+        """
+        if (other.user_col, other.domain_col, other.unique_count_col) != (
+            self.user_col,
+            self.domain_col,
+            self.unique_count_col,
+        ):
+            raise ValueError("Can't merge accumulators of different fields")
+        # the other's domains which are new to this accumulator keep their first-seen order
+        for domain in other._domains:
+            self._domains.setdefault(domain, domain)
+        for user, domain, item in other._seen:
+            self._add(user, domain, item)
+        return self
+
+    def sparse_count_matrix(
+        self,
+        normalize=False,
+        min_freq=None,
+        domain_list=[],
+        exclude_domain_list=[],
+        as_dataframe=False,
+    ):
+        """The counts as a sparse matrix, the same as sparse_count_matrix() of all of the links.
+
+        :returns: matrix, users, domains-> see sparse_count_matrix()
+        :rtype: tuple, Pandas dataframe
+
+        """
+        users, domains, counts = [], [], []
+        for (user, domain), count in self._counts.items():
+            if domain_list and domain not in domain_list:
+                continue
+            if exclude_domain_list and domain in exclude_domain_list:
+                continue
+            users.append(user)
+            domains.append(domain)
+            counts.append(count)
+
+        domain_order = None
+        if domain_list or exclude_domain_list:
+            kept = set(domains)
+            domain_order = [domain for domain in self._domains if domain in kept]
+        return _build_count_matrix(
+            users,
+            domains,
+            counts,
+            domain_order=domain_order,
+            user_col=self.user_col,
+            normalize=normalize,
+            min_freq=min_freq,
+            as_dataframe=as_dataframe,
+        )
+
+    def count_matrix(
+        self, normalize=False, min_freq=None, domain_list=[], exclude_domain_list=[]
+    ):
+        """The counts as a dataframe, the same as count_matrix() of all of the links.
+
+        :returns: matrix counts per domain by user
+        :rtype: Pandas dataframe
+
+        """
+        matrix, users, domains = self.sparse_count_matrix(
+            min_freq=min_freq,
+            domain_list=domain_list,
+            exclude_domain_list=exclude_domain_list,
+        )
+        return _to_dense(matrix, users, domains, normalize)
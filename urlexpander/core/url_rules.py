@@ -0,0 +1,195 @@
+"""Per-domain rules for standardizing URLs.
+
+Publishers add their own noise to URLs (e.g., AMP paths, mobile hosts, outlet-specific tracking parameters).
+The rules for each domain are registered in a DomainRules instance, which compiles them into a
+dispatch table keyed by domain. standardize_url() looks up the network location once and
+applies all of the matching rules in a single pass.
+"""
+
+__all__ = ["DomainRules", "default_rules"]
+
+import fnmatch
+import re
+import urllib.parse
+
+from urlexpander.core import constants
+
+
+class _CompiledRule:
+    """The rules of one domain, compiled for fast matching.
+
+    :param rule: the registered rules of one domain
+    :type rule: dict
+
+    """
+
+    __slots__ = ("query_regex", "path_rewrites", "host_aliases")
+
+    def __init__(self, rule):
+        patterns = [re.escape(p) for p in rule["params"]]
+        patterns += [re.escape(p) + ".*" for p in rule["param_prefixes"]]
+        # fnmatch.translate() returns an anchored pattern, e.g. '(?s:hsa_.*)\Z'
+        patterns += [fnmatch.translate(p) for p in rule["param_globs"]]
+        if patterns:
+            self.query_regex = re.compile("|".join(f"(?:{p})" for p in patterns))
+        else:
+            self.query_regex = None
+        self.path_rewrites = [
+            (re.compile(pattern), repl) for pattern, repl in rule["path_rewrites"]
+        ]
+        self.host_aliases = dict(rule["host_aliases"])
+
+    def apply(self, host, netloc, path, query):
+        """Apply the compiled rules to the components of a URL.
+
+        :returns: netloc, path, query
+        :rtype: tuple
+
+        """
+        if host in self.host_aliases:
+            userinfo, at, hostport = netloc.rpartition("@")
+            netloc = userinfo + at + self.host_aliases[host] + hostport[len(host) :]
+
+        for regex, repl in self.path_rewrites:
+            path = regex.sub(repl, path)
+
+        if query and self.query_regex is not None:
+            # filter the raw "name=value" pairs so that the kept pairs aren't re-encoded
+            kept = []
+            for pair in query.split("&"):
+                name = urllib.parse.unquote_plus(pair.split("=", 1)[0])
+                if not self.query_regex.fullmatch(name):
+                    kept.append(pair)
+            query = "&".join(kept)
+
+        return netloc, path, query
+
+
+class DomainRules:
+    """Registry of per-domain rules for standardizing URLs.
+
+    Rules registered for a domain also apply to its subdomains,
+    e.g. rules for "foxnews.com" apply to "www.foxnews.com" and "m.foxnews.com".
+
+    e.g.,
+        rules = DomainRules()
+        rules.register("newsmax.com", params=["dkt_nbr"])
+        rules.register("nypost.com", path_rewrites=[("/amp/?$", "/")])
+        url_utils.standardize_url(url, domain_rules=rules)
+
+    :param rules: rules to register, each as a dictionary of keyword arguments for register() (Default value = None)
+    :type rules: list
+
+    """
+
+    def __init__(self, rules=None):
+        self._rules = {}
+        self._table = None
+        for rule in rules or []:
+            self.register(**rule)
+
+    def __getstate__(self):
+        # the dispatch table is rebuilt on first use after unpickling
+        return {"_rules": self._rules, "_table": None}
+
+    def register(
+        self,
+        domain,
+        params=(),
+        param_prefixes=(),
+        param_globs=(),
+        path_rewrites=(),
+        host_aliases=None,
+    ):
+        """Register rules for a domain. Rules for the same domain are merged.
+
+        :param domain: domain or network location, e.g. "newsmax.com"
+        :type domain: str
+        :param params: query parameters to remove, e.g. ["dkt_nbr"]
+        :type params: list
+        :param param_prefixes: prefixes of query parameters to remove, e.g. ["hsa_"]
+        :type param_prefixes: list
+        :param param_globs: glob patterns of query parameters to remove, e.g. ["ref_*_id"]
+        :type param_globs: list
+        :param path_rewrites: (regex, replacement) pairs which are applied to the path in order
+        :type path_rewrites: list
+        :param host_aliases: maps a network location to its preferred version
+            - e.g., {"m.foxnews.com": "www.foxnews.com"}
+        :type host_aliases: dict
+
+        """
+        rule = self._rules.setdefault(
+            domain.lower(),
+            dict(
+                params=[],
+                param_prefixes=[],
+                param_globs=[],
+                path_rewrites=[],
+                host_aliases={},
+            ),
+        )
+        rule["params"].extend(params)
+        rule["param_prefixes"].extend(param_prefixes)
+        rule["param_globs"].extend(param_globs)
+        rule["path_rewrites"].extend(tuple(r) for r in path_rewrites)
+        rule["host_aliases"].update(
+            {k.lower(): v.lower() for k, v in (host_aliases or {}).items()}
+        )
+        self._table = None
+
+    def compile(self):
+        """Compile the registered rules into the dispatch table.
+
+        This is called automatically on first use after a rule is registered.
+
+        :returns: table-> compiled rules keyed by domain
+        :rtype: dict
+
+        """
+        self._table = {
+            domain: _CompiledRule(rule) for domain, rule in self._rules.items()
+        }
+        return self._table
+
+    def lookup(self, host):
+        """Find the compiled rules for a host, trying the most specific domain first.
+
+        e.g., "m.foxnews.com" is looked up as "m.foxnews.com", then "foxnews.com", then "com"
+
+        :param host: host name without the port
+        :type host: str
+        :returns: rule-> compiled rules for the host's domain
+        :rtype: _CompiledRule, None
+
+        """
+        table = self._table if self._table is not None else self.compile()
+        if not table:
+            return None
+        while host:
+            rule = table.get(host)
+            if rule is not None:
+                return rule
+            host = host.partition(".")[2]
+        return None
+
+    def apply(self, netloc, path, query):
+        """Apply the rules for a network location to the components of a URL.
+
+        :param netloc: network location, e.g. "www.newsmax.com:443"
+        :type netloc: str
+        :param path: path
+        :type path: str
+        :param query: query string
+        :type query: str
+        :returns: netloc, path, query
+        :rtype: tuple
+
+        """
+        host = netloc.rpartition("@")[2].partition(":")[0].lower()
+        rule = self.lookup(host)
+        if rule is None:
+            return netloc, path, query
+        return rule.apply(host, netloc, path, query)
+
+
+default_rules = DomainRules(constants.domain_rules)
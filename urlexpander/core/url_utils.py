@@ -1,15 +1,26 @@
 """Functions for parsing and standardizing URLs.
 """
 
-__all__ = ["is_short", "get_domain", "standardize_url", "is_generic_url"]
-
+__all__ = [
+    "is_short",
+    "get_domain",
+    "standardize_url",
+    "standardize_urls",
+    "is_generic_url",
+]
+
+import functools
+import itertools
 import logging
+import multiprocessing
+import os
 import re
+import sys
 import urllib.parse
 
 import tldextract
 import w3lib.url
-from urlexpander.core import constants
+from urlexpander.core import constants, url_rules
 
 LOGGER = logging.getLogger(__name__)
 
@@ -78,9 +89,11 @@ def standardize_url(
     remove_query=False,
     remove_fragment=True,
     to_lowercase=True,
+    domain_rules=url_rules.default_rules,
 ):
     """Standardize the URL.
     At minimum, the URL is canonicalized and and common advertising analytics params are removed.
+    Domain-specific rules (see url_rules.py) are applied once the network location is known.
     The URL is then parsed into five components for further cleaning using urllib.parse.urlsplit().
     If the default options are used, only the scheme and fragment are removed.
 
@@ -107,6 +120,8 @@ def standardize_url(
     :type remove_fragment: bool
     :param to_lowercase: lowercase the standardized version of the URL
     :type to_lowercase: bool
+    :param domain_rules: per-domain rules to apply, None to skip them (Default value = url_rules.default_rules)
+    :type domain_rules: url_rules.DomainRules
     :returns link: the standardized version of the URL
         - depending on the selected cleaning steps, this link may not conform to RFC 1808 Section 2.1
     :rtype: str
@@ -123,9 +138,9 @@ def standardize_url(
             link, constants.analytics_parameters, remove=True
         )
 
-        # remove google amp prefix if it exists
+        # remove google amp prefix if it exists, keeping a scheme so that the network location is parsed
         # https://www.theverge.com/2019/4/16/18402628/google-amp-url-problem-signed-exchange-original-chrome-cloudflare
-        link = re.sub("^http(s)?:\/\/www\.google\.com\/amp\/s\/", "", link)
+        link = re.sub("^http(s)?:\/\/www\.google\.com\/amp\/s\/", "https://", link)
 
         # 3) parse the URL into its components and modify as needed
         parsed = urllib.parse.urlsplit(link)
@@ -135,6 +150,9 @@ def standardize_url(
         query = parsed.query
         fragment = parsed.fragment
 
+        if domain_rules is not None:
+            netloc, path, query = domain_rules.apply(netloc, path, query)
+
         if remove_scheme:
             scheme = ""
         if replace_netloc_with_domain:
@@ -178,6 +196,159 @@ def standardize_url(
         return "ERROR"
 
 
+def _standardize_unique(urls, n_processes, chunksize, options):
+    """Standardize a list of unique URLs, optionally across a process pool.
+
+    :param urls: unique URLs
+    :type urls: list
+    :param n_processes: number of worker processes
+    :type n_processes: int
+    :param chunksize: number of URLs sent to a worker at a time
+    :type chunksize: int
+    :param options: keyword arguments for standardize_url()
+    :type options: dict
+    :returns: standardized URLs, in the same order as the input
+    :rtype: list
+
+    """
+    func = functools.partial(standardize_url, **options)
+    if n_processes <= 1 or len(urls) <= chunksize:
+        return [func(url) for url in urls]
+
+    n_processes = min(n_processes, -(-len(urls) // chunksize))
+    context = multiprocessing.get_context(constants.PROCESS_START_METHOD)
+    with context.Pool(processes=n_processes) as pool:
+        return pool.map(func, urls, chunksize=chunksize)
+
+
+def _iter_standardized(urls, n_processes, chunksize, batchsize, options):
+    """Yield standardized URLs batch by batch, in the order of the input.
+
+    Duplicates within a batch are only standardized once, and blank lines give an empty string.
+
+    :param urls: URLs
+    :type urls: Iterable[str]
+    :param n_processes: number of worker processes
+    :type n_processes: int
+    :param chunksize: number of URLs sent to a worker at a time
+    :type chunksize: int
+    :param batchsize: number of input URLs held in memory at a time
+    :type batchsize: int
+    :param options: keyword arguments for standardize_url()
+    :type options: dict
+    :rtype: Generator[str]
+
+    """
+    urls = iter(urls)
+    pool = None
+    func = functools.partial(standardize_url, **options)
+    try:
+        while True:
+            batch = list(itertools.islice(urls, batchsize))
+            if not batch:
+                break
+            # dict.fromkeys() keeps the first-seen order of the unique values
+            uniques = [url for url in dict.fromkeys(batch) if url]
+            if n_processes > 1 and len(uniques) > chunksize:
+                if pool is None:
+                    context = multiprocessing.get_context(
+                        constants.PROCESS_START_METHOD
+                    )
+                    pool = context.Pool(processes=n_processes)
+                standardized = pool.map(func, uniques, chunksize=chunksize)
+            else:
+                standardized = [func(url) for url in uniques]
+            lookup = dict(zip(uniques, standardized))
+            lookup[""] = ""
+            for url in batch:
+                yield lookup[url]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _read_urls(path):
+    """Yield the URLs in a text file with one URL per line.
+    A blank line yields an empty string, so that the output lines up with the lines of the file.
+
+    :param path: path to the file
+    :type path: str
+    :rtype: Generator[str]
+
+    """
+    with open(file=path, mode="r", encoding="utf-8") as file:
+        for line in file:
+            yield line.strip()
+
+
+def standardize_urls(
+    urls,
+    n_processes=1,
+    chunksize=10000,
+    batchsize=1000000,
+    **options,
+):
+    """Standardize many URLs with standardize_url().
+
+    The input is deduplicated before it is standardized, so each unique URL is only processed once.
+    With ``n_processes`` > 1, the unique URLs are spread across a pool of worker processes.
+
+    The type of the output depends on the input:
+        - pandas Series: returns a Series with the same index
+        - path to a text file with one URL per line: returns a generator which streams
+          the standardized URLs in the order of the file, ``batchsize`` lines at a time;
+          blank lines give an empty string
+        - any other iterable (e.g., a list): returns a list
+
+    e.g., standardize_urls(df["resolved_url"], n_processes=8, remove_query=True)
+
+    :param urls: URLs to standardize
+    :type urls: pandas.Series, list, Iterable[str], or str
+    :param n_processes: number of worker processes, or None to use one per CPU (os.cpu_count()) (Default value = 1)
+    :type n_processes: int
+    :param chunksize: number of unique URLs sent to a worker at a time (Default value = 10000)
+    :type chunksize: int
+    :param batchsize: number of lines read from a file at a time (Default value = 1000000)
+    :type batchsize: int
+    :param **options: keyword arguments for standardize_url(), e.g. remove_query=True
+    :returns: standardized-> the standardized URLs, in the same order as the input
+    :rtype: pandas.Series, list, or Generator[str]
+
+    """
+    if n_processes is None:
+        n_processes = os.cpu_count() or 1
+
+    if isinstance(urls, str):
+        return _iter_standardized(
+            _read_urls(urls), n_processes, chunksize, batchsize, options
+        )
+
+    # pandas is only needed if the input is already a Series,
+    # in which case it has been imported by the caller
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(urls, pd.Series):
+        import numpy as np
+
+        codes, uniques = pd.factorize(urls)
+        standardized = _standardize_unique(
+            uniques.tolist(), n_processes, chunksize, options
+        )
+        # missing values are coded as -1, which takes the last element
+        standardized.append(standardize_url(None, **options))
+        return pd.Series(
+            np.asarray(standardized, dtype=object).take(codes),
+            index=urls.index,
+            name=urls.name,
+        )
+
+    urls = list(urls)
+    uniques = list(dict.fromkeys(urls))
+    standardized = _standardize_unique(uniques, n_processes, chunksize, options)
+    lookup = dict(zip(uniques, standardized))
+    return [lookup[url] for url in urls]
+
+
 def is_generic_url(url):
     """Check if a URL likely leads to a generic homepage (e.g., 'cnn.com')
 
@@ -1,3 +1,14 @@
-from . import news_api
+import importlib
 
-__all__ = ["news_api"]
+__all__ = ["archive", "blobstore", "extraction", "news_api", "readers", "writers"]
+
+
+def __getattr__(name):
+    # submodules are imported on first access, see urlexpander/__init__.py
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
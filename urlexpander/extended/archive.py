@@ -0,0 +1,357 @@
+"""
+This module looks up and fetches archived snapshots of webpages from the Wayback Machine.
+
+ArchiveBackend resolves the oldest snapshot of many URLs with a few CDX queries
+(one per domain and batch) instead of one availability request per URL.
+Snapshots are matched to the URLs by their SURT `urlkey`, the canonical form the CDX server sorts by.
+A URL which a batched query doesn't find has no snapshot, unless its SURT is ambiguous
+(e.g., it has a port or percent-encoded characters), and it's then looked up on its own.
+The lookups, including the URLs without a snapshot, are saved in a .jsonl cache,
+so a re-run doesn't repeat them. The endpoints are configurable, e.g. to point
+at a local stand-in for tests.
+"""
+
+__all__ = ["ArchiveBackend", "NoSnapshotError", "FetchCancelled"]
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+from random import randint
+
+import requests
+from urlexpander.core import constants, url_utils
+from urlexpander.core.api import FetchCancelled
+
+LOGGER = logging.getLogger(__name__)
+
+
+class NoSnapshotError(Exception):
+    """The URL has no archived snapshot"""
+
+
+def _normalize_urlkey(urlkey):
+    """Normalize a CDX `urlkey` for matching, e.g. "com,cnn)/story/?b=2&a=1" -> "com,cnn)/story?a=1&b=2"
+
+    The trailing slash is dropped and the query parameters are sorted, so that either spelling matches.
+
+    """
+    host, _, rest = urlkey.lower().partition(")")
+    path, _, query = rest.partition("?")
+    key = host + ")" + path.rstrip("/")
+    if query:
+        key += "?" + "&".join(sorted(query.split("&")))
+    return key
+
+
+def _snapshot_key(url):
+    """Key which matches a URL to the `urlkey` of its snapshots.
+
+    This is the URL's SURT, like the CDX server computes it: the host is lowercased and reversed
+    without a "www." prefix or a default port, and the scheme is ignored, see _normalize_urlkey().
+    e.g., "https://www.CNN.com:443/story/?b=2&a=1" -> "com,cnn)/story?a=1&b=2"
+
+    """
+    split = urllib.parse.urlsplit(url.strip())
+    host = re.sub(r"^www\d*\.", "", (split.hostname or "").lower())
+    surt = ",".join(reversed(host.split(".")))
+    try:
+        port = split.port
+    except ValueError:
+        port = None
+    if port is not None and port not in (80, 443):
+        surt += f":{port}"
+    surt += ")" + (split.path or "/")
+    if split.query:
+        surt += "?" + split.query
+    return _normalize_urlkey(surt)
+
+
+def _is_ambiguous(url):
+    """Whether the CDX server may canonicalize a URL differently from _snapshot_key(),
+    e.g. because it has a port, user info, percent-encoded or non-ASCII characters
+    """
+    netloc = urllib.parse.urlsplit(url.strip()).netloc
+    return ":" in netloc or "@" in netloc or "%" in url or not url.isascii()
+
+
+def _urlkey_pattern(keys):
+    """Regex for the CDX `filter=urlkey:` parameter which matches the urlkeys of any of the keys"""
+    alternatives = []
+    for key in keys:
+        location, question, query = key.partition("?")
+        alternative = re.escape(location) + "/?"
+        if question:
+            alternative += re.escape("?" + query)
+        alternatives.append(alternative)
+    return "(?i)^(" + "|".join(alternatives) + ")$"
+
+
+def _split_resume_key(rows):
+    """Split the resume key off the rows of a CDX response with showResumeKey=true.
+
+    The rows end with an empty row and the resume key if there are more results.
+
+    :returns: rows, resume_key-> the rows, and the resume key or None
+    :rtype: tuple
+
+    """
+    if len(rows) >= 2 and rows[-2] == []:
+        return rows[:-2], rows[-1][0]
+    return rows, None
+
+
+class ArchiveBackend:
+    """Looks up the oldest snapshot of URLs with batched CDX queries, and caches the results.
+
+    e.g.,
+        backend = ArchiveBackend(cache_path="archive_cache.jsonl")
+        backend.prefetch(urls)  # optional, looks up the snapshots in batches
+        archive_url, original_url, html = backend.get(urls[0])
+
+    :param cdx_url: endpoint of the CDX server (Default value = constants.WAYBACK_CDX_URL)
+    :type cdx_url: str
+    :param wayback_url: prefix of the snapshot URLs (Default value = constants.WAYBACK_URL)
+    :type wayback_url: str
+    :param cache_path: path to the .jsonl cache of the lookups, or None to keep them in memory (Default value = None)
+    :type cache_path: str
+    :param batch_size: maximum number of URLs looked up by one CDX query (Default value = 50)
+    :type batch_size: int
+    :param page_size: maximum number of rows in each page of a batched CDX query (Default value = 5000)
+    :type page_size: int
+    :param missing_ttl: number of seconds after which a URL without a snapshot is looked up again,
+        or None to never look it up again (Default value = None)
+    :type missing_ttl: float
+    :param timeout: how many seconds to wait for a response (Default value = 30)
+    :type timeout: int
+
+    """
+
+    def __init__(
+        self,
+        cdx_url=constants.WAYBACK_CDX_URL,
+        wayback_url=constants.WAYBACK_URL,
+        cache_path=None,
+        batch_size=50,
+        page_size=5000,
+        missing_ttl=None,
+        timeout=30,
+    ):
+        self.cdx_url = cdx_url
+        self.wayback_url = wayback_url.rstrip("/")
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.missing_ttl = missing_ttl
+        self.timeout = timeout
+
+        # snapshot key -> {"timestamp": ..., "original": ..., "checked_at": ...}
+        self._cache = {}
+        self._lock = threading.Lock()
+        # every request goes to the same host, so they take turns
+        self._slots = threading.BoundedSemaphore(constants.ARCHIVE_MAX_CONCURRENCY)
+        self._session = requests.Session()
+        self._session.headers.update(constants.headers)
+        if cache_path and os.path.exists(cache_path):
+            self._load_cache()
+
+    def _load_cache(self):
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # an incomplete last line, left by a crash
+                    continue
+                self._cache[entry.pop("key")] = entry
+        LOGGER.info(f"Loaded {len(self._cache)} archive lookups from {self.cache_path}")
+
+    def _save(self, entries):
+        with self._lock:
+            self._cache.update(entries)
+            if self.cache_path:
+                with open(self.cache_path, "a", encoding="utf-8") as f:
+                    for key, entry in entries.items():
+                        f.write(json.dumps(dict(key=key, **entry)) + "\n")
+
+    def _cached(self, key):
+        """The cached lookup of a key, or None if it must be looked up (again)"""
+        entry = self._cache.get(key)
+        if (
+            entry is not None
+            and entry["timestamp"] is None
+            and self.missing_ttl is not None
+            and time.time() - entry["checked_at"] > self.missing_ttl
+        ):
+            return None
+        return entry
+
+    def _request(self, url, params=None, cancel=None):
+        with self._slots:
+            delay = randint(constants.MIN_DELAY, constants.MAX_DELAY)
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise FetchCancelled(url)
+            LOGGER.info(f"archive request: {url} {params or ''}")
+            r = self._session.get(url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r
+
+    def _query_exact(self, key, url):
+        """Look up the oldest snapshot of one URL, which the CDX server canonicalizes itself.
+
+        :returns: snapshots-> key -> (timestamp, original URL), empty if the URL has no snapshot
+        :rtype: dict
+
+        """
+        params = dict(
+            output="json",
+            fl="urlkey,original,timestamp",
+            filter="statuscode:200",
+            url=url,
+            limit=1,
+        )
+        rows = self._request(self.cdx_url, params=params).json()
+        # the first row is the header, e.g. ["urlkey", "original", "timestamp"]
+        for _, original, timestamp in rows[1:2]:
+            return {key: (timestamp, original)}
+        return {}
+
+    def _query(self, domain, urls):
+        """Look up the oldest snapshot of each URL with one CDX query, which is paged if it has many rows.
+
+        A URL which the query doesn't find has no snapshot, unless the server may canonicalize it
+        differently (see _is_ambiguous()), in which case it's looked up on its own.
+
+        :param domain: domain of the URLs
+        :type domain: str
+        :param urls: key -> URL
+        :type urls: dict
+        :returns: snapshots-> key -> (timestamp, original URL)
+        :rtype: dict
+
+        """
+        if len(urls) == 1:
+            ((key, url),) = urls.items()
+            return self._query_exact(key, url)
+
+        # the rows are sorted by urlkey and then by time, so collapsing keeps the oldest snapshot of each URL
+        params = dict(
+            output="json",
+            fl="urlkey,original,timestamp",
+            filter=["statuscode:200", "urlkey:" + _urlkey_pattern(urls)],
+            url=domain,
+            matchType="domain",
+            collapse="urlkey",
+            limit=self.page_size,
+            showResumeKey="true",
+        )
+        snapshots = {}
+        while True:
+            rows, resume_key = _split_resume_key(
+                self._request(self.cdx_url, params=params).json()
+            )
+            for urlkey, original, timestamp in rows[1:]:
+                key = _normalize_urlkey(urlkey)
+                if key in urls and (
+                    key not in snapshots or timestamp < snapshots[key][0]
+                ):
+                    snapshots[key] = (timestamp, original)
+            if resume_key is None:
+                break
+            params["resumeKey"] = resume_key
+
+        for key, url in urls.items():
+            if key not in snapshots and _is_ambiguous(url):
+                snapshots.update(self._query_exact(key, url))
+        return snapshots
+
+    def _lookup(self, domain, urls):
+        """Look up a batch of URLs of one domain and cache the results, see _query()"""
+        snapshots = self._query(domain, urls)
+        checked_at = time.time()
+        entries = {}
+        for key in urls:
+            timestamp, original = snapshots.get(key, (None, None))
+            entries[key] = dict(
+                timestamp=timestamp, original=original, checked_at=checked_at
+            )
+        self._save(entries)
+
+    def prefetch(self, urls):
+        """Look up the snapshots of the URLs which aren't cached yet, in batches grouped by domain.
+
+        A batch whose query fails (e.g., the CDX server is down) isn't cached,
+        so each of its URLs is looked up again by lookup().
+
+        :param urls: URLs
+        :type urls: Iterable[str]
+        :returns: n_looked_up-> number of URLs which were looked up
+        :rtype: int
+
+        """
+        by_domain = {}
+        for url in urls:
+            key = _snapshot_key(url)
+            if self._cached(key) is None:
+                by_domain.setdefault(url_utils.get_domain(url), {})[key] = url
+
+        n_looked_up = 0
+        for domain, keys in by_domain.items():
+            keys = list(keys.items())
+            for i in range(0, len(keys), self.batch_size):
+                batch = dict(keys[i : i + self.batch_size])
+                try:
+                    self._lookup(domain, batch)
+                except requests.RequestException as exc:
+                    LOGGER.warning(
+                        f"Failed to look up {len(batch)} URLs of {domain}, {str(exc)}"
+                    )
+                    continue
+                n_looked_up += len(batch)
+        return n_looked_up
+
+    def lookup(self, url):
+        """Find the oldest snapshot of a URL.
+
+        :param url: URL
+        :type url: str
+        :returns: timestamp, original-> timestamp of the snapshot and the URL it archived,
+            or None if the URL has no snapshot
+        :rtype: tuple, None
+        :raises requests.RequestException: if the CDX query failed
+
+        """
+        key = _snapshot_key(url)
+        entry = self._cached(key)
+        if entry is None:
+            self._lookup(url_utils.get_domain(url), {key: url})
+            entry = self._cache[key]
+        if entry["timestamp"] is None:
+            return None
+        return entry["timestamp"], entry["original"]
+
+    def get(self, url, cancel=None):
+        """Fetch the oldest snapshot of a URL.
+
+        :param url: URL
+        :type url: str
+        :param cancel: if this event is set before the snapshot is requested, raise FetchCancelled (Default value = None)
+        :type cancel: threading.Event
+        :returns: archive_url, original, html-> URL of the snapshot, the URL it archived, and its HTML
+        :rtype: tuple
+        :raises NoSnapshotError: if the URL has no snapshot
+        :raises FetchCancelled: if ``cancel`` was set
+
+        """
+        snapshot = self.lookup(url)
+        if snapshot is None:
+            raise NoSnapshotError(f"No archived snapshot of {url}")
+        timestamp, original = snapshot
+        archive_url = f"{self.wayback_url}/{timestamp}/{original}"
+        r = self._request(archive_url, cancel=cancel)
+        return archive_url, original, r.text
@@ -0,0 +1,135 @@
+"""
+This module has a content-addressed store for the fetched HTML and the article text extracted from it.
+
+Different short links and syndicated URLs often resolve to byte-identical pages.
+BlobStore keeps one compressed copy of each page, keyed by the SHA-256 hash of the HTML,
+so the fetched records only need to reference the hash (see `resolved_text_hash`).
+The extraction results are memoized per hash, so each page is only extracted once across runs.
+"""
+
+__all__ = ["BlobStore", "text_hash"]
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+
+LOGGER = logging.getLogger(__name__)
+
+
+def text_hash(text):
+    """Hash of a text, e.g. HTML
+
+    :param text: text
+    :type text: str
+    :returns: hash-> hex digest of the SHA-256 hash of the UTF-8 text
+    :rtype: str
+
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """Content-addressed store for HTML and extraction results, kept in a directory.
+
+    The files are spread over subdirectories named after the first two characters of the hash,
+    e.g. '<root>/blobs/9f/9f86d0...zz' and '<root>/results/newsplease/9f/9f86d0...json'.
+    Files are written atomically, so several threads or processes can share a store.
+
+    e.g.,
+        store = BlobStore("html_store")
+        key = store.put(html)
+        html = store.get(key)
+
+    :param root: path to the directory of the store
+    :type root: str
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, kind, key, suffix):
+        return os.path.join(self.root, kind, key[:2], key + suffix)
+
+    @staticmethod
+    def _write(path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def put(self, text):
+        """Store a text, unless it's already stored.
+
+        :param text: text, e.g. HTML
+        :type text: str
+        :returns: key-> hash of the text, see text_hash()
+        :rtype: str
+
+        """
+        key = text_hash(text)
+        path = self._path("blobs", key, ".zz")
+        if not os.path.exists(path):
+            self._write(path, zlib.compress(text.encode("utf-8")))
+        return key
+
+    def get(self, key):
+        """Read a stored text.
+
+        :param key: hash of the text
+        :type key: str
+        :returns: text
+        :rtype: str
+        :raises KeyError: if the text isn't stored
+
+        """
+        try:
+            with open(self._path("blobs", key, ".zz"), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return os.path.exists(self._path("blobs", key, ".zz"))
+
+    def put_result(self, key, result, name="newsplease"):
+        """Memoize the result of processing a stored text, e.g. the extracted article text.
+
+        :param key: hash of the text
+        :type key: str
+        :param result: JSON serializable result, e.g. {"article_maintext": "..."}
+        :type result: dict
+        :param name: name of the processing step, e.g. the extractor (Default value = "newsplease")
+        :type name: str
+
+        """
+        data = json.dumps(result).encode("utf-8")
+        self._write(self._path(os.path.join("results", name), key, ".json"), data)
+
+    def get_result(self, key, name="newsplease"):
+        """Read a memoized result, see put_result().
+
+        :param key: hash of the text
+        :type key: str
+        :param name: name of the processing step (Default value = "newsplease")
+        :type name: str
+        :returns: result, or None if it wasn't memoized
+        :rtype: dict, None
+
+        """
+        try:
+            with open(
+                self._path(os.path.join("results", name), key, ".json"), "rb"
+            ) as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,541 @@
+"""
+This module extracts the main text of news articles from their HTML.
+NewsContent.set_article_maintext() calls these functions directly, and the
+extraction pipeline of fetch_urls() calls them from a pool of worker processes.
+
+A crawl can also leave the extraction for later (see `defer_extraction` in fetch_urls()),
+storing the HTML compressed. extract_maintext() then fills in the article text of
+the fetched .jsonl file in bulk.
+
+The extractor is pluggable: NewsPlease is the default, "fast" is a density-based extractor
+which is much cheaper (see html_utils.MaintextParser), and "auto" only falls back to NewsPlease
+when the fast extractor's text looks too short. The extractor can be chosen per domain,
+see select_extractor().
+
+Some pages take NewsPlease minutes to parse. With a time limit, timed_maintext() runs the
+extraction in a worker process, which is killed if a document takes too long, and replaced
+if it crashes.
+"""
+
+__all__ = [
+    "newsplease_maintext",
+    "fast_maintext",
+    "auto_maintext",
+    "EXTRACTORS",
+    "select_extractor",
+    "timed_maintext",
+    "ExtractionTimeout",
+    "ExtractionCrashed",
+    "TimedExtractor",
+    "init_worker",
+    "compress_text",
+    "decompress_text",
+    "extract_maintext",
+]
+
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+
+import newspaper
+from newsplease import NewsPlease
+from urlexpander.core import constants, html_utils, io_utils
+from urlexpander.extended import writers
+
+LOGGER = logging.getLogger(__name__)
+
+# value of `resolved_text_encoding` for HTML compressed by compress_text()
+COMPRESSED_ENCODING = "zlib+base64"
+
+# value of `maintext_status` when the extraction exceeded its time limit
+TIMEOUT_STATUS = "timeout"
+
+# value of `maintext_status` when the worker process died while it extracted the article text
+CRASHED_STATUS = "crashed"
+
+# auto_maintext() falls back to NewsPlease when the fast extractor finds fewer characters
+FALLBACK_MIN_LENGTH = 500
+
+
+class ExtractionTimeout(Exception):
+    """The extraction of a document exceeded its time limit"""
+
+
+class ExtractionCrashed(Exception):
+    """The worker process died while it extracted a document"""
+
+
+def newsplease_maintext(html, url):
+    """Extract the article text from the HTML with NewsPlease
+
+    :param html: HTML of the webpage
+    :type html: str
+    :param url: URL of the webpage
+    :type url: str
+    :returns: maintext-> article text, "" if the extraction failed, or None if NewsPlease found no text
+    :rtype: str, None
+
+    """
+    try:
+        article = NewsPlease.from_html(html=html, url=url)
+        return article.maintext
+    except newspaper.article.ArticleException as exc:
+        LOGGER.info(
+            f"Failed to extract article's maintext due to ArticleException, {str(exc)}",
+        )
+        return ""
+    except Exception as exc:
+        LOGGER.info(
+            f"Failed to extract article's maintext due to unknown exception, {str(exc)}",
+        )
+        return ""
+
+
+def fast_maintext(html, url):
+    """Extract the article text from the HTML by the density of its paragraphs, see html_utils.MaintextParser
+
+    :param html: HTML of the webpage
+    :type html: str
+    :param url: URL of the webpage
+    :type url: str
+    :returns: maintext-> article text, or "" if no paragraphs were found
+    :rtype: str
+
+    """
+    try:
+        return html_utils.search_webpage_maintext(html)
+    except Exception as exc:
+        LOGGER.info(
+            f"Failed to extract article's maintext due to unknown exception, {str(exc)}",
+        )
+        return ""
+
+
+def auto_maintext(html, url):
+    """Extract the article text with fast_maintext(), falling back to NewsPlease
+    if the text is shorter than FALLBACK_MIN_LENGTH characters
+
+    :param html: HTML of the webpage
+    :type html: str
+    :param url: URL of the webpage
+    :type url: str
+    :returns: maintext-> article text
+    :rtype: str, None
+
+    """
+    maintext = fast_maintext(html, url)
+    if len(maintext) < FALLBACK_MIN_LENGTH:
+        LOGGER.info(f"Falling back to NewsPlease for {url}")
+        maintext = newsplease_maintext(html, url) or maintext
+    return maintext
+
+
+# extractors by name: functions (html, url) -> article text
+EXTRACTORS = {
+    "newsplease": newsplease_maintext,
+    "fast": fast_maintext,
+    "auto": auto_maintext,
+}
+
+DEFAULT_EXTRACTOR = "newsplease"
+
+
+def select_extractor(extractor=None, domain=None):
+    """Look up the extractor for a webpage.
+
+    e.g., select_extractor({"cnn.com": "fast", "default": "auto"}, "cnn.com")
+
+    :param extractor: name in EXTRACTORS, a function (html, url) -> article text, or a dictionary
+        which maps domains to either, with the optional key "default" for the other domains;
+        None is "newsplease" (Default value = None)
+        - a function must be picklable (i.e., defined at the top level of a module) to run
+          in another process, e.g. with a time limit
+    :type extractor: str, function, dict
+    :param domain: domain of the webpage, e.g. `resolved_domain` (Default value = None)
+    :type domain: str
+    :returns: name, function-> name of the extractor (e.g., for memoizing its results) and the extractor
+    :rtype: tuple
+
+    """
+    if isinstance(extractor, dict):
+        extractor = extractor.get(domain, extractor.get("default"))
+    if extractor is None:
+        extractor = DEFAULT_EXTRACTOR
+    if callable(extractor):
+        return extractor.__name__, extractor
+    try:
+        return extractor, EXTRACTORS[extractor]
+    except KeyError:
+        raise ValueError(f"Unknown extractor: {extractor}") from None
+
+
+def _serve(conn):
+    """Loop of a TimedExtractor's worker process: extract each (html, url, extractor) which is received"""
+    # this module is imported by now, tell TimedExtractor._start() that the worker is ready
+    conn.send(None)
+    while True:
+        try:
+            html, url, extractor = conn.recv()
+        except EOFError:
+            return
+        conn.send(extractor(html, url))
+
+
+class TimedExtractor:
+    """Extracts article text in a worker process, which is killed when a document exceeds its time limit.
+
+    The worker is reused across documents, and it's restarted after it's killed.
+    It has a core to itself while it runs, so the limit on its wall-clock time also bounds
+    the CPU time spent on a document.
+
+    The worker is started with constants.PROCESS_START_METHOD ("spawn") rather than forked,
+    because the extractors are called from threads.
+    So the extractor must be picklable, and the worker imports its module afresh.
+    A process which inherits a TimedExtractor by forking starts its own worker process.
+
+    e.g.,
+        extractor = TimedExtractor()
+        try:
+            maintext = extractor.extract(html, url, timeout=30)
+        except (ExtractionTimeout, ExtractionCrashed):
+            maintext = ""
+
+    """
+
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        # process which started the worker, only it can wait for the worker
+        self._owner = None
+
+    def _start(self):
+        self._owner = os.getpid()
+        context = multiprocessing.get_context(constants.PROCESS_START_METHOD)
+        self._conn, child_conn = context.Pipe()
+        try:
+            process = context.Process(target=_serve, args=(child_conn,), daemon=True)
+            process.start()
+        finally:
+            child_conn.close()
+        self._process = process
+        # the time limit doesn't include the start of the worker, which imports this module
+        self._conn.recv()
+
+    def extract(self, html, url, timeout, extractor=newsplease_maintext):
+        """Extract the article text from the HTML within a time limit.
+
+        :param html: HTML of the webpage
+        :type html: str
+        :param url: URL of the webpage
+        :type url: str
+        :param timeout: number of seconds the extraction may take
+        :type timeout: float
+        :param extractor: picklable function (html, url) -> article text (Default value = newsplease_maintext)
+        :type extractor: function
+        :returns: maintext-> see newsplease_maintext()
+        :rtype: str, None
+        :raises ExtractionTimeout: if the extraction took longer than ``timeout`` seconds
+        :raises ExtractionCrashed: if the worker process died, e.g. if the extractor raised
+            an exception or the process ran out of memory; the next extraction starts a new worker
+
+        """
+        try:
+            if (
+                self._process is None
+                or self._owner != os.getpid()
+                or not self._process.is_alive()
+            ):
+                self.close()
+                self._start()
+            self._conn.send((html, url, extractor))
+            if not self._conn.poll(timeout):
+                LOGGER.warning(f"Killing the extraction of {url} after {timeout}s")
+                self.close()
+                raise ExtractionTimeout(f"Extracting {url} took longer than {timeout}s")
+            return self._conn.recv()
+        except (EOFError, OSError) as exc:
+            LOGGER.warning(f"The worker process died while extracting {url}")
+            self.close()
+            raise ExtractionCrashed(
+                f"The worker process died while extracting {url}"
+            ) from exc
+
+    def close(self):
+        """Stop the worker process."""
+        if self._process is not None:
+            if self._owner == os.getpid():
+                self._process.kill()
+                self._process.join()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            # e.g., at interpreter shutdown, when multiprocessing stops daemon processes itself
+            pass
+
+
+# each thread has its own TimedExtractor, so threads extract in parallel
+_extractors = threading.local()
+
+
+def timed_maintext(html, url, timeout=None, extractor=newsplease_maintext):
+    """Extract the article text from the HTML within a time limit.
+
+    :param html: HTML of the webpage
+    :type html: str
+    :param url: URL of the webpage
+    :type url: str
+    :param timeout: number of seconds the extraction may take, or None to run it
+        in this process without a limit (Default value = None)
+    :type timeout: float
+    :param extractor: function (html, url) -> article text, see select_extractor() (Default value = newsplease_maintext)
+    :type extractor: function
+    :returns: maintext-> see newsplease_maintext()
+    :rtype: str, None
+    :raises ExtractionTimeout: if the extraction took longer than ``timeout`` seconds
+    :raises ExtractionCrashed: if the worker process died during the extraction
+
+    """
+    if timeout is None:
+        return extractor(html, url)
+    worker = getattr(_extractors, "worker", None)
+    if worker is None:
+        worker = _extractors.worker = TimedExtractor()
+    return worker.extract(html, url, timeout, extractor)
+
+
+def init_worker():
+    """Initializer for extraction worker processes.
+    Runs NewsPlease once so that its dependencies are imported before the first real article.
+    """
+    newsplease_maintext("<html><head><title></title></head><body></body></html>", "")
+
+
+def compress_text(text):
+    """Compress text so that it can be stored in a JSON string.
+
+    :param text: text, e.g. HTML
+    :type text: str
+    :returns: compressed-> base64 of the zlib-compressed UTF-8 text
+    :rtype: str
+
+    """
+    return base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii")
+
+
+def decompress_text(text, encoding):
+    """Reverse compress_text().
+
+    :param text: stored text
+    :type text: str
+    :param encoding: how the text is stored, "zlib+base64" or "" if it isn't compressed
+    :type encoding: str
+    :returns: text
+    :rtype: str
+
+    """
+    if not encoding:
+        return text
+    if encoding != COMPRESSED_ENCODING:
+        raise ValueError(f"Unknown text encoding: {encoding}")
+    return zlib.decompress(base64.b64decode(text)).decode("utf-8")
+
+
+def _extract_record(record, blob_store=None, timeout=None, extractor=None):
+    """Fill in the article text of a record whose extraction was deferred"""
+    name, extractor = select_extractor(extractor, record.get("resolved_domain"))
+    key = record.get("resolved_text_hash")
+    if key and blob_store is None:
+        raise ValueError(
+            f"The HTML of {record.get('original_url')} is in a blob store, please pass its blob_store"
+        )
+    if key:
+        result = blob_store.get_result(key, name=name)
+        if result is not None:
+            record["article_maintext"] = result["article_maintext"]
+            record["maintext_status"] = "extracted"
+            return record
+        html = blob_store.get(key)
+    else:
+        html = decompress_text(
+            record.get("resolved_text") or "", record.get("resolved_text_encoding")
+        )
+
+    try:
+        record["article_maintext"] = (
+            timed_maintext(
+                html=html,
+                url=record.get("resolved_url"),
+                timeout=timeout,
+                extractor=extractor,
+            )
+            if html
+            else ""
+        )
+    except ExtractionTimeout:
+        record["article_maintext"] = ""
+        record["maintext_status"] = TIMEOUT_STATUS
+        return record
+    except ExtractionCrashed:
+        record["article_maintext"] = ""
+        record["maintext_status"] = CRASHED_STATUS
+        return record
+    record["maintext_status"] = "extracted"
+    if key:
+        blob_store.put_result(
+            key, dict(article_maintext=record["article_maintext"]), name=name
+        )
+    return record
+
+
+def _extract_lines(
+    lines, filter_function, parser, blob_store=None, timeout=None, extractor=None
+):
+    """Extract the article text of the deferred records in a batch of lines.
+
+    :returns: lines-> the output lines, in the same order
+    :rtype: list
+
+    """
+    loads = io_utils.get_json_loads(parser)
+    output = []
+    for line in lines:
+        record = loads(line)
+        if record.get("maintext_status") == "deferred" and (
+            filter_function is None or filter_function(record)
+        ):
+            record = _extract_record(
+                record, blob_store=blob_store, timeout=timeout, extractor=extractor
+            )
+            line = (json.dumps(record) + "\n").encode("utf-8")
+        output.append(line)
+    return output
+
+
+def _count_complete_lines(file):
+    """Count the lines of an output file, removing an incomplete last line left by a crash"""
+    if not os.path.exists(file):
+        return 0
+    n_lines = 0
+    end = 0
+    for offset, line in io_utils.iter_lines(file):
+        if not line.endswith(b"\n"):
+            break
+        n_lines += 1
+        end = offset + len(line)
+    if end != os.path.getsize(file):
+        with open(file, "r+b") as f:
+            f.truncate(end)
+    return n_lines
+
+
+def extract_maintext(
+    path,
+    filename="fetched.jsonl",
+    output_filename=None,
+    n_processes=1,
+    filter_function=None,
+    batch_size=100,
+    parser="auto",
+    blob_store=None,
+    timeout=None,
+    extractor=None,
+):
+    """Extract the article text of fetched content whose extraction was deferred.
+
+    The records are written to a new file in the same order, with `article_maintext` filled in.
+    Records which were already extracted, or which are filtered out, are copied unchanged.
+    The extraction is resumable: if the output file exists, the records which it already
+    contains are skipped.
+
+    e.g., extract_maintext(path, "fetched.jsonl", n_processes=8,
+                           filter_function=lambda record: record["resolved_domain"] == "cnn.com")
+
+    :param path: path to the directory
+    :type path: str
+    :param filename: name of the fetched .jsonl file, or of its shards (Default value = "fetched.jsonl")
+    :type filename: str
+    :param output_filename: name of the output file, e.g. 'fetched-extracted.jsonl' if None (Default value = None)
+    :type output_filename: str
+    :param n_processes: number of worker processes (Default value = 1)
+    :type n_processes: int
+    :param filter_function: only extract the records for which this returns True,
+        or all deferred records if None (Default value = None)
+        - it must be picklable (i.e., defined at the top level of a module) if n_processes > 1
+    :type filter_function: function
+    :param batch_size: number of records handed to a process at a time (Default value = 100)
+    :type batch_size: int
+    :param parser: JSON parser, see io_utils.get_json_loads() (Default value = "auto")
+    :type parser: str
+    :param blob_store: the store which has the HTML of records with a `resolved_text_hash`;
+        the article text memoized for identical HTML is reused (Default value = None)
+        - required if the fetched content was stored with a blob_store, otherwise a ValueError is raised
+    :type blob_store: blobstore.BlobStore
+    :param timeout: number of seconds the extraction of one record may take, or None for no limit (Default value = None)
+        - the `maintext_status` of a record which takes longer is "timeout", and its HTML is kept
+        - it's "crashed" if the worker process died, e.g. if it ran out of memory
+    :type timeout: float
+    :param extractor: extractor, or extractors by domain, see select_extractor() (Default value = None)
+    :type extractor: str, function, dict
+    :returns: n_records-> number of records in the output file
+    :rtype: int
+
+    """
+    if output_filename is None:
+        stem, ext = os.path.splitext(filename)
+        output_filename = f"{stem}-extracted{ext}"
+    output_file = os.path.join(path, output_filename)
+
+    n_done = _count_complete_lines(output_file)
+    if n_done:
+        LOGGER.info(f"Resuming after the {n_done} records in {output_file}")
+
+    def batches():
+        n_skipped = 0
+        batch = []
+        for file in writers.list_shards(path, filename):
+            for _, line in io_utils.iter_lines(file):
+                if not line.strip():
+                    continue
+                if n_skipped < n_done:
+                    n_skipped += 1
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    n_records = n_done
+    with open(output_file, "ab") as f:
+
+        def write(lines):
+            # the output is flushed batch by batch, so a crash loses at most the batches in flight
+            f.write(b"".join(lines))
+            f.flush()
+            return len(lines)
+
+        # the batches are written in order
+        for lines in io_utils.map_in_processes(
+            _extract_lines,
+            (
+                (batch, filter_function, parser, blob_store, timeout, extractor)
+                for batch in batches()
+            ),
+            n_processes=n_processes,
+            initializer=init_worker,
+        ):
+            n_records += write(lines)
+    return n_records
@@ -12,85 +12,264 @@ __all__ = [
     "fetch_urls",
     "fetch_urls_to_file",
     "load_fetched_from_file",
+    "arrow_schema",
 ]
 
+import collections
+import concurrent.futures
 import datetime
 import inspect
+import itertools
 import json
 import logging
+import multiprocessing
 import os
+import queue
 import re
+import sys
+import threading
 import time
+import urllib.parse
 from random import randint
 
-import newspaper
 import waybackpy
-from newsplease import NewsPlease
-from urlexpander.core import api, constants, url_utils
+from urlexpander.core import api, constants, html_utils, url_utils
+from urlexpander.extended import archive, extraction, readers, writers
 from waybackpy.exceptions import URLError, WaybackError
 
 LOGGER = logging.getLogger(__name__)
 
+# every request to the Wayback Machine goes to the same host,
+# so concurrent fetches take turns (see constants.ARCHIVE_MAX_CONCURRENCY)
+_ARCHIVE_SLOTS = threading.BoundedSemaphore(constants.ARCHIVE_MAX_CONCURRENCY)
+
+
+def _json_default(o):
+    """Make the non-primitive values of NewsContent JSON serializable.
+
+    Default JSON serializable types are bool, int, float, str, list, and dict.
+    Modify this function to address other non-primitive types.
+    """
+    if isinstance(o, datetime.datetime):
+        # https://docs.python.org/3/library/datetime.html#datetime.datetime.isoformat
+        # Return a string representing the date and time in ISO 8601 format
+        # e.g., '2019-05-18T15:17:00+00:00'
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+# created once and reused by every NewsContent.to_json() call
+_JSON_ENCODER = json.JSONEncoder(default=_json_default)
+
 
 class NewsContent:
     """The fetching functions hydrate instances of this class.
 
+    The fields are stored in slots rather than a per-instance __dict__.
+    The key-values which are passed along to the output are kept in `extra`.
+
     :param original_url: URL
     :type original_url: str
+    :param FETCH_FUNCTION: name of the fetching function (Default value = None)
+        - if None, the name of the function which created the instance
+    :type FETCH_FUNCTION: str
     :param **kwargs:
-        - each kwarg is added as an attribute along with its provided value.
+        - each kwarg is added to the output along with its provided value.
         - both the argument and the value must be JSON serializable: see to_json().
-        - e.g., if "outlet=CNN" is a kwarg, "self.outlet" is added with a value of "CNN".
+        - e.g., if "outlet=CNN" is a kwarg, "self.outlet" returns "CNN".
 
     """
 
+    # the fields in the order of the output, after any kwargs
+    FIELDS = (
+        "article_maintext",
+        "maintext_status",
+        "original_url",
+        "resolved_url",
+        "resolved_domain",
+        "resolved_netloc",
+        "standardized_url",
+        "is_generic_url",
+        "canonical_url",
+        "response_code",
+        "response_reason",
+        "response_etag",
+        "response_last_modified",
+        "fetch_error",
+        "resolved_text",
+        "resolved_text_encoding",
+        "resolved_text_hash",
+        "FETCH_FUNCTION",
+        "FETCH_AT",
+    )
+
+    __slots__ = ("extra",) + FIELDS
+
     def __init__(
         self,
         original_url,
+        FETCH_FUNCTION=None,
         **kwargs,
     ):
 
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        self.extra = kwargs
 
         self.article_maintext = ""
+        # "extracted" once the article text is extracted, "deferred" if it's left for
+        # extraction.extract_maintext(), "timeout" if the extraction exceeded its time limit,
+        # "crashed" if the worker process which extracted it died
+        self.maintext_status = ""
         self.original_url = original_url
-        # self.response_url = ""
         self.resolved_url = ""
         self.resolved_domain = ""
         self.resolved_netloc = ""
         self.standardized_url = ""
         self.is_generic_url = ""
+        # from <link rel="canonical"> or og:url, used to spot copies of the same article
+        self.canonical_url = ""
 
         # for troubleshooting
         self.response_code = ""
         self.response_reason = ""
+        # validators of the response, for conditional requests when the page is fetched again
+        self.response_etag = ""
+        self.response_last_modified = ""
         self.fetch_error = ""
         # processed response text (HTML):
         # backup option which can be parsed if `article_maintext` returns None
         self.resolved_text = ""
-        # https://stackoverflow.com/a/5067654
-        self.FETCH_FUNCTION = inspect.currentframe().f_back.f_code.co_name
+        # "" if `resolved_text` is plain HTML, "zlib+base64" if it's compressed
+        self.resolved_text_encoding = ""
+        # hash of the HTML if it was moved to a blob store, see store_text()
+        self.resolved_text_hash = ""
+        if FETCH_FUNCTION is None:
+            # https://stackoverflow.com/a/5067654
+            FETCH_FUNCTION = sys._getframe(1).f_code.co_name
+        self.FETCH_FUNCTION = FETCH_FUNCTION
         self.FETCH_AT = datetime.datetime.now(datetime.timezone.utc)
 
-    def set_article_maintext(self):
-        """Extract the article text from the HTML with NewsPlease"""
+    def __getattr__(self, name):
+        # only called for names which aren't fields, e.g. "outlet"
+        try:
+            return object.__getattribute__(self, "extra")[name]
+        except KeyError:
+            raise AttributeError(
+                f"'NewsContent' object has no attribute '{name}'"
+            ) from None
+
+    def set_article_maintext(
+        self, canonical_index=None, blob_store=None, timeout=None, extractor=None
+    ):
+        """Extract the article text from the HTML, with NewsPlease unless another extractor is chosen
+
+        :param canonical_index: article text already extracted in this run, keyed by standardized canonical URL (Default value = None)
+            - if the page's canonical URL is in the index, its article text is reused instead of running NewsPlease
+            - newly extracted article text is added to the index
+        :type canonical_index: dict
+        :param blob_store: store the HTML and reuse the article text extracted from identical HTML,
+            including in previous runs (Default value = None)
+        :type blob_store: blobstore.BlobStore
+        :param timeout: number of seconds NewsPlease may take, or None for no limit (Default value = None)
+            - the extraction runs in a worker process, which is killed if it takes longer
+            - the `maintext_status` is then "timeout" and the article text is empty,
+              or "crashed" if the worker process died
+        :type timeout: float
+        :param extractor: extractor, or extractors by domain, see extraction.select_extractor() (Default value = None)
+            - e.g., "fast", or {"cnn.com": "fast", "default": "auto"}
+        :type extractor: str, function, dict
+
+        """
+        key = None
+        if canonical_index is not None:
+            key = self._canonical_key()
+            if key is not None and key in canonical_index:
+                LOGGER.info(f"Reusing article's maintext extracted for {key}")
+                self.article_maintext = canonical_index[key]
+                self.maintext_status = "extracted"
+                return
+
+        name, extractor = extraction.select_extractor(extractor, self.resolved_domain)
+        html = extraction.decompress_text(
+            self.resolved_text, self.resolved_text_encoding
+        )
+        if blob_store is not None and html:
+            self.resolved_text_hash = blob_store.put(html)
+            result = blob_store.get_result(self.resolved_text_hash, name=name)
+            if result is not None:
+                LOGGER.info(
+                    f"Reusing article's maintext extracted for {self.resolved_text_hash}"
+                )
+                self.article_maintext = result["article_maintext"]
+                self.maintext_status = "extracted"
+                return
 
         try:
-            article = NewsPlease.from_html(
-                html=self.resolved_text, url=self.resolved_url
-            )
-            self.article_maintext = article.maintext
-        except newspaper.article.ArticleException as exc:
-            LOGGER.info(
-                f"Failed to extract article's maintext due to ArticleException, {str(exc)}",
+            self.article_maintext = extraction.timed_maintext(
+                html=html, url=self.resolved_url, timeout=timeout, extractor=extractor
             )
+        except extraction.ExtractionTimeout:
             self.article_maintext = ""
-        except Exception as exc:
-            LOGGER.info(
-                f"Failed to extract article's maintext due to unknown exception, {str(exc)}",
-            )
+            self.maintext_status = extraction.TIMEOUT_STATUS
+            return
+        except extraction.ExtractionCrashed:
             self.article_maintext = ""
+            self.maintext_status = extraction.CRASHED_STATUS
+            return
+        self.maintext_status = "extracted"
+
+        if key is not None and self.article_maintext:
+            canonical_index[key] = self.article_maintext
+        if self.resolved_text_hash:
+            blob_store.put_result(
+                self.resolved_text_hash,
+                dict(article_maintext=self.article_maintext),
+                name=name,
+            )
+
+    def defer_article_maintext(self):
+        """Leave the article text to be extracted later by extraction.extract_maintext().
+        The HTML is compressed in the meantime.
+        """
+        self.maintext_status = "deferred"
+        if self.resolved_text and not self.resolved_text_encoding:
+            self.resolved_text = extraction.compress_text(self.resolved_text)
+            self.resolved_text_encoding = extraction.COMPRESSED_ENCODING
+
+    def store_text(self, blob_store):
+        """Move the HTML into a content-addressed blob store.
+        `resolved_text` is emptied and `resolved_text_hash` references the stored HTML.
+        """
+        if self.resolved_text and not self.resolved_text_hash:
+            self.resolved_text_hash = blob_store.put(
+                extraction.decompress_text(
+                    self.resolved_text, self.resolved_text_encoding
+                )
+            )
+        self.resolved_text = ""
+        self.resolved_text_encoding = ""
+
+    def set_canonical_url(self):
+        """Set the canonical URL declared in the HTML's <head>"""
+        canonical_url = html_utils.search_webpage_canonical_url(self.resolved_text)
+        if canonical_url:
+            # resolve relative URLs, e.g. "/2021/11/05/story"
+            self.canonical_url = urllib.parse.urljoin(self.resolved_url, canonical_url)
+        else:
+            self.canonical_url = ""
+
+    def _canonical_key(self):
+        """Key of the canonical URL in a canonical index.
+
+        :returns key: standardized canonical URL, or None if it can't identify an article
+        :rtype: str, None
+
+        """
+        if not self.canonical_url or url_utils.is_generic_url(self.canonical_url):
+            return None
+        key = url_utils.standardize_url(self.canonical_url)
+        if key == "ERROR":
+            return None
+        return key
 
     def set_fetch_error_ind(self):
         """Set indicator for whether a fetch attempt resulted in an error"""
@@ -129,30 +308,116 @@ class NewsContent:
         """Set indicator for whether a URL is generic"""
         self.is_generic_url = url_utils.is_generic_url(self.resolved_url)
 
+    def reuse_previous(self, previous):
+        """Copy the content of a previous record of the page, after the server replied it didn't change.
+
+        :param previous: previous record of the page
+        :type previous: dict
+
+        """
+        for field in _NOT_MODIFIED_FIELDS:
+            setattr(self, field, previous.get(field, getattr(self, field)))
+        # keep the previous validators unless the server sent new ones
+        self.response_etag = self.response_etag or previous.get("response_etag", "")
+        self.response_last_modified = self.response_last_modified or previous.get(
+            "response_last_modified", ""
+        )
+
+    def to_dict(self):
+        """Convert NewsContent instance into a dictionary.
+        The kwargs come first, followed by the fields (a field overrides a kwarg with the same name).
+        """
+        fetched = dict(self.extra)
+        for field in self.FIELDS:
+            fetched[field] = getattr(self, field)
+        return fetched
+
     def to_json(self):
         """Convert NewsContent instance into a JSON string"""
-        # https://stackoverflow.com/a/27058505
-        class CustomEncoder(json.JSONEncoder):
-            """
-            Default JSON serializable types are bool, int, float, and str.
-            CustomEncoder is a subclass of json.JSONEncoder.
-            It modifies datetime and dictionary types to make them JSON serializable.
-            Modify this subclass to address other non-primitive types.
-            """
-
-            def default(self, o):
-                if isinstance(o, datetime.datetime):
-                    # https://docs.python.org/3/library/datetime.html#datetime.datetime.isoformat
-                    # Return a string representing the date and time in ISO 8601 format
-                    # e.g., '2019-05-18T15:17:00+00:00'
-                    return o.isoformat()
-                elif isinstance(o, dict):
-                    return json.dumps(o)
-                return json.JSONEncoder.default(self, o)
-
-        fetched = self.__dict__
-        fetched_json = json.dumps(fetched, cls=CustomEncoder)
-        return fetched_json
+        return _JSON_ENCODER.encode(self.to_dict())
+
+
+# the fields which are copied from the previous record when a page wasn't modified
+_NOT_MODIFIED_FIELDS = (
+    "article_maintext",
+    "maintext_status",
+    "canonical_url",
+    "resolved_text",
+    "resolved_text_encoding",
+    "resolved_text_hash",
+)
+
+
+def arrow_schema():
+    """Schema of the fetched content in Parquet and Arrow IPC files, see writers.ArrowWriter.
+    Requires pyarrow.
+
+    The columns are "extra", which has the key-values passed along as a JSON object,
+    followed by NewsContent.FIELDS. `resolved_domain`, `maintext_status`, and
+    `FETCH_FUNCTION` are dictionary-encoded.
+
+    :returns: schema
+    :rtype: pyarrow.Schema
+
+    """
+    import pyarrow as pa
+
+    types = dict(
+        maintext_status=pa.dictionary(pa.int8(), pa.string()),
+        resolved_domain=pa.dictionary(pa.int32(), pa.string()),
+        is_generic_url=pa.bool_(),
+        response_code=pa.int32(),
+        fetch_error=pa.bool_(),
+        resolved_text=pa.large_string(),
+        FETCH_FUNCTION=pa.dictionary(pa.int8(), pa.string()),
+        FETCH_AT=pa.timestamp("us", tz="UTC"),
+    )
+    return pa.schema(
+        [pa.field("extra", pa.string())]
+        + [
+            pa.field(field, types.get(field, pa.string()))
+            for field in NewsContent.FIELDS
+        ]
+    )
+
+
+def _arrow_record(fetched):
+    """Convert the output of a fetching function into a record which matches arrow_schema()
+
+    :param fetched: NewsContent instance or stringified JSON object
+    :type fetched: NewsContent, str
+    :returns: record
+    :rtype: dict
+
+    """
+    if isinstance(fetched, NewsContent):
+        fetched = fetched.to_dict()
+    else:
+        fetched = json.loads(fetched)
+
+    extra = {k: v for k, v in fetched.items() if k not in NewsContent.FIELDS}
+    record = dict(extra=_JSON_ENCODER.encode(extra))
+    for field in NewsContent.FIELDS:
+        value = fetched.get(field)
+        if field in ("is_generic_url", "fetch_error"):
+            value = value if isinstance(value, bool) else None
+        elif field == "response_code":
+            # e.g., "" or NaN if there was no response
+            value = value if type(value) is int else None
+        elif field == "FETCH_AT":
+            if isinstance(value, str):
+                value = datetime.datetime.fromisoformat(value)
+        elif value is not None and not isinstance(value, str):
+            value = str(value)
+        record[field] = value
+    return record
+
+
+def _to_json(fetched):
+    """Serialize the output of a fetching function, which is either a NewsContent instance or already a JSON string"""
+    if isinstance(fetched, NewsContent):
+        return fetched.to_json()
+    return fetched
 
 
 def load_fetched_from_file(path, filename):
@@ -174,6 +439,478 @@ def load_fetched_from_file(path, filename):
                 yield data
 
 
+def _accepts_keyword(function, name):
+    """Whether a function can be called with the keyword argument ``name``"""
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        # e.g., some builtins have no signature, so let the call decide
+        return True
+    return any(
+        p.kind == p.VAR_KEYWORD
+        or (p.name == name and p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY))
+        for p in parameters
+    )
+
+
+def _iter_url_dicts(urls):
+    """Split each input dictionary into its URL and the key-values to pass along.
+
+    :param urls: URL(s) to fetch, see fetch_urls()
+    :type urls: dict, Iterable[dict]
+    :returns: n, url, kwargs-> position in the input, URL, remaining key-values
+    :rtype: Generator[tuple]
+
+    """
+    if isinstance(urls, dict):
+        urls = [urls]
+
+    for n, url_dict in enumerate(urls):
+        # dictionaries are mutable so work off a copy to avoid modifying the input
+        d = url_dict.copy()
+        try:
+            # Collect the value of the 'url' key if it exists and
+            # remove it from the dictionary before calling fetch_function.
+            # the remaining key-values are passed as optional kwargs.
+            url = d.pop("url")
+        except KeyError:
+            LOGGER.error(
+                "Fetch failed to start, please provide a 'url' key-value in the input dictionary."
+            )
+            continue
+        yield n, url, d
+
+
+def _fetch_concurrently(tasks, fetch, n_workers, preserve_order, live_requests=None):
+    """Run ``fetch`` on the tasks with multiple threads while being polite to each domain.
+
+    At most one request per domain is in flight at a time, so requests to the same domain
+    stay as spaced out as in a sequential run while requests to different domains overlap.
+
+    :param tasks: (n, url, kwargs) tuples, see _iter_url_dicts()
+    :type tasks: Iterable[tuple]
+    :param fetch: called with (n, url, kwargs) for each task
+    :type fetch: function
+    :param n_workers: number of threads
+    :type n_workers: int
+    :param preserve_order: yield the results in the order of the tasks
+    :type preserve_order: bool
+    :param live_requests: domain -> future of a live request which ``fetch`` abandoned while it was running,
+        see _fetch_url_hedged(); the domain stays busy until it has finished (Default value = None)
+    :type live_requests: dict
+    :returns: results of fetch
+    :rtype: Generator
+
+    """
+    tasks = iter(tasks)
+    # the number of tasks read ahead of the results, which bounds memory use
+    max_pending = max(100, 10 * n_workers)
+    pending = collections.OrderedDict()  # domain -> deque of (position, task)
+    busy = set()  # domains with a request in flight
+    in_flight = {}  # future -> (position, domain)
+    finished = {}  # position -> result, waiting for its turn if preserve_order
+    n_pending = 0
+    n_read = 0
+    n_yielded = 0
+    exhausted = False
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        while True:
+            while not exhausted and n_pending + len(finished) < max_pending:
+                try:
+                    task = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                domain = url_utils.get_domain(task[1])
+                pending.setdefault(domain, collections.deque()).append((n_read, task))
+                n_pending += 1
+                n_read += 1
+
+            for domain in list(pending):
+                if len(in_flight) >= n_workers:
+                    break
+                if domain in busy or _is_running(live_requests, domain):
+                    continue
+                position, task = pending[domain].popleft()
+                if not pending[domain]:
+                    del pending[domain]
+                n_pending -= 1
+                busy.add(domain)
+                in_flight[executor.submit(fetch, *task)] = (position, domain)
+
+            # the pending domains which wait for an abandoned live request
+            waiting = [
+                future
+                for domain, future in (live_requests or {}).copy().items()
+                if domain in pending
+            ]
+            if not in_flight and not waiting:
+                break
+
+            done, _ = concurrent.futures.wait(
+                list(in_flight) + waiting,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                if future not in in_flight:
+                    continue
+                position, domain = in_flight.pop(future)
+                busy.discard(domain)
+                if preserve_order:
+                    finished[position] = future.result()
+                else:
+                    yield future.result()
+
+            while n_yielded in finished:
+                yield finished.pop(n_yielded)
+                n_yielded += 1
+
+
+def _is_running(live_requests, domain):
+    """Check if an abandoned live request to the domain is still running, see _fetch_url_hedged()"""
+    if not live_requests or domain not in live_requests:
+        return False
+    if live_requests[domain].done():
+        del live_requests[domain]
+        return False
+    return True
+
+
+# marks the end of the records in the pipeline's queue
+_END_OF_RECORDS = object()
+
+
+def _extract_in_processes(
+    fetched,
+    n_processes,
+    queue_size=100,
+    dedup_canonical=False,
+    blob_store=None,
+    timeout=None,
+    extractor=None,
+):
+    """Extract the article text of fetched content in a pool of worker processes.
+
+    The fetching runs in a background thread, which hands the HTML of each page to the pool
+    as soon as it's fetched, so that requests keep being sent while NewsPlease runs.
+    Each record waits for its article text in a bounded queue, which is consumed
+    (e.g., by the writer) in the order the pages were fetched.
+
+    :param fetched: fetched content without article text, see _fetch_many()
+    :type fetched: Iterable[NewsContent]
+    :param n_processes: number of worker processes
+    :type n_processes: int
+    :param queue_size: number of records which can wait for their article text (Default value = 100)
+    :type queue_size: int
+    :param dedup_canonical: extract the article text once per canonical URL (Default value = False)
+    :type dedup_canonical: bool
+    :param blob_store: move the HTML into this store, and reuse the article text memoized for identical HTML (Default value = None)
+    :type blob_store: blobstore.BlobStore
+    :param timeout: number of seconds the extraction of one page may take, see NewsContent.set_article_maintext() (Default value = None)
+    :type timeout: float
+    :param extractor: extractor, or extractors by domain, see extraction.select_extractor() (Default value = None)
+    :type extractor: str, function, dict
+    :returns data: fetched content with article text
+    :rtype data: Generator[NewsContent]
+
+    """
+    records = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    # standardized canonical URL -> future of its article text
+    canonical_futures = {} if dedup_canonical else None
+
+    def put(item):
+        # stop waiting for space in the queue once the consumer is gone
+        while not stop.is_set():
+            try:
+                records.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(executor):
+        try:
+            for record in fetched:
+                future = None
+                result = None
+                name, function = extraction.select_extractor(
+                    extractor, record.resolved_domain
+                )
+                # a page which wasn't modified reuses its previous record, whose HTML may be compressed
+                # and whose extraction may have been deferred, see NewsContent.reuse_previous()
+                deferred = record.maintext_status == "deferred"
+                html = extraction.decompress_text(
+                    record.resolved_text, record.resolved_text_encoding
+                )
+                if html and blob_store is not None and not deferred:
+                    record.resolved_text_hash = blob_store.put(html)
+                    result = blob_store.get_result(record.resolved_text_hash, name=name)
+                if deferred:
+                    pass
+                elif result is not None:
+                    record.article_maintext = result["article_maintext"]
+                elif html and record.maintext_status != "extracted":
+                    key = None
+                    if canonical_futures is not None:
+                        key = record._canonical_key()
+                        future = canonical_futures.get(key)
+                    if future is not None:
+                        LOGGER.info(f"Reusing article's maintext extracted for {key}")
+                    else:
+                        future = executor.submit(
+                            extraction.timed_maintext,
+                            html,
+                            record.resolved_url,
+                            timeout,
+                            function,
+                        )
+                        if key is not None:
+                            canonical_futures[key] = future
+                if blob_store is not None:
+                    record.store_text(blob_store)
+                if not put((record, future, name)):
+                    return
+            put((_END_OF_RECORDS, None, None))
+        except BaseException as exc:
+            put((_END_OF_RECORDS, exc, None))
+        finally:
+            if hasattr(fetched, "close"):
+                fetched.close()
+
+    # the pool is first used by the producer thread while the fetching threads run, so it isn't forked
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_processes,
+        initializer=extraction.init_worker,
+        mp_context=multiprocessing.get_context(constants.PROCESS_START_METHOD),
+    ) as executor:
+        producer = threading.Thread(target=produce, args=(executor,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                record, future, name = records.get()
+                if record is _END_OF_RECORDS:
+                    if future is not None:
+                        # the fetching failed
+                        raise future
+                    break
+                if record.maintext_status != "deferred":
+                    record.maintext_status = "extracted"
+                if future is not None:
+                    try:
+                        record.article_maintext = future.result()
+                    except extraction.ExtractionTimeout:
+                        record.maintext_status = extraction.TIMEOUT_STATUS
+                    except extraction.ExtractionCrashed:
+                        record.maintext_status = extraction.CRASHED_STATUS
+                    if record.resolved_text_hash and not future.exception():
+                        blob_store.put_result(
+                            record.resolved_text_hash,
+                            dict(article_maintext=record.article_maintext),
+                            name=name,
+                        )
+                yield record
+        finally:
+            stop.set()
+            producer.join()
+            executor.shutdown(cancel_futures=True)
+
+
+def _wait_for_live_requests(tasks, live_requests):
+    """Before each task, wait for an abandoned live request to its domain to finish, see _fetch_url_hedged()"""
+    for task in tasks:
+        if live_requests:
+            future = live_requests.pop(url_utils.get_domain(task[1]), None)
+            if future is not None:
+                concurrent.futures.wait([future])
+        yield task
+
+
+def _prefetch_snapshots(tasks, archive_backend):
+    """Look up the archived snapshots of the tasks' URLs in batches, ahead of fetching them.
+
+    :param tasks: (n, url, kwargs) tuples, see _iter_url_dicts()
+    :type tasks: Iterable[tuple]
+    :param archive_backend: backend which caches the lookups
+    :type archive_backend: archive.ArchiveBackend
+    :returns: the tasks
+    :rtype: Generator[tuple]
+
+    """
+    tasks = iter(tasks)
+    while True:
+        window = list(itertools.islice(tasks, 10 * archive_backend.batch_size))
+        if not window:
+            return
+        archive_backend.prefetch(_archive_lookup_url(url) for _, url, _ in window)
+        yield from window
+
+
+def _fetch_many(
+    urls,
+    fetch_function,
+    verbose=1,
+    dedup_canonical=False,
+    n_workers=1,
+    preserve_order=False,
+    n_extract_processes=None,
+    queue_size=100,
+    defer_extraction=False,
+    archive_backend=None,
+    hedge_after=None,
+    blob_store=None,
+    refresh_from=None,
+    extract_timeout=None,
+    extractor=None,
+):
+    """Fetch the webpage contents for one URL or multiple URLs. See fetch_urls().
+
+    :returns data: fetched content, as NewsContent instances unless fetch_function is a custom function
+    :rtype data: Generator[NewsContent, str]
+
+    """
+    # the package's fetching functions are swapped for their versions which return NewsContent
+    # instances, so that the output is only serialized once
+    record_function = _RECORD_FUNCTIONS.get(fetch_function, fetch_function)
+
+    # the options which only apply to some of the package's fetching functions
+    any_function = (
+        [_request_active_url, _request_archived_url, _fetch_url],
+        "request_active_url, request_archived_url, or fetch_url",
+    )
+    requirements = [
+        ("defer_extraction", defer_extraction, any_function),
+        ("n_extract_processes", n_extract_processes, any_function),
+        ("archive_backend", archive_backend is not None, any_function),
+        ("blob_store", blob_store is not None, any_function),
+        ("extract_timeout", extract_timeout is not None, any_function),
+        ("extractor", extractor is not None, any_function),
+        ("hedge_after", hedge_after is not None, ([_fetch_url], "fetch_url")),
+        (
+            "refresh_from",
+            refresh_from is not None,
+            ([_request_active_url, _fetch_url], "request_active_url or fetch_url"),
+        ),
+    ]
+    for name, is_set, (functions, description) in requirements:
+        if is_set and record_function not in functions:
+            raise ValueError(f"{name} requires {description}")
+    # a custom fetch_function may keep its own canonical index
+    if (
+        dedup_canonical
+        and record_function not in any_function[0]
+        and not _accepts_keyword(record_function, "canonical_index")
+    ):
+        raise ValueError(
+            f"dedup_canonical requires {any_function[1]}, "
+            "or a fetch_function with a canonical_index parameter"
+        )
+
+    fetch_kwargs = {}
+    if defer_extraction or n_extract_processes:
+        # the article text is extracted later, by extract_maintext() or _extract_in_processes()
+        fetch_kwargs["extract"] = False
+    elif dedup_canonical:
+        fetch_kwargs["canonical_index"] = {}
+    if archive_backend is not None:
+        if record_function is not _request_active_url:
+            fetch_kwargs["archive_backend"] = archive_backend
+    if hedge_after is not None:
+        fetch_kwargs["hedge_after"] = hedge_after
+        # the domains whose live requests failed are shared across the run
+        fetch_kwargs["dead_domains"] = set()
+        fetch_kwargs["live_requests"] = {}
+    if blob_store is not None:
+        fetch_kwargs["blob_store"] = blob_store
+    if extract_timeout is not None:
+        fetch_kwargs["extract_timeout"] = extract_timeout
+    if extractor is not None:
+        fetch_kwargs["extractor"] = extractor
+    # with the extraction pipeline, the HTML is stored once its extraction is submitted
+    pipelined = bool(n_extract_processes) and not defer_extraction
+
+    def fetch(n, url, d):
+        msg = f"url {n}, {fetch_function.__name__}: {url}"
+        LOGGER.info(msg)
+        if verbose:
+            print(msg)
+        if refresh_from is not None:
+            d["previous"] = refresh_from.get(url)
+        fetched = record_function(url=url, **fetch_kwargs, **d)
+        if blob_store is not None and not pipelined:
+            fetched.store_text(blob_store)
+        if defer_extraction and fetched.maintext_status != "extracted":
+            fetched.defer_article_maintext()
+        return fetched
+
+    tasks = _iter_url_dicts(urls)
+    if archive_backend is not None and record_function is _request_archived_url:
+        # every URL is looked up in the archive, so the lookups can be batched
+        tasks = _prefetch_snapshots(tasks, archive_backend)
+    live_requests = fetch_kwargs.get("live_requests")
+    if n_workers > 1:
+        fetched = _fetch_concurrently(
+            tasks,
+            fetch,
+            n_workers=n_workers,
+            preserve_order=preserve_order,
+            live_requests=live_requests,
+        )
+    else:
+        fetched = (
+            fetch(n, url, d)
+            for n, url, d in _wait_for_live_requests(tasks, live_requests)
+        )
+
+    if pipelined:
+        fetched = _extract_in_processes(
+            fetched,
+            n_processes=n_extract_processes,
+            queue_size=queue_size,
+            dedup_canonical=dedup_canonical,
+            blob_store=blob_store,
+            timeout=extract_timeout,
+            extractor=extractor,
+        )
+    yield from fetched
+
+
+def _completed_keys(path, filename, resume_key, retry_errors):
+    """Collect the keys of the records which are already in the output.
+
+    :returns: keys-> values of ``resume_key`` which don't need to be fetched again
+    :rtype: set
+
+    """
+    fetch_errors = {}
+    for record in readers.read_fetched(
+        path, filename, fields=[resume_key, "fetch_error"]
+    ):
+        # the last record of a key is the most recent attempt
+        fetch_errors[record[resume_key]] = record["fetch_error"]
+    if retry_errors:
+        return {key for key, fetch_error in fetch_errors.items() if not fetch_error}
+    return set(fetch_errors)
+
+
+def _skip_completed(urls, completed, resume_key):
+    """Skip the input dictionaries whose key is in ``completed``"""
+    if isinstance(urls, dict):
+        urls = [urls]
+    n_skipped = 0
+    for url_dict in urls:
+        if resume_key == "original_url":
+            key = url_dict.get("url")
+        else:
+            key = url_dict.get(resume_key)
+        if key is not None and key in completed:
+            n_skipped += 1
+            continue
+        yield url_dict
+    LOGGER.info(f"Skipped {n_skipped} URLs which were already fetched")
+
+
 def fetch_urls_to_file(
     urls,
     fetch_function,
@@ -181,9 +918,31 @@ def fetch_urls_to_file(
     filename="fetched.jsonl",
     write_mode="a",
     verbose=1,
+    dedup_canonical=False,
+    n_workers=1,
+    preserve_order=False,
+    n_extract_processes=None,
+    queue_size=100,
+    defer_extraction=False,
+    archive_backend=None,
+    hedge_after=None,
+    blob_store=None,
+    refresh_from=None,
+    extract_timeout=None,
+    extractor=None,
+    resume=False,
+    resume_key="original_url",
+    retry_errors=False,
+    output_format="jsonl",
+    batch_size=100,
+    flush_interval=10,
+    fsync=False,
+    rotate_records=None,
+    rotate_bytes=None,
 ):
     """Fetch the webpage contents for one URL or multiple URLs.
     Outputs file where each line contains a URL's fetched content (stringified JSON object).
+    The output is written in batches, see writers.JsonlWriter.
 
     :param urls: URL(s) to fetch
         - required: 'url' key
@@ -198,42 +957,147 @@ def fetch_urls_to_file(
     :type write_mode: str
     :param verbose: 0 - don't print progress, 1 - print progress (Default value = 1)
     :type verbose: bool
+    :param dedup_canonical: reuse the article text of pages which share a canonical URL
+        with a page fetched earlier in the run, instead of extracting it again (Default value = False)
+        - a custom fetch_function must accept the run's index as `canonical_index`, otherwise a ValueError is raised
+    :type dedup_canonical: bool
+    :param n_workers: number of threads; requests to different domains overlap,
+        while each domain gets at most one request at a time (Default value = 1)
+    :type n_workers: int
+    :param preserve_order: with n_workers > 1, write the output in the order of the input
+        instead of the order in which the fetches finish (Default value = False)
+    :type preserve_order: bool
+    :param n_extract_processes: extract the article text in this many worker processes instead of
+        on the fetching threads, so that fetching, extraction, and writing run at the same time (Default value = None)
+    :type n_extract_processes: int
+    :param queue_size: with n_extract_processes, the number of fetched pages which can wait for
+        their article text (Default value = 100)
+    :type queue_size: int
+    :param defer_extraction: don't extract the article text while fetching, and store the HTML
+        compressed; see extraction.extract_maintext() (Default value = False)
+    :type defer_extraction: bool
+    :param archive_backend: look up and fetch archived snapshots with this backend instead of waybackpy;
+        with request_archived_url, the lookups are batched (Default value = None)
+    :type archive_backend: archive.ArchiveBackend
+    :param hedge_after: with fetch_url, request the archive once a live request has been outstanding
+        for this many seconds, or right away for domains whose live requests failed earlier in the run;
+        see fetch_url() (Default value = None)
+    :type hedge_after: float
+    :param blob_store: keep the HTML in this content-addressed store instead of in the output,
+        which references it by `resolved_text_hash`; the article text is extracted once per distinct HTML,
+        see blobstore.BlobStore (Default value = None)
+    :type blob_store: blobstore.BlobStore
+    :param refresh_from: index of a previous run's output, e.g. readers.FetchedIndex.load_or_build(path, "fetched.jsonl");
+        pages which the server reports as not modified since then reuse their previous content,
+        see request_active_url() (Default value = None)
+    :type refresh_from: readers.FetchedIndex
+    :param extract_timeout: number of seconds the extraction of one page's article text may take,
+        or None for no limit; a page which takes longer gets the `maintext_status` "timeout",
+        or "crashed" if the worker process died, see NewsContent.set_article_maintext() (Default value = None)
+    :type extract_timeout: float
+    :param extractor: how the article text is extracted: "newsplease", "fast", "auto" (fast, with NewsPlease
+        as a fallback when its text is too short), a function, or a dictionary of these by domain;
+        see extraction.select_extractor() (Default value = None)
+    :type extractor: str, function, dict
+    :param resume: skip the URLs which already have a record in the output, e.g. to restart
+        a crashed crawl; requires write_mode="a" (Default value = False)
+    :type resume: bool
+    :param resume_key: field which identifies a URL's record when resuming, either "original_url"
+        (the input's 'url') or the name of one of the key-values passed along (Default value = "original_url")
+    :type resume_key: str
+    :param retry_errors: when resuming, fetch the URLs whose last record has a fetch error again (Default value = False)
+    :type retry_errors: bool
+    :param output_format: "jsonl", or "parquet" or "arrow" for a columnar file with arrow_schema() (Default value = "jsonl")
+        - requires pyarrow unless it's "jsonl"
+        - the options below which are about shards and syncing only apply to "jsonl"
+    :type output_format: str
+    :param batch_size: number of records written to the file at a time,
+        i.e. the size of the row groups of a columnar file (Default value = 100)
+    :type batch_size: int
+    :param flush_interval: number of seconds after which buffered records are written (Default value = 10)
+    :type flush_interval: float
+    :param fsync: sync the file to disk after each batch (Default value = False)
+    :type fsync: bool
+    :param rotate_records: split the output into shards of this many records,
+        e.g. 'fetched-00000.jsonl', 'fetched-00001.jsonl', ... (Default value = None)
+    :type rotate_records: int
+    :param rotate_bytes: split the output into shards of at most this many bytes (Default value = None)
+    :type rotate_bytes: int
     :returns: None
 
     """
-
-    if isinstance(urls, dict):
-        urls = [urls]
-
-    for n, url_dict in enumerate(urls):
-        # dictionaries are mutable so work off a copy to avoid modifying the input
-        d = url_dict.copy()
-        try:
-            # Collect the value of the 'url' key if it exists and
-            # remove it from the dictionary before calling fetch_function.
-            # the remaining key-values are passed as optional kwargs.
-            url = d.pop("url")
-            LOGGER.info((f"url {n}, {fetch_function.__name__}: {url}"))
-
-            msg = f"url {n}, {fetch_function.__name__}: {url}"
-            LOGGER.info(msg)
-            if verbose:
-                print(msg)
-
-            data = fetch_function(url=url, **d)
-            with open(
-                file=os.path.join(path, filename), mode=write_mode, encoding="utf-8"
-            ) as file:
-                # https://stackoverflow.com/a/12451465
-                file.write(data + "\n")
-
-        except KeyError:
-            LOGGER.error(
-                "Fetch failed to start, please provide a 'url' key-value in the input dictionary."
-            )
+    if resume and write_mode != "a":
+        raise ValueError('resume requires write_mode="a"')
+
+    if output_format == "jsonl":
+        writer = writers.JsonlWriter(
+            path=path,
+            filename=filename,
+            write_mode=write_mode,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            fsync=fsync,
+            rotate_records=rotate_records,
+            rotate_bytes=rotate_bytes,
+        )
+        serialize = _to_json
+    else:
+        if resume:
+            raise ValueError('resume requires output_format="jsonl"')
+        writer = writers.ArrowWriter(
+            path=path,
+            filename=filename,
+            schema=arrow_schema(),
+            output_format=output_format,
+            write_mode=write_mode,
+            batch_size=batch_size,
+        )
+        serialize = _arrow_record
+    if resume:
+        # the writer has repaired the output of a crashed run, so it can be read
+        completed = _completed_keys(path, filename, resume_key, retry_errors)
+        LOGGER.info(f"Resuming with {len(completed)} URLs already fetched")
+        urls = _skip_completed(urls, completed, resume_key)
+
+    fetched = _fetch_many(
+        urls,
+        fetch_function,
+        verbose=verbose,
+        dedup_canonical=dedup_canonical,
+        n_workers=n_workers,
+        preserve_order=preserve_order,
+        n_extract_processes=n_extract_processes,
+        queue_size=queue_size,
+        defer_extraction=defer_extraction,
+        archive_backend=archive_backend,
+        hedge_after=hedge_after,
+        blob_store=blob_store,
+        refresh_from=refresh_from,
+        extract_timeout=extract_timeout,
+        extractor=extractor,
+    )
+    with writer:
+        for data in fetched:
+            writer.write(serialize(data))
 
 
-def fetch_urls(urls, fetch_function, verbose=1):
+def fetch_urls(
+    urls,
+    fetch_function,
+    verbose=1,
+    dedup_canonical=False,
+    n_workers=1,
+    preserve_order=False,
+    n_extract_processes=None,
+    queue_size=100,
+    defer_extraction=False,
+    archive_backend=None,
+    hedge_after=None,
+    blob_store=None,
+    refresh_from=None,
+    extract_timeout=None,
+    extractor=None,
+):
     """Fetch the webpage contents for one URL or multiple URLs.
 
     :param urls: URL(s) to fetch
@@ -243,99 +1107,326 @@ def fetch_urls(urls, fetch_function, verbose=1):
     :type fetch_function: function
     :param verbose: 0 - don't print progress, 1 - print progress (Default value = 1)
     :type verbose: bool
+    :param dedup_canonical: reuse the article text of pages which share a canonical URL
+        with a page fetched earlier in the run, instead of extracting it again (Default value = False)
+        - a custom fetch_function must accept the run's index as `canonical_index`, otherwise a ValueError is raised
+    :type dedup_canonical: bool
+    :param n_workers: number of threads; requests to different domains overlap,
+        while each domain gets at most one request at a time (Default value = 1)
+    :type n_workers: int
+    :param preserve_order: with n_workers > 1, yield the output in the order of the input
+        instead of the order in which the fetches finish (Default value = False)
+    :type preserve_order: bool
+    :param n_extract_processes: extract the article text in this many worker processes instead of
+        on the fetching threads, so that fetching, extraction, and serialization run at the same time (Default value = None)
+    :type n_extract_processes: int
+    :param queue_size: with n_extract_processes, the number of fetched pages which can wait for
+        their article text (Default value = 100)
+    :type queue_size: int
+    :param defer_extraction: don't extract the article text while fetching, and store the HTML
+        compressed; see extraction.extract_maintext() (Default value = False)
+    :type defer_extraction: bool
+    :param archive_backend: look up and fetch archived snapshots with this backend instead of waybackpy;
+        with request_archived_url, the lookups are batched (Default value = None)
+    :type archive_backend: archive.ArchiveBackend
+    :param hedge_after: with fetch_url, request the archive once a live request has been outstanding
+        for this many seconds, or right away for domains whose live requests failed earlier in the run;
+        see fetch_url() (Default value = None)
+    :type hedge_after: float
+    :param blob_store: keep the HTML in this content-addressed store instead of in the output,
+        which references it by `resolved_text_hash`; the article text is extracted once per distinct HTML,
+        see blobstore.BlobStore (Default value = None)
+    :type blob_store: blobstore.BlobStore
+    :param refresh_from: index of a previous run's output, e.g. readers.FetchedIndex.load_or_build(path, "fetched.jsonl");
+        pages which the server reports as not modified since then reuse their previous content,
+        see request_active_url() (Default value = None)
+    :type refresh_from: readers.FetchedIndex
+    :param extract_timeout: number of seconds the extraction of one page's article text may take,
+        or None for no limit; a page which takes longer gets the `maintext_status` "timeout",
+        or "crashed" if the worker process died, see NewsContent.set_article_maintext() (Default value = None)
+    :type extract_timeout: float
+    :param extractor: how the article text is extracted: "newsplease", "fast", "auto" (fast, with NewsPlease
+        as a fallback when its text is too short), a function, or a dictionary of these by domain;
+        see extraction.select_extractor() (Default value = None)
+    :type extractor: str, function, dict
     :returns data: fetched content as stringified JSON object
     :rtype data: Generator[str]
 
     """
+    fetched = _fetch_many(
+        urls,
+        fetch_function,
+        verbose=verbose,
+        dedup_canonical=dedup_canonical,
+        n_workers=n_workers,
+        preserve_order=preserve_order,
+        n_extract_processes=n_extract_processes,
+        queue_size=queue_size,
+        defer_extraction=defer_extraction,
+        archive_backend=archive_backend,
+        hedge_after=hedge_after,
+        blob_store=blob_store,
+        refresh_from=refresh_from,
+        extract_timeout=extract_timeout,
+        extractor=extractor,
+    )
+    for data in fetched:
+        yield _to_json(data)
+
+
+def _fetch_url(
+    url,
+    timeout=10,
+    canonical_index=None,
+    extract=True,
+    archive_backend=None,
+    hedge_after=None,
+    dead_domains=None,
+    live_requests=None,
+    blob_store=None,
+    previous=None,
+    **kwargs,
+):
+    """Fetch the URL directly or from an archive. See fetch_url().
 
-    if isinstance(urls, dict):
-        urls = [urls]
-
-    for n, url_dict in enumerate(urls):
-        # dictionaries are mutable so work off a copy to avoid modifying the input
-        d = url_dict.copy()
-        try:
-            # Collect the value of the 'url' key if it exists and
-            # remove it from the dictionary before calling fetch_function.
-            # the remaining key-values are passed as optional kwargs.
-            url = d.pop("url")
-
-            msg = f"url {n}, {fetch_function.__name__}: {url}"
-            LOGGER.info(msg)
-            if verbose:
-                print(msg)
-
-            data = fetch_function(url=url, **d)
-            yield data
-
-        except KeyError:
-            LOGGER.error(
-                "Fetch failed to start, please provide a 'url' key-value in the input dictionary."
-            )
-
-
-def fetch_url(url, timeout=10, **kwargs):
-    """Fetch the URL directly or from an archive.
-    First try to fetch the content directly from the URL domain's servers.
-    If it fails, then try to fetch the content from an archived version of the URL.
+    With ``hedge_after``, a live request which is abandoned while it's still running
+    is added to ``live_requests`` (domain -> future), see _fetch_url_hedged().
 
-    :param url: URL
-    :type url: str
-    :param timeout:  (Default value = 10)
-    :param **kwargs:
-    :returns: fetched-> fetched content as stringified JSON object
-    :rtype: str
+    :returns: fetched-> fetched content
+    :rtype: NewsContent
     """
     LOGGER.info(f"fetching URL: {url}")
 
-    active_json = request_active_url(
+    if hedge_after is not None:
+        return _fetch_url_hedged(
+            url=url,
+            timeout=timeout,
+            hedge_after=hedge_after,
+            dead_domains=dead_domains,
+            live_requests=live_requests,
+            archive_kwargs=dict(archive_backend=archive_backend),
+            active_kwargs=dict(previous=previous),
+            canonical_index=canonical_index,
+            extract=extract,
+            blob_store=blob_store,
+            **kwargs,
+        )
+
+    active = _request_active_url(
         url=url,
         timeout=timeout,
+        canonical_index=canonical_index,
+        extract=extract,
+        blob_store=blob_store,
+        previous=previous,
         **kwargs,
     )
 
-    active_data = json.loads(active_json)
-    if active_data["fetch_error"]:
-        archived_json = request_archived_url(
+    if active.fetch_error:
+        fetched = _request_archived_url(
             url=url,
+            canonical_index=canonical_index,
+            extract=extract,
+            archive_backend=archive_backend,
+            blob_store=blob_store,
             **kwargs,
         )
-
-        fetched = archived_json
         LOGGER.info(
             "Failed with request_active_url, returning fetched content from request_archived_url."
         )
 
     else:
-        fetched = active_json
+        fetched = active
         LOGGER.info("Succeeded with request_active_url, returning fetched content.")
 
     return fetched
 
 
-def request_active_url(url, timeout=10, **kwargs):
-    """Request the webpage directly from the URL domain
+def _fetch_url_hedged(
+    url,
+    timeout,
+    hedge_after,
+    dead_domains,
+    archive_kwargs,
+    active_kwargs,
+    live_requests=None,
+    **kwargs,
+):
+    """Fetch the URL directly and from an archive at the same time. See fetch_url().
+
+    The archive is requested once the live request has been outstanding for ``hedge_after`` seconds,
+    right away if the URL's domain is in ``dead_domains``, or as soon as the live request fails.
+    The first fetched content without a fetch error is returned; if neither succeeds, the archived content is.
+    The other request is cancelled: it's skipped if it hasn't been sent yet, and a live request
+    which is still running skips the extraction of the article text and returns with a fetch error.
+    Until it has finished, the live request is kept in ``live_requests`` (domain -> future),
+    so that the next request to the domain can wait for it, see _fetch_concurrently().
+
+    :returns: fetched-> fetched content
+    :rtype: NewsContent
+
+    """
+    domain = url_utils.get_domain(url)
+    cancel = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    active = None
+    try:
+        active = executor.submit(
+            _request_active_url,
+            url=url,
+            timeout=timeout,
+            cancel=cancel,
+            **active_kwargs,
+            **kwargs,
+        )
+        if dead_domains is None or domain not in dead_domains:
+            try:
+                fetched = active.result(timeout=hedge_after)
+                if not fetched.fetch_error:
+                    LOGGER.info(
+                        "Succeeded with request_active_url, returning fetched content."
+                    )
+                    return fetched
+            except concurrent.futures.TimeoutError:
+                LOGGER.info(
+                    f"request_active_url is taking longer than {hedge_after}s, starting request_archived_url."
+                )
+
+        archived = executor.submit(
+            _request_archived_url, url=url, cancel=cancel, **archive_kwargs, **kwargs
+        )
+        pending = {active, archived}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                fetched = future.result()
+                if future is active and fetched.fetch_error:
+                    if dead_domains is not None:
+                        dead_domains.add(domain)
+                elif not fetched.fetch_error:
+                    LOGGER.info(
+                        f"Succeeded with {fetched.FETCH_FUNCTION}, returning fetched content."
+                    )
+                    return fetched
+        LOGGER.info(
+            "Failed with request_active_url, returning fetched content from request_archived_url."
+        )
+        return archived.result()
+    finally:
+        cancel.set()
+        if live_requests is not None and active is not None and not active.done():
+            live_requests[domain] = active
+        # don't wait for the cancelled requests
+        executor.shutdown(wait=False)
+
+
+def fetch_url(
+    url,
+    timeout=10,
+    canonical_index=None,
+    archive_backend=None,
+    hedge_after=None,
+    dead_domains=None,
+    previous=None,
+    **kwargs,
+):
+    """Fetch the URL directly or from an archive.
+    First try to fetch the content directly from the URL domain's servers.
+    If it fails, then try to fetch the content from an archived version of the URL.
+
+    With ``hedge_after``, the archive doesn't wait for the live request to fail: it's requested
+    once the live request has been outstanding for ``hedge_after`` seconds
+    (or right away for ``dead_domains``), and whichever succeeds first is returned.
 
     :param url: URL
     :type url: str
-    :param timeout: how many seconds to wait for a response (Default value = 10)
-    :type timeout: int
+    :param timeout:  (Default value = 10)
+    :param canonical_index: article text keyed by canonical URL, see NewsContent.set_article_maintext() (Default value = None)
+    :type canonical_index: dict
+    :param archive_backend: look up and fetch the snapshot with this backend instead of waybackpy,
+        see archive.ArchiveBackend (Default value = None)
+    :type archive_backend: archive.ArchiveBackend
+    :param hedge_after: number of seconds after which the archive is requested while the live request
+        is still outstanding, or None to wait for the live request to fail (Default value = None)
+    :type hedge_after: float
+    :param dead_domains: domains whose archive is requested right away when hedging;
+        if it's a set, the domains of failed live requests are added to it (Default value = None)
+    :type dead_domains: set
+    :param previous: previous record of the URL, see request_active_url() (Default value = None)
+    :type previous: dict
     :param **kwargs:
-    :returns: fetched-> as stringified JSON object
+    :returns: fetched-> fetched content as stringified JSON object
     :rtype: str
+    """
+    fetched = _fetch_url(
+        url=url,
+        timeout=timeout,
+        canonical_index=canonical_index,
+        archive_backend=archive_backend,
+        hedge_after=hedge_after,
+        dead_domains=dead_domains,
+        previous=previous,
+        **kwargs,
+    )
+    return fetched.to_json()
+
+
+def _request_active_url(
+    url,
+    timeout=10,
+    canonical_index=None,
+    extract=True,
+    blob_store=None,
+    previous=None,
+    extract_timeout=None,
+    extractor=None,
+    cancel=None,
+    **kwargs,
+):
+    """Request the webpage directly from the URL domain. See request_active_url().
+
+    If ``extract`` is False, the article text isn't extracted, e.g. so that the pipeline
+    can extract it in another process (see _extract_in_processes()).
+    If the ``cancel`` event is set before the request is sent or before the article text is extracted,
+    the rest is skipped and the content is returned with a fetch error.
+
+    :returns: fetched-> fetched content
+    :rtype: NewsContent
 
     """
 
     fetched = NewsContent(
         original_url=url,
+        FETCH_FUNCTION="request_active_url",
         **kwargs,
     )
 
     # urlExpander.expand_with_content already includes a time delay
 
+    validators = None
+    if previous and not previous.get("fetch_error"):
+        validators = dict(
+            etag=previous.get("response_etag"),
+            last_modified=previous.get("response_last_modified"),
+        )
+
     # send the request
     LOGGER.info(f"request_active_url: {url}")
-    r = api.expand_with_content(url=url, timeout=timeout)
+    try:
+        r = api.expand_with_content(
+            url=url, timeout=timeout, validators=validators, cancel=cancel
+        )
+    except api.FetchCancelled:
+        r = None
+    if r is None or (cancel is not None and cancel.is_set()):
+        # the archived page arrived first, see _fetch_url_hedged()
+        LOGGER.info(f"Cancelled request_active_url: {url}")
+        fetched.response_code = float("nan")
+        fetched.response_reason = "FetchCancelled, archived page arrived first"
+        fetched.set_fetch_error_ind()
+        return fetched
 
     # hydrate the instance with the response info
     fetched.resolved_url = r["resolved_url"]
@@ -345,32 +1436,61 @@ def request_active_url(url, timeout=10, **kwargs):
     # fetched.response_url = r["response_url"]
     fetched.response_code = r["response_code"]
     fetched.response_reason = r["response_reason"]
+    fetched.response_etag = r.get("response_etag", "")
+    fetched.response_last_modified = r.get("response_last_modified", "")
 
     fetched.set_fetch_error_ind()
-    fetched.set_article_maintext()
+    if validators and fetched.response_code == 304:
+        LOGGER.info(f"Not modified, reusing the previous content of {url}")
+        fetched.reuse_previous(previous)
+    else:
+        fetched.set_canonical_url()
+        if extract:
+            fetched.set_article_maintext(
+                canonical_index=canonical_index,
+                blob_store=blob_store,
+                timeout=extract_timeout,
+                extractor=extractor,
+            )
     fetched.set_url_versions()
     fetched.set_generic_url_ind()
 
-    fetched_json = fetched.to_json()
-    return fetched_json
+    return fetched
 
 
-def request_archived_url(url, **kwargs):
-    """Request the oldest version of the webpage from the Internet Archive's Wayback Machine
+def request_active_url(url, timeout=10, canonical_index=None, previous=None, **kwargs):
+    """Request the webpage directly from the URL domain
 
     :param url: URL
     :type url: str
+    :param timeout: how many seconds to wait for a response (Default value = 10)
+    :type timeout: int
+    :param canonical_index: article text keyed by canonical URL, see NewsContent.set_article_maintext() (Default value = None)
+    :type canonical_index: dict
+    :param previous: previous record of the URL, e.g. from readers.FetchedIndex.get() (Default value = None)
+        - its ETag and Last-Modified validators are sent with a conditional request
+        - if the server replies 304 Not Modified, its HTML and article text are reused
+    :type previous: dict
     :param **kwargs:
     :returns: fetched-> as stringified JSON object
     :rtype: str
 
     """
+    fetched = _request_active_url(
+        url=url,
+        timeout=timeout,
+        canonical_index=canonical_index,
+        previous=previous,
+        **kwargs,
+    )
+    return fetched.to_json()
 
-    fetched = NewsContent(original_url=url, **kwargs)
 
+def _archive_lookup_url(url):
+    """Version of the URL which is looked up in the archive"""
     # canonicalize, remove common ad analytics query params, remove fragment
     # this step may help improve the archive hit rate
-    url = url_utils.standardize_url(
+    return url_utils.standardize_url(
         url=url,
         remove_scheme=False,
         replace_netloc_with_domain=False,
@@ -380,20 +1500,57 @@ def request_archived_url(url, **kwargs):
         to_lowercase=False,
     )
 
-    time.sleep(randint(constants.MIN_DELAY, constants.MAX_DELAY))
+
+def _request_archived_url(
+    url,
+    canonical_index=None,
+    extract=True,
+    archive_backend=None,
+    cancel=None,
+    blob_store=None,
+    extract_timeout=None,
+    extractor=None,
+    **kwargs,
+):
+    """Request the oldest version of the webpage from the Internet Archive's Wayback Machine. See request_archived_url().
+
+    If ``extract`` is False, the article text isn't extracted, see _request_active_url().
+    If the ``cancel`` event is set before the archive is requested, the request is skipped.
+
+    :returns: fetched-> fetched content
+    :rtype: NewsContent
+
+    """
+
+    fetched = NewsContent(
+        original_url=url, FETCH_FUNCTION="request_archived_url", **kwargs
+    )
+
+    url = _archive_lookup_url(url)
 
     try:
-        # send the request
-        LOGGER.info(f"request_archived_url: {url}")
-        wayback = waybackpy.Url(url, constants.headers["User-Agent"])
-        archive = wayback.oldest()
-        wbm_url = archive.archive_url
-        wbm_html = archive.get()
-        # fetched.response_url = wbm_url
-        # remove prefix URL from Wayback Machine
-        fetched.resolved_url = re.sub(
-            "^http(s)?:\/\/web\.archive\.org\/web\/\d+\/", "", wbm_url
-        )
+        if archive_backend is not None:
+            # the backend sleeps before each request and caches the lookups
+            LOGGER.info(f"request_archived_url: {url}")
+            _, fetched.resolved_url, wbm_html = archive_backend.get(url, cancel=cancel)
+        else:
+            with _ARCHIVE_SLOTS:
+                delay = randint(constants.MIN_DELAY, constants.MAX_DELAY)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise api.FetchCancelled(url)
+                # send the request
+                LOGGER.info(f"request_archived_url: {url}")
+                wayback = waybackpy.Url(url, constants.headers["User-Agent"])
+                snapshot = wayback.oldest()
+                wbm_url = snapshot.archive_url
+                wbm_html = snapshot.get()
+            # fetched.response_url = wbm_url
+            # remove prefix URL from Wayback Machine
+            fetched.resolved_url = re.sub(
+                "^http(s)?:\/\/web\.archive\.org\/web\/\d+\/", "", wbm_url
+            )
         fetched.resolved_domain = url_utils.get_domain(fetched.resolved_url)
         fetched.resolved_text = wbm_html
         fetched.response_code = 200
@@ -406,6 +1563,20 @@ def request_archived_url(url, **kwargs):
         fetched.response_code = float("nan")
         fetched.response_reason = msg
 
+    except api.FetchCancelled:
+        # the live page arrived first, see _fetch_url_hedged()
+        LOGGER.info(f"Cancelled request_archived_url: {url}")
+        fetched.response_code = float("nan")
+        fetched.response_reason = "FetchCancelled, live page arrived first"
+        fetched.set_fetch_error_ind()
+        return fetched
+
+    except archive.NoSnapshotError:
+        msg = "NoSnapshotError, no archived snapshot"
+        LOGGER.warning(msg)
+        fetched.response_code = float("nan")
+        fetched.response_reason = msg
+
     except URLError:
         msg = "URLError, malformed URL"
         LOGGER.warning(msg)
@@ -419,9 +1590,46 @@ def request_archived_url(url, **kwargs):
         fetched.response_reason = msg
 
     fetched.set_fetch_error_ind()
-    fetched.set_article_maintext()
+    fetched.set_canonical_url()
+    if extract:
+        fetched.set_article_maintext(
+            canonical_index=canonical_index,
+            blob_store=blob_store,
+            timeout=extract_timeout,
+            extractor=extractor,
+        )
     fetched.set_url_versions()
     fetched.set_generic_url_ind()
 
-    fetched_json = fetched.to_json()
-    return fetched_json
+    return fetched
+
+
+def request_archived_url(url, canonical_index=None, archive_backend=None, **kwargs):
+    """Request the oldest version of the webpage from the Internet Archive's Wayback Machine
+
+    :param url: URL
+    :type url: str
+    :param canonical_index: article text keyed by canonical URL, see NewsContent.set_article_maintext() (Default value = None)
+    :type canonical_index: dict
+    :param archive_backend: look up and fetch the snapshot with this backend instead of waybackpy,
+        see archive.ArchiveBackend (Default value = None)
+    :type archive_backend: archive.ArchiveBackend
+    :param **kwargs:
+    :returns: fetched-> as stringified JSON object
+    :rtype: str
+
+    """
+    fetched = _request_archived_url(
+        url=url,
+        canonical_index=canonical_index,
+        archive_backend=archive_backend,
+        **kwargs,
+    )
+    return fetched.to_json()
+
+
+_RECORD_FUNCTIONS = {
+    fetch_url: _fetch_url,
+    request_active_url: _request_active_url,
+    request_archived_url: _request_archived_url,
+}
@@ -0,0 +1,261 @@
+"""
+This module has readers for the fetched content written by fetch_urls_to_file().
+read_fetched() keeps only the requested fields of each record, and it can parse chunks of the file in parallel.
+FetchedIndex is a sidecar index of each record's offset, for random access by key.
+read_fetched_table() reads only the requested columns of a Parquet or Arrow IPC file.
+"""
+
+__all__ = ["read_fetched", "read_fetched_table", "FetchedIndex"]
+
+import json
+import logging
+import os
+
+from urlexpander.core import io_utils
+from urlexpander.extended import writers
+
+LOGGER = logging.getLogger(__name__)
+
+# suffix of the sidecar index file, e.g. 'fetched.jsonl.index'
+INDEX_SUFFIX = ".index"
+
+
+def _parse_line(line, fields, loads):
+    """Parse one line of fetched content, keeping only ``fields`` (all fields if None)"""
+    record = loads(line)
+    if fields is not None:
+        record = {field: record.get(field) for field in fields}
+    return record
+
+
+def _read_range(file, start, end, fields, parser):
+    """Parse the lines within a byte range of a file"""
+    loads = io_utils.get_json_loads(parser)
+    return [
+        _parse_line(line, fields, loads)
+        for _, line in io_utils.iter_lines(file, start, end)
+        if line.strip()
+    ]
+
+
+def read_fetched(
+    path,
+    filename,
+    fields=None,
+    n_processes=1,
+    parser="auto",
+    chunk_bytes=67108864,
+    include_partial=False,
+):
+    """Read fetched content from a .jsonl file (or its shards, see writers.list_shards()).
+
+    e.g., read_fetched(path, "fetched.jsonl", fields=["original_url", "article_maintext"])
+
+    :param path: path to the directory
+    :type path: str
+    :param filename: name of the file
+    :type filename: str
+    :param fields: names of the fields to keep, or None to keep all of them (Default value = None)
+    :type fields: list
+    :param n_processes: number of processes which parse chunks of the file in parallel (Default value = 1)
+    :type n_processes: int
+    :param parser: JSON parser, "orjson", "json", or "auto" (Default value = "auto")
+    :type parser: str
+    :param chunk_bytes: size of the chunks parsed by each process (Default value = 67108864)
+    :type chunk_bytes: int
+    :param include_partial: include the shard which is still being written (Default value = False)
+    :type include_partial: bool
+    :returns data: fetched content, in the order of the file
+    :rtype data: Generator[dict]
+
+    """
+    files = writers.list_shards(path, filename, include_partial=include_partial)
+
+    if n_processes <= 1:
+        loads = io_utils.get_json_loads(parser)
+        for file in files:
+            for _, line in io_utils.iter_lines(file):
+                if line.strip():
+                    yield _parse_line(line, fields, loads)
+        return
+
+    ranges = [
+        (file, start, end)
+        for file in files
+        for start, end in io_utils.line_ranges(file, chunk_bytes=chunk_bytes)
+    ]
+    for records in io_utils.map_in_processes(
+        _read_range,
+        ((file, start, end, fields, parser) for file, start, end in ranges),
+        n_processes=n_processes,
+    ):
+        yield from records
+
+
+def read_fetched_table(path, filename, fields=None):
+    """Read fetched content from a Parquet or Arrow IPC file written by writers.ArrowWriter.
+    Requires pyarrow.
+
+    e.g., read_fetched_table(path, "fetched.parquet", fields=["resolved_domain"]).to_pandas()
+
+    :param path: path to the directory
+    :type path: str
+    :param filename: name of the file, which is read as Parquet unless it ends with ".arrow"
+    :type filename: str
+    :param fields: names of the columns to read, or None to read all of them (Default value = None)
+        - the other columns aren't read from a Parquet file
+    :type fields: list
+    :returns: table
+    :rtype: pyarrow.Table
+
+    """
+    file = os.path.join(path, filename)
+    if filename.endswith(".arrow"):
+        import pyarrow as pa
+
+        with pa.memory_map(file) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.select(fields) if fields is not None else table
+
+    import pyarrow.parquet as pq
+
+    return pq.read_table(file, columns=fields)
+
+
+class FetchedIndex:
+    """Sidecar index of the fetched content, for random access to any record by key.
+
+    The index maps each key (e.g., `original_url`) to the file, offset, and length of its record,
+    and it's saved next to the output as '<filename>.index'. If a key appears more than once,
+    the index points to its last record.
+
+    e.g.,
+        index = FetchedIndex.load_or_build(path, "fetched.jsonl")
+        record = index.get("https://trib.al/xXI5ruM", fields=["article_maintext"])
+
+    :param files: paths of the indexed files
+    :type files: list
+    :param key: name of the field used as the key
+    :type key: str
+    :param offsets: key -> (file number, offset, length)
+    :type offsets: dict
+
+    """
+
+    def __init__(self, files, key, offsets):
+        self.files = files
+        self.key = key
+        self.offsets = offsets
+
+    @staticmethod
+    def _index_path(path, filename):
+        return os.path.join(path, filename + INDEX_SUFFIX)
+
+    @staticmethod
+    def _file_stats(files):
+        return [[os.path.basename(f), os.path.getsize(f)] for f in files]
+
+    @classmethod
+    def build(cls, path, filename, key="original_url", parser="auto", save=True):
+        """Scan the fetched content and build its index.
+
+        :param path: path to the directory
+        :type path: str
+        :param filename: name of the file
+        :type filename: str
+        :param key: name of the field used as the key (Default value = "original_url")
+        :type key: str
+        :param parser: JSON parser, see read_fetched() (Default value = "auto")
+        :type parser: str
+        :param save: save the index next to the file (Default value = True)
+        :type save: bool
+        :returns: index
+        :rtype: FetchedIndex
+
+        """
+        files = writers.list_shards(path, filename)
+        loads = io_utils.get_json_loads(parser)
+        offsets = {}
+        for file_number, file in enumerate(files):
+            for offset, line in io_utils.iter_lines(file):
+                if line.strip():
+                    value = _parse_line(line, [key], loads)[key]
+                    offsets[value] = (file_number, offset, len(line))
+        index = cls(files, key, offsets)
+
+        if save:
+            with open(cls._index_path(path, filename), "w", encoding="utf-8") as f:
+                header = dict(key=key, files=cls._file_stats(files))
+                f.write(json.dumps(header) + "\n")
+                for value, location in offsets.items():
+                    f.write(json.dumps([value, *location]) + "\n")
+        return index
+
+    @classmethod
+    def load(cls, path, filename):
+        """Load a saved index.
+
+        :param path: path to the directory
+        :type path: str
+        :param filename: name of the file
+        :type filename: str
+        :returns: index, or None if it doesn't exist or the files changed after it was built
+        :rtype: FetchedIndex, None
+
+        """
+        index_path = cls._index_path(path, filename)
+        if not os.path.exists(index_path):
+            return None
+
+        files = writers.list_shards(path, filename)
+        with open(index_path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header["files"] != cls._file_stats(files):
+                LOGGER.info(f"{index_path} is out of date")
+                return None
+            offsets = {}
+            for line in f:
+                value, *location = json.loads(line)
+                offsets[value] = tuple(location)
+        return cls(files, header["key"], offsets)
+
+    @classmethod
+    def load_or_build(cls, path, filename, key="original_url", parser="auto"):
+        """Load the saved index if it's up to date, otherwise build it.
+
+        :returns: index
+        :rtype: FetchedIndex
+
+        """
+        index = cls.load(path, filename)
+        if index is None or index.key != key:
+            index = cls.build(path, filename, key=key, parser=parser)
+        return index
+
+    def __contains__(self, value):
+        return value in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, value, fields=None, parser="auto"):
+        """Read the record of a key.
+
+        :param value: value of the key, e.g. an original URL
+        :type value: str
+        :param fields: names of the fields to keep, see read_fetched() (Default value = None)
+        :type fields: list
+        :param parser: JSON parser, see read_fetched() (Default value = "auto")
+        :type parser: str
+        :returns: record, or None if the key isn't in the index
+        :rtype: dict, None
+
+        """
+        location = self.offsets.get(value)
+        if location is None:
+            return None
+        file_number, offset, length = location
+        with open(self.files[file_number], "rb") as f:
+            f.seek(offset)
+            line = f.read(length)
+        return _parse_line(line, fields, io_utils.get_json_loads(parser))
@@ -0,0 +1,435 @@
+"""
+This module has writers for the fetched content.
+JsonlWriter keeps the output file open, writes records in batches,
+and can rotate the output into shards so that finished shards can be processed during a crawl.
+ArrowWriter writes the records in batches to a columnar Parquet or Arrow IPC file,
+so that readers can load only the columns they need.
+"""
+
+__all__ = ["JsonlWriter", "ArrowWriter", "list_shards"]
+
+import glob
+import logging
+import os
+import re
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# suffix of a shard which is still being written
+PARTIAL_SUFFIX = ".part"
+
+
+def _shard_name(filename, shard):
+    """Name of a shard, e.g. 'fetched.jsonl' -> 'fetched-00003.jsonl'"""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-{shard:05d}{ext}"
+
+
+def _truncate_incomplete_line(file):
+    """Remove an incomplete last line, e.g. left behind when a crash interrupted a write"""
+    with open(file, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        # search backwards for the last line break
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            LOGGER.warning(f"Removing an incomplete line at the end of {file}")
+            f.truncate(end)
+
+
+def list_shards(path, filename, include_partial=False):
+    """List the output files written for ``filename``, in the order they were written.
+
+    This is the file itself if the output wasn't rotated, and otherwise its shards
+    (e.g., 'fetched-00000.jsonl', 'fetched-00001.jsonl', ...).
+
+    :param path: path to the directory
+    :type path: str
+    :param filename: name of the output file
+    :type filename: str
+    :param include_partial: include the shard which is still being written (Default value = False)
+    :type include_partial: bool
+    :returns: files-> paths of the existing output files
+    :rtype: list
+
+    """
+    files = []
+    single = os.path.join(path, filename)
+    if os.path.exists(single):
+        files.append(single)
+
+    stem, ext = os.path.splitext(filename)
+    regex = re.compile(
+        re.escape(stem)
+        + r"-(\d{5,})"
+        + re.escape(ext)
+        + f"({re.escape(PARTIAL_SUFFIX)})?$"
+    )
+    shards = []
+    for file in glob.glob(os.path.join(glob.escape(path), f"{glob.escape(stem)}-*")):
+        match = regex.match(os.path.basename(file))
+        if match and (include_partial or not match.group(2)):
+            shards.append((int(match.group(1)), file))
+    files.extend(file for _, file in sorted(shards))
+    return files
+
+
+class JsonlWriter:
+    """Buffered writer for .jsonl files.
+
+    The file is kept open, and records are written in batches once ``batch_size`` records or
+    ``buffer_bytes`` bytes are buffered, or ``flush_interval`` seconds have passed since the last write to disk.
+    A background thread also writes the buffered records every ``flush_interval`` seconds,
+    so that they reach the file while no new records arrive (e.g., while the fetching stalls).
+
+    If ``rotate_records`` or ``rotate_bytes`` is set, the output is split into shards
+    (e.g., 'fetched-00000.jsonl', 'fetched-00001.jsonl', ...). The shard which is being written has
+    a '.part' suffix, which is removed once the shard is complete. See list_shards().
+
+    e.g.,
+        with JsonlWriter(path, "fetched.jsonl", rotate_records=10000) as writer:
+            for data in fetch_urls(urls, fetch_url):
+                writer.write(data)
+
+    :param path: output directory path (Default value = "")
+    :type path: str
+    :param filename: name of the output file (Default value = "fetched.jsonl")
+    :type filename: str
+    :param write_mode: "a" to append, "w" to overwrite (Default value = "a")
+    :type write_mode: str
+    :param batch_size: number of records to buffer before writing them (Default value = 100)
+    :type batch_size: int
+    :param buffer_bytes: number of bytes to buffer before writing them (Default value = 8388608)
+    :type buffer_bytes: int
+    :param flush_interval: number of seconds after which buffered records are written (Default value = 10)
+    :type flush_interval: float
+    :param fsync: sync the file to disk at every checkpoint, i.e. after each batch (Default value = False)
+    :type fsync: bool
+    :param rotate_records: start a new shard after this many records (Default value = None)
+    :type rotate_records: int
+    :param rotate_bytes: start a new shard once a shard reaches this many bytes (Default value = None)
+    :type rotate_bytes: int
+
+    """
+
+    def __init__(
+        self,
+        path="",
+        filename="fetched.jsonl",
+        write_mode="a",
+        batch_size=100,
+        buffer_bytes=8388608,
+        flush_interval=10,
+        fsync=False,
+        rotate_records=None,
+        rotate_bytes=None,
+    ):
+        self.path = path
+        self.filename = filename
+        self.write_mode = write_mode
+        self.batch_size = batch_size
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.rotate_records = rotate_records
+        self.rotate_bytes = rotate_bytes
+        self.rotate = bool(rotate_records or rotate_bytes)
+
+        self.n_records = 0
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._file_path = None
+        self._shard = 0
+        self._shard_records = 0
+        self._shard_bytes = 0
+        # the file and the buffer are shared with the flushing thread
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+        if self.rotate:
+            self._shard = self._first_shard()
+        self._open()
+        if self.flush_interval and self.flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if (
+                    self._file is not None
+                    and self._buffer
+                    and time.monotonic() - self._last_flush >= self.flush_interval
+                ):
+                    self.flush()
+                    if self.fsync:
+                        self.checkpoint()
+
+    def _first_shard(self):
+        """Number of the first shard to write, after any shards of previous runs"""
+        existing = list_shards(self.path, self.filename, include_partial=True)
+        if self.write_mode == "w":
+            for file in existing:
+                os.remove(file)
+            return 0
+
+        shard = 0
+        stem, ext = os.path.splitext(self.filename)
+        for file in existing:
+            name = os.path.basename(file)
+            if name.endswith(PARTIAL_SUFFIX):
+                # left behind by a crashed run
+                os.replace(file, file[: -len(PARTIAL_SUFFIX)])
+                _truncate_incomplete_line(file[: -len(PARTIAL_SUFFIX)])
+                name = name[: -len(PARTIAL_SUFFIX)]
+            if name != self.filename:
+                shard = max(shard, int(name[len(stem) + 1 : -len(ext) or None]) + 1)
+        return shard
+
+    def _open(self):
+        if self.rotate:
+            name = _shard_name(self.filename, self._shard) + PARTIAL_SUFFIX
+            mode = "wb"
+        else:
+            name = self.filename
+            mode = self.write_mode + "b"
+        self._file_path = os.path.join(self.path, name)
+        if mode == "ab" and os.path.exists(self._file_path):
+            # appending after an incomplete line would corrupt the next record
+            _truncate_incomplete_line(self._file_path)
+        self._file = open(self._file_path, mode)
+        self._shard_records = 0
+        self._shard_bytes = self._file.tell()
+
+    def _close_file(self):
+        self._file.close()
+        if self.rotate:
+            final_path = self._file_path[: -len(PARTIAL_SUFFIX)]
+            if self._shard_records:
+                os.replace(self._file_path, final_path)
+                LOGGER.info(f"finished shard {final_path}")
+            else:
+                os.remove(self._file_path)
+        self._file = None
+
+    def _rotate(self):
+        # a finished shard is synced to disk before it's renamed
+        self.checkpoint()
+        self._close_file()
+        self._shard += 1
+        self._open()
+
+    def write(self, data):
+        """Buffer one record, writing the buffer to disk if a threshold is reached.
+
+        :param data: stringified JSON object
+        :type data: str
+
+        """
+        line = (data + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                raise ValueError("I/O operation on closed JsonlWriter.")
+            if (
+                self.rotate
+                and self._shard_records
+                and (
+                    (self.rotate_records and self._shard_records >= self.rotate_records)
+                    or (
+                        self.rotate_bytes
+                        and self._shard_bytes + len(line) > self.rotate_bytes
+                    )
+                )
+            ):
+                self._rotate()
+
+            self._buffer.append(line)
+            self._buffered_bytes += len(line)
+            self._shard_records += 1
+            self._shard_bytes += len(line)
+            self.n_records += 1
+
+            if (
+                len(self._buffer) >= self.batch_size
+                or self._buffered_bytes >= self.buffer_bytes
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+                if self.fsync:
+                    self.checkpoint()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        with self._lock:
+            if self._buffer:
+                self._file.write(b"".join(self._buffer))
+                self._buffer.clear()
+                self._buffered_bytes = 0
+            self._file.flush()
+            self._last_flush = time.monotonic()
+
+    def checkpoint(self):
+        """Write the buffered records and sync the file to disk."""
+        with self._lock:
+            self.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Write the buffered records and close the file."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if self._file is None:
+            return
+        self.flush()
+        if self.fsync:
+            self.checkpoint()
+        self._close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArrowWriter:
+    """Buffered writer for Parquet and Arrow IPC files. Requires pyarrow.
+
+    Each batch of records is written as a row group (Parquet) or a record batch (Arrow IPC).
+    The file is written with a '.part' suffix, which is removed when the writer is closed,
+    because a Parquet file can't be read before its footer is written. If the ``with`` block
+    raises an exception, the file is left with its '.part' suffix instead of passing for a complete output.
+
+    e.g.,
+        with ArrowWriter(path, "fetched.parquet", schema=news_api.arrow_schema()) as writer:
+            for record in records:
+                writer.write(record)
+
+    :param path: output directory path (Default value = "")
+    :type path: str
+    :param filename: name of the output file (Default value = "fetched.parquet")
+    :type filename: str
+    :param schema: schema of the records; each record is a dictionary with its field names
+    :type schema: pyarrow.Schema
+    :param output_format: "parquet" or "arrow" (Default value = "parquet")
+    :type output_format: str
+    :param write_mode: "w" to overwrite, or "a", which only writes a file which doesn't exist yet
+        because these formats can't be appended to (Default value = "w")
+    :type write_mode: str
+    :param batch_size: number of records in each row group (Default value = 1000)
+    :type batch_size: int
+    :param compression: Parquet compression codec (Default value = "zstd")
+    :type compression: str
+
+    """
+
+    def __init__(
+        self,
+        path="",
+        filename="fetched.parquet",
+        schema=None,
+        output_format="parquet",
+        write_mode="w",
+        batch_size=1000,
+        compression="zstd",
+    ):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(
+                "ArrowWriter requires pyarrow, see `pip install urlexpander[arrow]`"
+            ) from None
+        if schema is None:
+            raise ValueError("ArrowWriter requires a schema")
+        if output_format not in ("parquet", "arrow"):
+            raise ValueError(f"Unknown output format: {output_format}")
+
+        self._pa = pa
+        self.schema = schema
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.n_records = 0
+        self._buffer = []
+
+        self._final_path = os.path.join(path, filename)
+        if write_mode == "a" and os.path.exists(self._final_path):
+            raise ValueError(
+                f"Can't append to {self._final_path}, use another filename or write_mode='w'"
+            )
+        self._file_path = self._final_path + PARTIAL_SUFFIX
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(
+                self._file_path, schema, compression=compression
+            )
+        else:
+            self._writer = pa.ipc.new_file(self._file_path, schema)
+
+    def write(self, record):
+        """Buffer one record, writing the buffer as a row group once it has ``batch_size`` records.
+
+        :param record: field name -> value
+        :type record: dict
+
+        """
+        if self._writer is None:
+            raise ValueError("I/O operation on closed ArrowWriter.")
+        self._buffer.append(record)
+        self.n_records += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records as a row group."""
+        if self._buffer:
+            table = self._pa.Table.from_pylist(self._buffer, schema=self.schema)
+            self._writer.write_table(table)
+            self._buffer.clear()
+
+    def close(self):
+        """Write the buffered records and finish the file."""
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.close()
+        self._writer = None
+        os.replace(self._file_path, self._final_path)
+        LOGGER.info(f"finished {self._final_path}")
+
+    def _abort(self):
+        """Close the file without writing the buffered records, leaving its '.part' suffix."""
+        if self._writer is None:
+            return
+        self._buffer.clear()
+        self._writer.close()
+        self._writer = None
+        LOGGER.warning(f"left the incomplete output in {self._file_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()